@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the piglet console application.
+
+Measures how long a run of piglet.py on a small file takes, compared with
+starting the interpreter alone, and which imports the time goes to.
+"""
+import sys
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+BUILD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIGLET = os.path.join(BUILD_DIR, "piglet.py")
+
+
+def parse_arguments():
+    """
+    Parse command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(description="Measure the startup time of piglet.py.")
+    parser.add_argument("--runs", type=int, default=30, help="Number of runs to take the median of")
+    parser.add_argument("--imports", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument(
+        "--max-overhead", type=float, metavar="MS",
+        help="Exit with 1 if piglet.py takes more than MS milliseconds longer than the bare interpreter"
+    )
+    return parser.parse_args()
+
+
+def time_command(command, runs):
+    """
+    Run a command several times and return its median wall-clock time.
+
+    Args:
+        command (list): The command and its arguments
+        runs (int): The number of runs
+
+    Returns:
+        float: The median time in milliseconds
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def slowest_imports(command, count):
+    """
+    List the top-level imports of a command that take the longest.
+
+    Args:
+        command (list): The command and its arguments, without the interpreter
+        count (int): The number of imports to list
+
+    Returns:
+        list: (cumulative time in milliseconds, module name) tuples, slowest first
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime"] + command,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only modules imported directly by the program, not by other modules
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    """
+    Run the benchmark and print the results.
+
+    Returns:
+        int: Exit code (0 for success, 1 if the overhead is above the limit)
+    """
+    args = parse_arguments()
+    with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as file:
+        file.write("The cow and the sheep are in the field.\n")
+    try:
+        command = [PIGLET, file.name]
+        # The first run writes the bytecode caches
+        time_command([sys.executable] + command, 1)
+        interpreter = time_command([sys.executable, "-c", "pass"], args.runs)
+        piglet = time_command([sys.executable] + command, args.runs)
+        print(f"interpreter:  {interpreter:7.1f} ms")
+        print(f"piglet.py:    {piglet:7.1f} ms")
+        print(f"overhead:     {piglet - interpreter:7.1f} ms")
+        print("slowest imports:")
+        for cumulative, name in slowest_imports(command, args.imports):
+            print(f"  {cumulative:7.1f} ms  {name}")
+    finally:
+        os.unlink(file.name)
+
+    if args.max_overhead is not None and piglet - interpreter > args.max_overhead:
+        print(f"Overhead is above {args.max_overhead} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
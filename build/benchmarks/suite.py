@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the piglet console application.
+
+Generates corpora of different sizes and shapes, measures the throughput,
+per-match latency and peak memory of the library and of the command-line
+tool, and the startup time of the tool. Results can be saved as a baseline
+that later runs are compared with.
+"""
+import sys
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+from startup import PIGLET, BUILD_DIR, time_command
+
+sys.path.insert(0, BUILD_DIR)
+import piglet_engine  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Larger or smaller is better for each measurement
+HIGHER_IS_BETTER = {'library_mb_s': True, 'library_bytes_mb_s': True, 'cli_mb_s': True, 'match_latency_us': False,
+                    'peak_rss_mb': False, 'startup_ms': False}
+
+_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+_FILLER_WORDS = ("the farmer walked across field near barn with old gate while rain fell on green "
+                 "hills and children played by river under tall trees").split()
+
+_SHEEP_PHRASES = ["many sheep", "a sheep", "the sheep are", "sheep and Sheep", "one sheep", "these sheep were"]
+
+
+def parse_size(value):
+    """
+    Convert a size such as 512K, 10M or 1G to a number of bytes.
+
+    Args:
+        value (str): The size, with an optional K, M or G suffix
+
+    Returns:
+        int: The number of bytes
+    """
+    value = value.strip().upper()
+    if value[-1:] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+
+def parse_arguments():
+    """
+    Parse command-line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed command-line arguments
+    """
+    parser = argparse.ArgumentParser(description="Run the piglet benchmarks.")
+    parser.add_argument("--sizes", default="1M,10M",
+                        help="Comma-separated corpus sizes, such as 64K,10M,1G (default: 1M,10M)")
+    parser.add_argument("--density", type=float, default=0.05,
+                        help="Share of the words of a synthetic corpus that are animals")
+    parser.add_argument("--sheep-share", type=float, default=0.2,
+                        help="Share of the animals of a synthetic corpus that are 'sheep' phrases")
+    parser.add_argument("--line-length", type=int, default=80,
+                        help="Approximate number of characters per line of a synthetic corpus")
+    parser.add_argument("--modes", default="default,stream,mmap,bytes",
+                        help="Comma-separated command-line modes to measure: default, stream, mmap, bytes")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times each measurement is repeated; the best one is kept")
+    parser.add_argument("--corpus-dir", help="Directory to keep the generated corpora in (default: a temporary one)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="The baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change from the baseline reported as a regression (default: 0.2)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results to PATH as JSON")
+    return parser.parse_args()
+
+
+def generate_corpus(path, size, density=0.05, sheep_share=0.2, line_length=80, seed=0):
+    """
+    Write a synthetic corpus of animals mixed with filler words.
+
+    A block of about a megabyte is generated and repeated up to the size,
+    so that even corpora of gigabytes are written quickly.
+
+    Args:
+        path (str): The file to write
+        size (int): The size of the corpus in bytes
+        density (float): The share of words that are animals
+        sheep_share (float): The share of animals that are 'sheep' in context
+        line_length (int): The approximate number of characters per line
+        seed (int): The seed of the random generator
+    """
+    generator = random.Random(seed)
+    animals = [form for pair in piglet_engine.get_barnyard_animals().items() for form in pair]
+    lines = []
+    line = []
+    block_size = 0
+    while block_size < min(size, 1024 * 1024):
+        if generator.random() >= density:
+            word = generator.choice(_FILLER_WORDS)
+        elif generator.random() < sheep_share:
+            word = generator.choice(_SHEEP_PHRASES)
+        else:
+            word = generator.choice(animals)
+            if generator.random() < 0.3:
+                word = word.capitalize() if generator.random() < 0.8 else word.upper()
+        line.append(word)
+        if sum(len(item) + 1 for item in line) >= line_length:
+            lines.append(' '.join(line) + '.\n')
+            block_size += len(lines[-1])
+            line = []
+    block = ''.join(lines).encode('utf-8')
+    with open(path, 'wb') as file:
+        for _ in range(size // len(block)):
+            file.write(block)
+        file.write(block[:size % len(block)].rsplit(b' ', 1)[0])
+
+
+def scale_sample(path, size):
+    """
+    Write a corpus made of copies of the sample text test.txt.
+
+    Args:
+        path (str): The file to write
+        size (int): The size of the corpus in bytes
+    """
+    with open(os.path.join(os.path.dirname(BUILD_DIR), "test.txt"), 'rb') as file:
+        sample = file.read()
+    with open(path, 'wb') as file:
+        for _ in range(max(size // len(sample), 1)):
+            file.write(sample)
+
+
+def run_measured(command):
+    """
+    Run a command and measure its time and peak memory.
+
+    Args:
+        command (list): The command and its arguments
+
+    Returns:
+        tuple: The wall-clock time in seconds and the peak resident set size in megabytes
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed with exit code {process.returncode}")
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return elapsed, usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def measure_library(path, repeat):
+    """
+    Measure the library on a corpus, in this process.
+
+    The text path decodes the file, calls replace_animals_with_piglet() and
+    encodes the result, as the command does by default; the bytes path calls
+    replace_animals_with_piglet_bytes() on the file's bytes.
+
+    Args:
+        path (str): The corpus
+        repeat (int): The number of runs; the fastest one is kept
+
+    Returns:
+        dict: The throughput of both paths in MB/s and the mean time per
+            match of the text path in microseconds
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    text = data.decode('utf-8')
+    pattern, _ = piglet_engine._get_animal_matcher()
+    matches = sum(1 for _ in pattern.finditer(text))
+
+    def transform_text(data):
+        return piglet_engine.replace_animals_with_piglet(data.decode('utf-8')).encode('utf-8')
+
+    best = min(_time_call(transform_text, data) for _ in range(repeat))
+    best_bytes = min(_time_call(piglet_engine.replace_animals_with_piglet_bytes, data) for _ in range(repeat))
+    return {
+        'library_mb_s': len(data) / best / 1e6,
+        'library_bytes_mb_s': len(data) / best_bytes / 1e6,
+        'match_latency_us': best / matches * 1e6 if matches else 0.0,
+    }
+
+
+def _time_call(function, *args):
+    """Return the time one call of a function takes, in seconds."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def measure_cli(path, mode, repeat):
+    """
+    Measure the command-line tool on a corpus.
+
+    Args:
+        path (str): The corpus
+        mode (str): The mode to run: default, stream, mmap or bytes
+        repeat (int): The number of runs; the fastest one is kept
+
+    Returns:
+        dict: The throughput in MB/s and the peak resident set size in megabytes
+    """
+    command = [sys.executable, PIGLET] + ([] if mode == 'default' else [f"--{mode}"]) + [path]
+    runs = [run_measured(command) for _ in range(repeat)]
+    size = os.path.getsize(path)
+    return {
+        'cli_mb_s': size / min(elapsed for elapsed, _ in runs) / 1e6,
+        'peak_rss_mb': max(rss for _, rss in runs),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find the measurements that got worse than the baseline.
+
+    Args:
+        results (dict): The measurements of this run, by case
+        baseline (dict): The stored measurements, by case
+        tolerance (float): The relative change that is accepted
+
+    Returns:
+        list: Messages describing each regression
+    """
+    regressions = []
+    for case, measurements in results.items():
+        for name, value in measurements.items():
+            reference = baseline.get(case, {}).get(name)
+            if not reference:
+                continue
+            change = (value - reference) / reference
+            if (-change if HIGHER_IS_BETTER[name] else change) > tolerance:
+                regressions.append(f"{case} {name}: {value:.2f} (baseline {reference:.2f}, {change:+.0%})")
+    return regressions
+
+
+def main():
+    """
+    Run the benchmarks and print the results.
+
+    Returns:
+        int: Exit code (0 for success, 1 if a regression was found)
+    """
+    args = parse_arguments()
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="piglet-bench-")
+    os.makedirs(corpus_dir, exist_ok=True)
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+
+    with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as file:
+        file.write("The cow and the sheep are in the field.\n")
+    try:
+        time_command([sys.executable, PIGLET, file.name], 1)
+        interpreter = time_command([sys.executable, "-c", "pass"], 10)
+        results = {'startup': {'startup_ms': time_command([sys.executable, PIGLET, file.name], 10) - interpreter}}
+    finally:
+        os.unlink(file.name)
+
+    for size_text in args.sizes.split(','):
+        size = parse_size(size_text)
+        corpora = {
+            f"sample-{size_text}": ('sample', {}),
+            f"synthetic-{size_text}": ('synthetic', {'density': args.density, 'sheep_share': args.sheep_share,
+                                                     'line_length': args.line_length}),
+        }
+        for case, (kind, options) in corpora.items():
+            path = os.path.join(corpus_dir, case + ''.join(f"-{value}" for value in options.values()) + ".txt")
+            if not os.path.exists(path):
+                if kind == 'sample':
+                    scale_sample(path, size)
+                else:
+                    generate_corpus(path, size, **options)
+            results[f"{case} library"] = measure_library(path, args.repeat)
+            for mode in modes:
+                results[f"{case} cli {mode}"] = measure_cli(path, mode, args.repeat)
+
+    for case, measurements in results.items():
+        print(f"{case:32} " + "  ".join(f"{name} {value:9.2f}" for name, value in measurements.items()))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with; run with --save-baseline to store one")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
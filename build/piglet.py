@@ -4,232 +4,933 @@ Entry point for the console application.
 """
 import sys
 import argparse
+import io
 import os
-import re
 import logging
+import stat
+import time
 
+from piglet_engine import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SHARD_SIZE,
+    TokenIndex,
+    Lexicon,
+    Stats,
+    Transformer,
+    _cached_lexicon,
+    get_barnyard_animals,
+    is_plural_context,
+    iter_animal_spans,
+    iter_replace_animals_in_bytes,
+    load_lexicon,
+    match_case,
+    matcher_fingerprint,
+    process_batch,
+    read_chunks,
+    replace_animals_with_piglet,
+    replace_animals_with_piglet_bytes,
+    replace_animals_with_piglet_cached,
+    replace_animals_with_piglet_stream,
+    write_mapped_file,
+    write_sharded_file,
+)
 
-def setup_logging():
-    """Configure logging for the application."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[logging.StreamHandler()]
-    )
-    return logging.getLogger(__name__)
+# Number of output bytes collected before they are written
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def setup_logging(stream=None):
+    """
+    Create the logger for one run of the application.
+
+    Every run gets a logger and handler of its own instead of configuring
+    the logging module, so that runs in one process neither pile up handlers
+    nor write to each other's streams. The level set on the logger of this
+    module applies, INFO if it has none.
+
+    Args:
+        stream: Where to write the messages (default: sys.stderr)
+
+    Returns:
+        logging.Logger: The logger
+    """
+    logger = logging.Logger(__name__, logging.getLogger(__name__).level or logging.INFO)
+    handler = logging.StreamHandler(sys.stderr if stream is None else stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    return logger
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """An argument parser that writes help and errors to given streams instead of sys.stdout and sys.stderr."""
+
+    def __init__(self, *args, stdout=None, stderr=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stdout = stdout
+        self._stderr = stderr
+
+    def _print_message(self, message, file=None):
+        if file is sys.stdout and self._stdout is not None:
+            file = self._stdout
+        elif file is sys.stderr and self._stderr is not None:
+            file = self._stderr
+        super()._print_message(message, file)
 
 
-def parse_arguments():
+def parse_arguments(argv=None, stdout=None, stderr=None):
     """
     Parse command-line arguments.
-    
+
+    Args:
+        argv (list): The arguments (default: sys.argv[1:])
+        stdout: Where to write the help (default: sys.stdout)
+        stderr: Where to write errors (default: sys.stderr)
+
     Returns:
         argparse.Namespace: The parsed command-line arguments
     """
-    parser = argparse.ArgumentParser(description="Process a text file.")
-    parser.add_argument("file", help="The text file to process")
-    return parser.parse_args()
+    parser = _ArgumentParser(description="Process a text file.", formatter_class=_help_formatter,
+                             stdout=stdout, stderr=stderr)
+    parser.add_argument("file", nargs="?",
+                        help="The text file to process, - for standard input, or a directory to mirror into --output-dir")
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Process the file in chunks and write the output as it is produced"
+    )
+    parser.add_argument(
+        "--mmap", action="store_true",
+        help="Memory-map the file and process its bytes without decoding them"
+    )
+    parser.add_argument(
+        "--bytes", action="store_true",
+        help="Read the file or standard input as bytes and process them without decoding them"
+    )
+    parser.add_argument(
+        "--spans", action="store_true",
+        help="Write a JSON line with the byte offset, length, animal, replacement and number of each animal "
+             "instead of the processed text"
+    )
+    parser.add_argument(
+        "--chunk-size", type=_positive_int, default=DEFAULT_CHUNK_SIZE,
+        help="Number of characters read at a time in streaming mode and from standard input"
+    )
+    parser.add_argument(
+        "--line-buffered", action="store_true",
+        help="With standard input, transform and flush each line as soon as it arrives"
+    )
+    parser.add_argument(
+        "--parallel", action="store_true",
+        help="Split the file into shards that --jobs worker processes transform at the same time"
+    )
+    parser.add_argument(
+        "--shard-size", type=_positive_int, default=DEFAULT_SHARD_SIZE,
+        help="Approximate number of bytes per shard in parallel mode"
+    )
+    parser.add_argument(
+        "--batch", nargs="+", metavar="FILE",
+        help="Process several files in parallel, along with the file if one is given"
+    )
+    parser.add_argument(
+        "--files-from", metavar="LIST",
+        help="Read the names of the files to process in batch mode from LIST, one per line"
+    )
+    parser.add_argument(
+        "--jobs", type=_positive_int, default=None,
+        help="Number of worker processes in batch and parallel mode (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--output-dir", metavar="DIR",
+        help="Write each processed file of a batch to DIR instead of stdout, or mirror a directory into DIR"
+    )
+    parser.add_argument(
+        "--output", metavar="PATH",
+        help="Write the output to PATH, which is replaced only once the output is complete"
+    )
+    parser.add_argument(
+        "--in-place", action="store_true",
+        help="Replace the file with its processed text, without the newline added on stdout"
+    )
+    parser.add_argument(
+        "--buffer-size", type=_positive_int, default=DEFAULT_BUFFER_SIZE,
+        help="Number of output bytes collected before they are written"
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Keep running and transform the file into --output, or the directory into --output-dir, on every change"
+    )
+    parser.add_argument(
+        "--watch-interval", metavar="SECONDS", type=_positive_float, default=None,
+        help="Seconds between two looks for changes in watch mode (default: 0.5)"
+    )
+    parser.add_argument(
+        "--serve", metavar="SOCKET",
+        help="Run a server that processes requests sent to the Unix socket SOCKET"
+    )
+    parser.add_argument(
+        "--socket", metavar="SOCKET", default=os.environ.get("PIGLET_SOCKET"),
+        help="Send the file to the server at SOCKET if it is running (default: $PIGLET_SOCKET)"
+    )
+    parser.add_argument(
+        "--stats", action="store_const", const="text",
+        help="Report timings, match counts and byte counts of a single-file run to stderr"
+    )
+    parser.add_argument(
+        "--stats-json", dest="stats", action="store_const", const="json",
+        help="Like --stats, but report the statistics as one line of JSON"
+    )
+    parser.add_argument(
+        "--lexicon", metavar="PATH",
+        help="Replace the animals listed in PATH (.txt/.tsv, .csv, .json, or a .pigm compiled matcher) "
+             "instead of the barnyard animals"
+    )
+    parser.add_argument(
+        "--compile-matcher", metavar="PATH",
+        help="Compile the barnyard animals, or the --lexicon, into the matcher file PATH (.pigm) and exit"
+    )
+    parser.add_argument(
+        "--paragraph-cache", metavar="PATH",
+        help="Keep the results for each paragraph in the database PATH and reuse them for unchanged paragraphs"
+    )
+    parser.add_argument(
+        "--paragraph-cache-size", metavar="SIZE", type=_size, default=None,
+        help="Evict the least recently used paragraphs above SIZE bytes, such as 512M (default: 256M)"
+    )
+    parser.add_argument(
+        "--field", metavar="NAME",
+        help="Treat the file as records and replace the animals only in the field or column NAME of each"
+    )
+    parser.add_argument(
+        "--format", choices=["jsonl", "csv"], default=None,
+        help="The format of the records for --field (default: from the file extension, else jsonl)"
+    )
+    parser.add_argument(
+        "--record-batch-size", type=_positive_int, default=None,
+        help="Number of records handed to a worker at a time with --field (default: 10000)"
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="DIR", default=os.environ.get("PIGLET_CACHE_DIR"),
+        help="Keep the output of each file in DIR and reuse it for identical input (default: $PIGLET_CACHE_DIR)"
+    )
+    parser.add_argument(
+        "--cache-size", metavar="SIZE", type=_size, default=None,
+        help="Evict the least recently used outputs above SIZE bytes, such as 512M (default: 1G)"
+    )
+    parser.add_argument(
+        "--cache-hardlink", action="store_true",
+        help="Hard-link cached outputs to --output and --output-dir files instead of copying them"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Neither use nor fill the output cache, even if --cache-dir or $PIGLET_CACHE_DIR is set"
+    )
+    args = parser.parse_args(argv)
+    if args.file is None and not args.batch and not args.files_from and not args.serve and not args.compile_matcher:
+        parser.error("the following arguments are required: file")
+    return args
+
+
+def _help_formatter(prog):
+    """
+    Create the formatter for the help text.
+
+    argparse creates one for every argument added to the parser, and by
+    default imports shutil to find the width of the terminal, which costs
+    more than processing a small file. The width is found through os instead.
+
+    Args:
+        prog (str): The name of the program
+
+    Returns:
+        argparse.HelpFormatter: The help formatter
+    """
+    try:
+        columns = int(os.environ['COLUMNS'])
+    except (KeyError, ValueError):
+        try:
+            columns = os.get_terminal_size(sys.__stdout__.fileno()).columns
+        except (AttributeError, ValueError, OSError):
+            columns = 80
+    return argparse.HelpFormatter(prog, width=max(columns, 1) - 2)
 
 
-def get_barnyard_animals():
+def _positive_int(value):
     """
-    Return a list of common barnyard animals and their plural forms.
-    
+    Convert a command-line value to a positive integer.
+
+    Args:
+        value (str): The value given on the command line
+
     Returns:
-        dict: Dictionary mapping singular forms to plural forms
-    """
-    animals = {
-        'pig': 'pigs',
-        'cow': 'cows',
-        'chicken': 'chickens',
-        'rooster': 'roosters',
-        'hen': 'hens',
-        'duck': 'ducks',
-        'goose': 'geese',
-        'sheep': 'sheep',
-        'lamb': 'lambs',
-        'goat': 'goats',
-        'horse': 'horses',
-        'donkey': 'donkeys',
-        'mule': 'mules',
-        'turkey': 'turkeys',
-        'rabbit': 'rabbits'
-    }
-    return animals
-
-
-def is_plural_context(text, match):
-    """
-    Determine if a word is being used in a plural context based on surrounding words.
-    
-    Args:
-        text (str): The full text being processed
-        match: The regex match object for the word
-    
+        int: The converted value
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def _positive_float(value):
+    """
+    Convert a command-line value to a positive number of seconds.
+
+    Args:
+        value (str): The value given on the command line
+
     Returns:
-        bool: True if the word is being used in a plural context, False otherwise
-    """
-    # Get the position of the match
-    start = match.start()
-    end = match.end()
-    
-    # Get the word itself
-    word = match.group(0).lower()
-    
-    # Special handling for capitalized versions in patterns like "sheep and Sheep"
-    if word == "sheep" and match.group(0)[0].isupper():
-        # Check if this is part of a pattern like "sheep and Sheep"
-        before_context = text[:start].lower().strip()
-        if before_context.endswith("sheep and") or before_context.endswith("sheep,"):
-            # This is likely a capitalized version in a list, treat as singular
-            return False
-    
-    # Check for specific phrases that indicate singular context
-    full_text = text.lower()
-    match_pos = match.start()
-    if "sheep and sheep" in full_text and match_pos == full_text.find("sheep and sheep"):
-        return False
-    
-    # Get a larger context before and after the match
-    before_text = text[:start].strip().split()[-6:] if start > 0 else []
-    after_text = text[end:].strip().split()[:5] if end < len(text) else []
-    
-    # Articles and determiners that typically precede singular nouns
-    singular_indicators = [
-        'a', 'an', 'one', 'this', 'that', 'each', 'every', 'is', 'was', 
-        'the', 'my', 'your', 'his', 'her', 'its', 'our', 'their', 'another'
-    ]
-    
-    # Check for singular indicators before the word
-    for word_index, word_before in enumerate(before_text):
-        if word_before.lower() in singular_indicators:
-            # If the singular indicator is immediately before the word or separated by adjectives
-            if word_index >= len(before_text) - 3:
-                return False
-    
-    # Words that typically precede plural nouns
-    plural_indicators = [
-        'many', 'several', 'few', 'some', 'these', 'those', 'are', 'were',
-        'multiple', 'various', 'numerous', 'all', 'both', 'many', 'most', 'other',
-        'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten'
-    ]
-    
-    # Check for plural indicators before the word
-    for word_before in before_text:
-        if word_before.lower() in plural_indicators:
-            return True
-    
-    # Check if the word is followed by a plural verb form or other plural indicators
-    if len(after_text) > 0:
-        # Check for plural verb forms
-        if after_text[0].lower() in ['are', 'were', 'seem', 'seemed', 'appear', 'appeared']:
-            return True
-
-    # Special handling for "sheep" which is often misidentified
-    if word.lower() == 'sheep':
-        # Look for specific context clues for plural sheep
-        # Check if it's part of a phrase like "sheep and Sheep" which indicates singular usage
-        if len(before_text) > 0 and before_text[-1].lower() in ['and', 'or', 'both']:
-            return False
-        if len(after_text) > 0 and after_text[0].lower() in ['and', 'or', 'both']:
-            # Special case for "other sheep" which should be treated as plural
-            if len(before_text) > 0 and before_text[-1].lower() == 'other':
-                return True
-            
-            return False
-        for word_before in before_text:
-            if word_before.lower() in ['many', 'several', 'these', 'those', 'are', 'were', 'some']:
-                return True
-        # Default to singular for sheep unless clear plural indicators are present
-        return False
-
-    # Default to singular if no plural context is detected
-    return False
-def replace_animals_with_piglet(text):
-    """
-    Replace all occurrences of barnyard animals with 'piglet' or 'piglets',
-    preserving the original capitalization.
-    
-    Args:
-        text (str): The input text to process
-    
+        float: The converted value
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a number")
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def _size(value):
+    """
+    Convert a command-line size such as 4096, 64K, 512M or 2G to bytes.
+
+    Args:
+        value (str): The size given on the command line
+
     Returns:
-        str: The processed text with animal names replaced
-    """
-    animals = get_barnyard_animals()
-    
-    # Process the text
-    for singular, plural in animals.items():
-        # Create patterns that match the word boundaries and preserve capitalization
-        singular_pattern = re.compile(r'\b' + singular + r'\b', re.IGNORECASE)
-        plural_pattern = re.compile(r'\b' + plural + r'\b', re.IGNORECASE)
-        
-        # Replace with appropriate case-matched version
-        def match_case(match, replacement, is_plural=False):
-            word = match.group(0)
-            if is_plural:
-                replacement = 'piglets'
-            
-            if word.isupper():
-                return replacement.upper()
-            elif word[0].isupper():
-                return replacement.capitalize()
+        int: The number of bytes
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = value.strip().upper()
+    try:
+        number = int(float(text[:-1]) * units[text[-1]]) if text[-1:] in units else int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a size")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive size")
+    return number
+
+
+def _option(args, name, default=None):
+    """
+    Return an optional setting from the parsed command-line arguments.
+
+    Callers of main() may pass a namespace that only sets the file name.
+
+    Args:
+        args: The parsed command-line arguments
+        name (str): The name of the setting
+        default: The value used if the setting is missing
+
+    Returns:
+        The value of the setting
+    """
+    return vars(args).get(name, default)
+
+
+def _batch_paths(args):
+    """
+    Collect the files of a batch from the command-line arguments.
+
+    Args:
+        args: The parsed command-line arguments
+
+    Returns:
+        list: The files to process in order, or None if no batch was requested
+    """
+    batch = _option(args, 'batch')
+    files_from = _option(args, 'files_from')
+    if not batch and not files_from:
+        return None
+    paths = list(batch or [])
+    if _option(args, 'file') is not None:
+        paths.insert(0, args.file)
+    if files_from:
+        with open(files_from, 'r', encoding='utf-8') as file:
+            paths.extend(line.rstrip('\r\n') for line in file if line.strip())
+    return paths
+
+
+def _result_cache(args):
+    """
+    Open the output cache chosen on the command line.
+
+    Args:
+        args: The parsed command-line arguments
+
+    Returns:
+        piglet_cache.ResultCache: The cache, or None if no cache is used
+    """
+    directory = _option(args, 'cache_dir')
+    if not directory or _option(args, 'no_cache'):
+        return None
+    # Imported here, as most runs do not use a cache
+    import piglet_cache
+    max_size = _option(args, 'cache_size') or piglet_cache.DEFAULT_RESULT_CACHE_SIZE
+    return piglet_cache.ResultCache(directory, max_size, _option(args, 'cache_hardlink', False))
+
+
+class _BufferedOutput:
+    """
+    Collect output bytes and write them to a stream in large blocks.
+
+    Text is encoded as UTF-8. If the stream is a text stream, such as a
+    replacement of sys.stdout without a binary buffer, the blocks are decoded
+    again. The blocks are also written to copy, a binary file, if one is
+    given. With a Stats, the bytes written and the time spent writing them
+    are added to it.
+    """
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE, stats=None, copy=None):
+        self._stream = stream
+        self._copy = copy
+        self._is_text = isinstance(stream, io.TextIOBase)
+        self._buffer_size = buffer_size
+        self._stats = stats
+        self._pieces = []
+        self._size = 0
+
+    def write(self, data):
+        """
+        Add output, writing the collected output once it fills the buffer.
+
+        Args:
+            data (bytes or str): The output to add
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'surrogateescape')
+        self._pieces.append(data)
+        self._size += len(data)
+        if self._size >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the collected output to the stream and flush it."""
+        start = time.perf_counter()
+        data = b''.join(self._pieces)
+        self._pieces = []
+        self._size = 0
+        if data:
+            self._stream.write(data.decode('utf-8', 'surrogateescape') if self._is_text else data)
+            if self._copy is not None:
+                self._copy.write(data)
+        self._stream.flush()
+        if self._stats is not None:
+            self._stats.add_time('write', time.perf_counter() - start)
+            self._stats.bytes_out += len(data)
+
+
+class _AtomicFile:
+    """
+    A file written under a temporary name and renamed into place when complete.
+
+    Readers of the path see either its old content or the complete new one,
+    never a partly written file.
+    """
+
+    def __init__(self, path):
+        """
+        Create the temporary file next to the path.
+
+        Args:
+            path (str): The file to write
+        """
+        self.path = path
+        directory, name = os.path.split(os.path.abspath(path))
+        self._temp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        self.file = open(self._temp_path, 'xb')
+
+    def commit(self):
+        """Make the written content durable and move it to the path."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            status = None
+        # A replaced file keeps its permissions, unless it is linked to a
+        # read-only entry of the result cache, or was left read-only by one
+        if status is not None and status.st_nlink == 1 and status.st_mode & stat.S_IWUSR:
+            os.chmod(self._temp_path, status.st_mode & 0o7777)
+        os.replace(self._temp_path, self.path)
+
+    def discard(self):
+        """Remove the temporary file, leaving the path as it was."""
+        self.file.close()
+        try:
+            os.unlink(self._temp_path)
+        except OSError:
+            pass
+
+
+def _timed_chunks(chunks, stats, count_bytes=False):
+    """
+    Pass chunks through, adding the time spent reading them to a Stats.
+
+    Args:
+        chunks (iterable): The chunks being read
+        stats (Stats): The statistics to add to, or None
+        count_bytes (bool): Whether to add the UTF-8 size of the chunks to
+            the bytes read, for input whose size is not known in advance
+
+    Yields:
+        str: The chunks
+    """
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if stats is not None:
+            stats.add_time('read', time.perf_counter() - start)
+            if count_bytes and chunk is not None:
+                stats.bytes_in += len(chunk.encode('utf-8', 'surrogateescape'))
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _report_stats(stats, style, stream):
+    """
+    Write the statistics of a run.
+
+    Args:
+        stats (Stats): The statistics
+        style (str): 'text' for a readable report, 'json' for one line of JSON
+        stream: Where to write them
+    """
+    if style == 'json':
+        import json
+        stream.write(json.dumps(stats.as_dict()) + '\n')
+    else:
+        stream.write("Statistics:\n" + stats.format() + '\n')
+
+
+def _read_stdin_bytes(stdin, stats=None):
+    """
+    Read all of standard input as bytes.
+
+    Args:
+        stdin: The text stream to read, from its binary buffer if it has one
+        stats (Stats): Collects the time spent reading and the bytes read, or None
+
+    Returns:
+        bytes: The input
+    """
+    start = time.perf_counter()
+    buffer = getattr(stdin, 'buffer', None)
+    data = stdin.read().encode('utf-8', 'surrogateescape') if buffer is None else buffer.read()
+    if stats is not None:
+        stats.add_time('read', time.perf_counter() - start)
+        stats.bytes_in += len(data)
+    return data
+
+
+def _process_stdin(args, output, stdin, stats=None):
+    """
+    Transform standard input and write the result.
+
+    Args:
+        args: The parsed command-line arguments
+        output (_BufferedOutput): Where to write the result
+        stdin: The text stream to read
+        stats (Stats): Collects the timings and counts of the run, or None
+
+    Returns:
+        int: Exit code (0 at the end of the input, 130 if interrupted)
+    """
+    if _option(args, 'bytes') and not _option(args, 'line_buffered'):
+        # Match the animals in the bytes and copy the rest as it is
+        output.write(replace_animals_with_piglet_bytes(_read_stdin_bytes(stdin, stats), stats))
+        return 0
+    lexicon_path = _option(args, 'lexicon')
+    transformer = Transformer(load_lexicon(lexicon_path) if lexicon_path else None)
+    if _option(args, 'line_buffered'):
+        # Each line is rewritten on its own and written at once, so the
+        # delay never depends on the lines that follow it
+        try:
+            for line in _timed_chunks(iter(stdin.readline, ''), stats, count_bytes=True):
+                output.write(transformer.transform(line, stats))
+                output.flush()
+        except KeyboardInterrupt:
+            return 130
+        return 0
+    # Read large blocks of lines and write the output as it is ready
+    chunk_size = _option(args, 'chunk_size', DEFAULT_CHUNK_SIZE)
+    chunks = _timed_chunks(read_chunks(stdin, chunk_size), stats, count_bytes=True)
+    for processed_chunk in transformer.transform_iter(chunks, stats):
+        output.write(processed_chunk)
+    return 0
+
+
+def _process_records(args, output, logger, stdin):
+    """
+    Transform a field in every record of the file or of standard input.
+
+    Args:
+        args: The parsed command-line arguments
+        output (_BufferedOutput): Where to write the records
+        logger: The logger for messages
+        stdin: The text stream to read for -
+    """
+    # Imported here, as most runs do not process records
+    import piglet_records
+    record_format = _option(args, 'format')
+    if record_format is None:
+        record_format = (args.file != '-' and piglet_records.guess_format(args.file)) or 'jsonl'
+    jobs = _option(args, 'jobs') or os.cpu_count() or 1
+    batch_size = _option(args, 'record_batch_size') or piglet_records.DEFAULT_RECORD_BATCH_SIZE
+    if args.file == '-':
+        # Line endings inside CSV values must reach the reader untranslated
+        buffer = getattr(stdin, 'buffer', None)
+        source = stdin if buffer is None else io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+        try:
+            count = piglet_records.transform_records(source, output, args.field, record_format, jobs, batch_size,
+                                                     _option(args, 'lexicon'))
+        finally:
+            if buffer is not None:
+                # Leave standard input open
+                source.detach()
+    else:
+        with open(args.file, 'r', encoding='utf-8', newline='') as source:
+            count = piglet_records.transform_records(source, output, args.field, record_format, jobs, batch_size,
+                                                     _option(args, 'lexicon'))
+    logger.info(f"Processed {count} records")
+
+
+def _process_spans(args, output, stats, stdin):
+    """
+    Write one JSON line for each animal of the file or of standard input.
+
+    The input is matched as bytes, a file through a memory map, and is never
+    rewritten: only the matches are written, with their byte offset and
+    length, the animal, its replacement and whether it was taken as plural.
+
+    Args:
+        args: The parsed command-line arguments
+        output (_BufferedOutput): Where to write the lines
+        stats (Stats): Collects the timings and counts of the run, or None
+        stdin: The text stream to read for -
+    """
+    # Imported here, as most runs do not need them
+    import json
+    import mmap
+    lexicon_path = _option(args, 'lexicon')
+    lexicon = _cached_lexicon(lexicon_path) if lexicon_path else None
+
+    def write_spans(data):
+        quote = json.encoder.encode_basestring
+        lines = []
+        for offset, length, word, replacement, is_plural in iter_animal_spans(data, lexicon, stats):
+            lines.append(f'{{"offset": {offset}, "length": {length}, "original": {quote(word)}, '
+                         f'"replacement": "{replacement}", "plural": {"true" if is_plural else "false"}}}\n')
+            if len(lines) >= 4096:
+                output.write(''.join(lines))
+                lines = []
+        output.write(''.join(lines))
+
+    if args.file == '-':
+        write_spans(_read_stdin_bytes(stdin, stats))
+        return
+    with open(args.file, 'rb') as file:
+        # An empty file cannot be mapped, and has no animals
+        if os.fstat(file.fileno()).st_size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                write_spans(data)
+
+
+def _process_file(args, output, stats, logger):
+    """
+    Transform a file in the mode chosen on the command line and write the result.
+
+    Args:
+        args: The parsed command-line arguments
+        output (_BufferedOutput): Where to write the result
+        stats (Stats): Collects the timings and counts of the run, or None
+        logger: The logger for messages
+    """
+    if _option(args, 'parallel'):
+        # Transform the shards in worker processes and write them in order
+        write_sharded_file(args.file, output, _option(args, 'jobs'),
+                           _option(args, 'shard_size', DEFAULT_SHARD_SIZE), stats)
+    elif _option(args, 'mmap'):
+        # Write the processed bytes without decoding them
+        write_mapped_file(args.file, output, stats)
+    elif _option(args, 'bytes'):
+        # Match the animals in the bytes and copy the rest as it is
+        start = time.perf_counter()
+        with open(args.file, 'rb') as file:
+            data = file.read()
+        if stats is not None:
+            stats.add_time('read', time.perf_counter() - start)
+        output.write(replace_animals_with_piglet_bytes(data, stats))
+    elif _option(args, 'stream'):
+        # Write each processed chunk as soon as it is ready
+        chunk_size = _option(args, 'chunk_size', DEFAULT_CHUNK_SIZE)
+        with open(args.file, 'r', encoding='utf-8') as file:
+            chunks = _timed_chunks(read_chunks(file, chunk_size), stats)
+            for processed_chunk in replace_animals_with_piglet_stream(chunks, stats):
+                output.write(processed_chunk)
+    else:
+        processed_content = None
+        lexicon_path = _option(args, 'lexicon')
+        paragraph_cache = _option(args, 'paragraph_cache')
+        if _option(args, 'socket') and not lexicon_path and not paragraph_cache and stats is None:
+            # Let a running server do the work, if there is one; it does not
+            # collect statistics
+            import piglet_server
+            try:
+                processed_content = piglet_server.request_server(args.socket, path=os.path.abspath(args.file))
+            except OSError as e:
+                logger.debug(f"Server not available, processing locally: {e}")
+            except RuntimeError as e:
+                # The server may not be able to read the file, though this process can
+                logger.debug(f"Server failed, processing locally: {e}")
+
+        if processed_content is None:
+            # Read the file content
+            start = time.perf_counter()
+            with open(args.file, 'r', encoding='utf-8') as file:
+                content = file.read()
+            if stats is not None:
+                stats.add_time('read', time.perf_counter() - start)
+
+            # Replace animal names with piglet/piglets
+            lexicon = _cached_lexicon(lexicon_path) if lexicon_path else None
+            if paragraph_cache:
+                import piglet_cache
+                max_size = _option(args, 'paragraph_cache_size') or piglet_cache.DEFAULT_CACHE_SIZE
+                with piglet_cache.ParagraphCache(paragraph_cache, max_size) as cache:
+                    processed_content = replace_animals_with_piglet_cached(content, cache, lexicon, stats)
             else:
-                return replacement
-        
-        # Special handling for words with same singular and plural form
-        if singular == plural:
-            def replace_with_context(match):
-                is_plural = is_plural_context(text, match)
-                return match_case(match, 'piglet', is_plural)
-            
-            text = singular_pattern.sub(replace_with_context, text)
-            # Skip the regular processing for this animal since we've handled it
-            continue
-        
-        # Regular processing for animals with different singular and plural forms
-        text = singular_pattern.sub(lambda m: match_case(m, 'piglet'), text)
-        text = plural_pattern.sub(lambda m: match_case(m, 'piglet', True), text)
-    
-    return text
+                processed_content = replace_animals_with_piglet(content, lexicon, stats)
+
+        output.write(processed_content)
 
 
-def main(args=None):
+def main(args=None, stdin=None, stdout=None, stderr=None):
     """
     Main entry point for the application.
-    
+
+    main() keeps no state between calls and only uses the streams it is
+    given, so it can be called many times in one process, like running the
+    command each time.
+
     Args:
-        args: Command-line arguments (if None, they will be parsed from sys.argv)
-    
+        args: Command-line arguments, as a list of strings or as parsed
+            arguments (if None, they will be parsed from sys.argv)
+        stdin: The text stream read for - (default: sys.stdin)
+        stdout: The stream the output is written to, binary or text (default: sys.stdout)
+        stderr: The text stream for messages (default: sys.stderr)
+
     Returns:
         int: Exit code (0 for success, non-zero for errors)
     """
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
     try:
-        logger = setup_logging()
+        logger = setup_logging(stderr)
         logger.debug("Application started")
-        
+
         # Parse command-line arguments
-        args = parse_arguments() if args is None else args
+        if args is None or isinstance(args, (list, tuple)):
+            try:
+                args = parse_arguments(args, stdout, stderr)
+            except SystemExit as e:
+                # Invalid arguments or --help
+                return e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+
+        if _option(args, 'compile_matcher'):
+            # Imported here, as only the build step needs it
+            import piglet_matcher
+            fingerprint = piglet_matcher.compile_matcher(args.compile_matcher, _option(args, 'lexicon'))
+            logger.info(f"Compiled matcher {fingerprint} into {args.compile_matcher}")
+            return 0
+
+        if _option(args, 'lexicon') and any(_option(args, name)
+                                            for name in ['stream', 'mmap', 'bytes', 'parallel', 'serve']):
+            logger.error("--lexicon cannot be combined with --stream, --mmap, --bytes, --parallel or --serve")
+            return 1
+
+        if _option(args, 'lexicon'):
+            # Reject a stale compiled matcher or a broken lexicon before any output is written
+            try:
+                _cached_lexicon(args.lexicon)
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot use the lexicon {args.lexicon}: {e}")
+                return 1
+
+        if _option(args, 'spans') and any(_option(args, name) for name in
+                                          ['stream', 'mmap', 'bytes', 'parallel', 'field', 'in_place',
+                                           'paragraph_cache', 'line_buffered', 'watch', 'batch', 'files_from']):
+            logger.error("--spans cannot be combined with --stream, --mmap, --bytes, --parallel, --field, --in-place, "
+                         "--paragraph-cache, --line-buffered, --watch, --batch or --files-from")
+            return 1
+
+        if _option(args, 'paragraph_cache') and (any(_option(args, name) for name in
+                                                     ['stream', 'mmap', 'bytes', 'parallel', 'batch', 'files_from'])
+                                                 or _option(args, 'file') == '-'):
+            logger.error("--paragraph-cache cannot be combined with --stream, --mmap, --bytes, --parallel, --batch, "
+                         "--files-from or standard input")
+            return 1
+
+        if _option(args, 'field') and (any(_option(args, name) for name in
+                                           ['stream', 'mmap', 'bytes', 'parallel', 'paragraph_cache', 'stats',
+                                            'batch', 'files_from'])):
+            logger.error("--field cannot be combined with --stream, --mmap, --bytes, --parallel, --paragraph-cache, "
+                         "--stats, --batch or --files-from")
+            return 1
+
+        if _option(args, 'serve'):
+            import piglet_server
+            piglet_server.serve(args.serve, logger)
+            return 0
+
+        if _option(args, 'watch'):
+            is_directory = os.path.isdir(args.file)
+            output = _option(args, 'output_dir' if is_directory else 'output')
+            if args.file == '-' or not output:
+                logger.error("--watch needs a file with --output or a directory with --output-dir")
+                return 1
+            if any(_option(args, name) for name in ['stream', 'mmap', 'bytes', 'parallel', 'field', 'in_place',
+                                                    'paragraph_cache', 'stats', 'batch', 'files_from']):
+                logger.error("--watch cannot be combined with --stream, --mmap, --bytes, --parallel, --field, "
+                             "--in-place, --paragraph-cache, --stats, --batch or --files-from")
+                return 1
+            # Imported here, as most runs do not watch
+            import piglet_watch
+            interval = _option(args, 'watch_interval') or piglet_watch.DEFAULT_INTERVAL
+            failures = piglet_watch.watch(args.file, output, logger, _option(args, 'lexicon'), _option(args, 'jobs'),
+                                          interval)
+            return 1 if failures else 0
+
+        is_batch = _option(args, 'batch') or _option(args, 'files_from')
+        if is_batch and any(_option(args, name) for name in ['in_place', 'output']):
+            logger.error("--batch and --files-from cannot be combined with --in-place or --output; "
+                         "use --output-dir to write the results to files")
+            return 1
+
+        paths = _batch_paths(args)
+        if paths is not None:
+            # Results are encoded like the output of a single file, whether stdout is binary or text
+            stdout.flush()
+            output = _BufferedOutput(getattr(stdout, 'buffer', stdout),
+                                     _option(args, 'buffer_size', DEFAULT_BUFFER_SIZE))
+            try:
+                failures = process_batch(paths, _option(args, 'output_dir'), _option(args, 'jobs'), logger,
+                                         _option(args, 'lexicon'), _result_cache(args), output)
+            finally:
+                output.flush()
+            return 1 if failures else 0
         
-        # Validate that the file exists
-        if not os.path.isfile(args.file):
+        if args.file != '-' and os.path.isdir(args.file):
+            if not _option(args, 'output_dir'):
+                logger.error("Processing a directory needs --output-dir to mirror it into")
+                return 1
+            if any(_option(args, name) for name in ['stream', 'mmap', 'bytes', 'parallel', 'field', 'in_place',
+                                                    'output', 'paragraph_cache', 'stats', 'spans']):
+                logger.error("A directory cannot be processed with --stream, --mmap, --bytes, --parallel, --field, "
+                             "--in-place, --output, --paragraph-cache, --stats or --spans")
+                return 1
+            # Imported here, as most runs do not process directories
+            import piglet_tree
+            failures = piglet_tree.process_tree(args.file, args.output_dir, _option(args, 'jobs'), logger,
+                                                _option(args, 'lexicon'))
+            return 1 if failures else 0
+
+        in_place = _option(args, 'in_place')
+        if args.file == '-':
+            if any(_option(args, name) for name in ['mmap', 'parallel', 'in_place']):
+                logger.error("Standard input cannot be processed with --mmap, --parallel or --in-place")
+                return 1
+        elif not os.path.isfile(args.file):
+            # Validate that the file exists
             logger.error(f"File not found: {args.file}")
             return 1
 
         logger.info(f"Processing file: {args.file}")
 
-        # Read the file content
-        with open(args.file, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        # Replace animal names with piglet/piglets
-        processed_content = replace_animals_with_piglet(content)
-        
-        # Output the processed content to stdout
-        print(processed_content)
+        stats = Stats() if _option(args, 'stats') else None
+        if stats is not None:
+            stats.timings.update(read=0.0, transform=0.0, write=0.0)
+            if args.file != '-':
+                stats.bytes_in = os.path.getsize(args.file)
+        started = time.perf_counter()
+
+        output_path = args.file if in_place else _option(args, 'output')
+        # Statistics describe a transformation, a file processed in place
+        # lacks the newline the cached outputs end with, and the key of an
+        # output does not cover the field of records or the span mode
+        cache = None if (args.file == '-' or in_place or stats is not None or _option(args, 'field')
+                         or _option(args, 'spans')) else _result_cache(args)
+        entry_file = None
+        if cache is not None:
+            lexicon_path = _option(args, 'lexicon')
+            lexicon = _cached_lexicon(lexicon_path) if lexicon_path else None
+            # The byte modes keep line endings and invalid UTF-8 that the text modes translate or reject
+            flavour = 'bytes' if any(_option(args, name) for name in ['mmap', 'bytes', 'parallel']) else 'text'
+            key = cache.key(args.file, matcher_fingerprint(lexicon), flavour)
+            entry = cache.lookup(key)
+            if entry is not None:
+                logger.debug(f"Using the cached output for {args.file}")
+                if output_path:
+                    cache.copy_to(entry, output_path)
+                else:
+                    stdout.flush()
+                    stream = getattr(stdout, 'buffer', stdout)
+                    output = _BufferedOutput(stream, _option(args, 'buffer_size', DEFAULT_BUFFER_SIZE))
+                    cache.write_to(entry, output)
+                    output.flush()
+                logger.debug("Application completed successfully")
+                return 0
+            entry_file = cache.create()
+
+        if output_path:
+            target = _AtomicFile(output_path)
+            stream = target.file
+        else:
+            target = None
+            stdout.flush()
+            stream = getattr(stdout, 'buffer', stdout)
+        output = _BufferedOutput(stream, _option(args, 'buffer_size', DEFAULT_BUFFER_SIZE), stats, entry_file)
+        try:
+            if _option(args, 'field'):
+                _process_records(args, output, logger, stdin)
+                result = 0
+            elif _option(args, 'spans'):
+                _process_spans(args, output, stats, stdin)
+                result = 0
+            elif args.file == '-':
+                result = _process_stdin(args, output, stdin, stats)
+            else:
+                _process_file(args, output, stats, logger)
+                result = 0
+            # Lines written as they arrive are complete already, a file
+            # processed in place and records keep their own ending, and spans
+            # are complete lines
+            line_buffered = args.file == '-' and _option(args, 'line_buffered')
+            if not in_place and not _option(args, 'field') and not _option(args, 'spans') and not line_buffered:
+                output.write(b'\n')
+            output.flush()
+        except BaseException:
+            if target is not None:
+                target.discard()
+            if entry_file is not None:
+                cache.discard(entry_file)
+            raise
+        if target is not None:
+            target.commit()
+        if entry_file is not None:
+            cache.store(key, entry_file)
+            cache.evict()
+
+        if stats is not None:
+            # Whatever was not spent reading or writing went to the transformation
+            elapsed = time.perf_counter() - started
+            stats.add_time('transform', elapsed - stats.timings['read'] - stats.timings['write'])
+            _report_stats(stats, args.stats, stderr)
         
         logger.debug("Application completed successfully")
-        return 0
+        return result
     except Exception as e:
         # If logger is not defined (e.g., setup_logging failed), use root logger
         try:
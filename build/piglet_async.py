@@ -0,0 +1,127 @@
+"""
+Asyncio interface for the piglet console application.
+
+Small payloads are transformed on the event loop, where that is cheaper than
+a thread switch. Payloads of at least DEFAULT_OFFLOAD_THRESHOLD characters or
+bytes are transformed in an executor, so that other tasks keep running.
+"""
+import asyncio
+import codecs
+
+from piglet_engine import DEFAULT_CHUNK_SIZE, Transformer, _StreamRewriter
+
+DEFAULT_OFFLOAD_THRESHOLD = 64 * 1024
+
+
+async def _run(size, executor, threshold, function, *args):
+    """
+    Call a function on the loop, or in an executor if it has much to process.
+
+    Args:
+        size (int): The length of the text the function processes
+        executor (concurrent.futures.Executor): The executor, or None for the
+            default executor of the loop
+        threshold (int): The length from which the call is offloaded
+        function (callable): The function to call
+        *args: Its arguments
+
+    Returns:
+        The result of the function
+    """
+    if size < threshold:
+        return function(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+async def _read_chunks(source, chunk_size):
+    """
+    Iterate over the chunks of a stream reader or an async iterator.
+
+    Args:
+        source: An asyncio.StreamReader, or any object with an async read(n)
+            method, or an async iterator of chunks
+        chunk_size (int): The number of bytes to read at a time from a reader
+
+    Yields:
+        str or bytes: The consecutive chunks
+    """
+    if hasattr(source, 'read'):
+        while True:
+            chunk = await source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+
+async def transform(data, transformer=None, executor=None, threshold=DEFAULT_OFFLOAD_THRESHOLD, stats=None):
+    """
+    Replace the animals in a text without blocking the event loop.
+
+    Args:
+        data (str or bytes): The text, or UTF-8 encoded bytes
+        transformer (Transformer): The transformer to use; the barnyard animals if omitted
+        executor (concurrent.futures.Executor): Where large texts are processed;
+            the default executor of the loop if omitted
+        threshold (int): The length from which the work is done in the executor
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Returns:
+        str or bytes: The processed text, of the same type as data
+    """
+    transformer = Transformer() if transformer is None else transformer
+    if isinstance(data, (bytes, bytearray)):
+        return await _run(len(data), executor, threshold, transformer.transform_bytes, data, stats)
+    return await _run(len(data), executor, threshold, transformer.transform, data, stats)
+
+
+async def transform_stream(source, transformer=None, executor=None, threshold=DEFAULT_OFFLOAD_THRESHOLD,
+                           chunk_size=DEFAULT_CHUNK_SIZE, stats=None):
+    """
+    Replace the animals in a text that arrives asynchronously in chunks.
+
+    Output is yielded as soon as enough of the text has been seen, as with
+    replace_animals_with_piglet_stream(). Bytes are decoded as UTF-8 and the
+    output is encoded again, leaving invalid bytes as they are. With a
+    lexicon, the whole text is collected and transformed at the end.
+
+    Args:
+        source: An asyncio.StreamReader, or an async iterator of str or bytes chunks
+        transformer (Transformer): The transformer to use; the barnyard animals if omitted
+        executor (concurrent.futures.Executor): Where large chunks are processed;
+            the default executor of the loop if omitted
+        threshold (int): The chunk length from which the work is done in the executor
+        chunk_size (int): The number of bytes to read at a time from a StreamReader
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Yields:
+        str or bytes: The consecutive pieces of the processed text, of the
+            same type as the chunks
+    """
+    transformer = Transformer() if transformer is None else transformer
+    if transformer.lexicon is not None:
+        chunks = [chunk async for chunk in _read_chunks(source, chunk_size)]
+        if chunks:
+            data = (b'' if isinstance(chunks[0], (bytes, bytearray)) else '').join(chunks)
+            yield await transform(data, transformer, executor, threshold, stats)
+        return
+
+    stream = _StreamRewriter(stats)
+    decoder = None
+    async for chunk in _read_chunks(source, chunk_size):
+        if isinstance(chunk, (bytes, bytearray)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')('surrogateescape')
+            chunk = decoder.decode(chunk)
+        processed_chunk = await _run(len(chunk), executor, threshold, stream.feed, chunk)
+        if processed_chunk:
+            yield processed_chunk if decoder is None else processed_chunk.encode('utf-8', 'surrogateescape')
+    if decoder is not None:
+        # The bytes of an incomplete character at the end are kept as they are
+        stream.feed(decoder.decode(b'', True))
+    # The text held back for context is rewritten when the stream is closed
+    processed_chunk = await _run(stream.buffered, executor, threshold, stream.close)
+    if processed_chunk:
+        yield processed_chunk if decoder is None else processed_chunk.encode('utf-8', 'surrogateescape')
@@ -0,0 +1,317 @@
+"""
+On-disk caches for the piglet console application.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+DEFAULT_RESULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# Number of bytes hashed or copied at a time
+_BLOCK_SIZE = 1024 * 1024
+
+# SQLite limits the number of parameters of a statement
+_BATCH_SIZE = 500
+
+# The file in a result cache directory holding the estimated size of its entries
+_SIZE_FILE = 'size'
+
+
+class ParagraphCache:
+    """
+    Results for paragraphs, stored in an SQLite database.
+
+    Used with replace_animals_with_piglet_cached(). Entries are kept in order
+    of their last use, and the least recently used ones are evicted once the
+    stored results take more than max_size bytes. Several processes can share
+    one database.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Open the database, creating it if needed.
+
+        Args:
+            path (str): The database file
+            max_size (int): The number of bytes of results to keep at most
+        """
+        self.path = path
+        self.max_size = max_size
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS paragraphs "
+                             "(key BLOB PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, used INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS paragraphs_used ON paragraphs (used)")
+
+    def get_many(self, keys):
+        """
+        Look up results, marking the ones found as used.
+
+        Args:
+            keys (list): The keys to look up, as bytes
+
+        Returns:
+            dict: The results found, by key
+        """
+        found = {}
+        for i in range(0, len(keys), _BATCH_SIZE):
+            batch = list(set(keys[i:i + _BATCH_SIZE]))
+            rows = self._db.execute(
+                f"SELECT key, value FROM paragraphs WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update((key, value.decode('utf-8', 'surrogatepass')) for key, value in rows)
+        if found:
+            now = time.time_ns()
+            with self._db:
+                self._db.executemany("UPDATE paragraphs SET used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_many(self, items):
+        """
+        Store results, evicting the least recently used ones if the cache is full.
+
+        Args:
+            items (dict): The results to store, by key
+        """
+        now = time.time_ns()
+        rows = []
+        for key, value in items.items():
+            data = value.encode('utf-8', 'surrogatepass')
+            rows.append((key, data, len(key) + len(data), now))
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO paragraphs VALUES (?, ?, ?, ?)", rows)
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used results until the rest fit in max_size."""
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM paragraphs").fetchone()
+        excess = total - self.max_size
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM paragraphs ORDER BY used"):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM paragraphs WHERE key = ?", evicted)
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def _copy_file(source, destination):
+    """Copy a file's content to a new writable file."""
+    # Imported here, as it is slow to import and only cache hits need it
+    import shutil
+    shutil.copyfile(source, destination)
+
+
+class ResultCache:
+    """
+    Outputs of whole files, stored as files in a directory.
+
+    Entries are named by a hash of the input bytes and the fingerprint of the
+    matcher, so a changed file, engine or lexicon never hits an old entry. A
+    hit is copied to its destination, or hard-linked if hardlink is set.
+    Entries are read-only, so that writing to a linked output fails instead of
+    changing the cache. The least recently used entries are evicted once the
+    cache holds more than max_size bytes. Several processes can share one
+    directory.
+
+    The size of the entries is kept as a running estimate, so that a store
+    does not look at every entry. Stores that race may each miss the other's
+    size, which only delays eviction; every eviction pass counts the entries
+    again and corrects the estimate.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_RESULT_CACHE_SIZE, hardlink=False):
+        """
+        Create the directory if needed.
+
+        Args:
+            directory (str): The directory holding the entries
+            max_size (int): The number of bytes of entries to keep at most
+            hardlink (bool): Whether hits are hard-linked instead of copied
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hardlink = hardlink
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, fingerprint, flavour='text'):
+        """
+        Compute the key of the output for a file.
+
+        Args:
+            path (str): The input file
+            fingerprint (str): The fingerprint of the matcher, from matcher_fingerprint()
+            flavour (str): 'text' for the modes that decode the file and
+                translate newlines, 'bytes' for those that copy the bytes
+                between the animals unchanged
+
+        Returns:
+            str: The key, as hexadecimal digits
+        """
+        digest = hashlib.blake2b(f"{fingerprint}\0{flavour}".encode('ascii'), digest_size=20)
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        """Return the file of an entry, spread over subdirectories by its first digits."""
+        return os.path.join(self.directory, key[:2], key)
+
+    def lookup(self, key):
+        """
+        Find an entry, marking it as used.
+
+        Args:
+            key (str): The key of the entry
+
+        Returns:
+            str: The file holding the output, or None if there is no entry
+        """
+        path = self._entry_path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def create(self):
+        """
+        Start a new entry.
+
+        Returns:
+            file: A binary file to write the output to, passed to store() or discard() when done
+        """
+        # Imported here, as the cache is only opened when it is used
+        import tempfile
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix='.', suffix='.tmp', delete=False)
+
+    def store(self, key, file):
+        """
+        Add a completely written entry, replacing any entry with the same key.
+
+        Args:
+            key (str): The key of the entry
+            file (file): The file returned by create()
+        """
+        file.close()
+        os.chmod(file.name, 0o444)
+        size = os.path.getsize(file.name)
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(file.name, path)
+        estimate = self._read_size()
+        if estimate is not None:
+            self._write_size(estimate + size)
+
+    def _read_size(self):
+        """Return the estimated size of the entries, or None if it is not known."""
+        try:
+            with open(os.path.join(self.directory, _SIZE_FILE), 'r', encoding='ascii') as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_size(self, size):
+        """Record the estimated size of the entries, replacing the file at once."""
+        path = os.path.join(self.directory, _SIZE_FILE)
+        temporary = os.path.join(self.directory, f".{_SIZE_FILE}.{os.getpid()}.tmp")
+        with open(temporary, 'w', encoding='ascii') as file:
+            file.write(str(size))
+        os.replace(temporary, path)
+
+    def discard(self, file):
+        """
+        Drop an entry that could not be completed.
+
+        Args:
+            file (file): The file returned by create()
+        """
+        file.close()
+        try:
+            os.unlink(file.name)
+        except FileNotFoundError:
+            pass
+
+    def copy_to(self, entry, destination):
+        """
+        Copy or hard-link an entry to a file, replacing the file at once.
+
+        Args:
+            entry (str): The file of the entry, from lookup()
+            destination (str): The file to write
+        """
+        directory, name = os.path.split(os.path.abspath(destination))
+        temporary = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        try:
+            if self.hardlink:
+                try:
+                    os.link(entry, temporary)
+                except OSError:
+                    # Another file system, or one without hard links
+                    _copy_file(entry, temporary)
+            else:
+                _copy_file(entry, temporary)
+            os.replace(temporary, destination)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def write_to(self, entry, stream):
+        """
+        Write an entry to a binary stream.
+
+        Args:
+            entry (str): The file of the entry, from lookup()
+            stream: The stream to write to
+        """
+        with open(entry, 'rb') as file:
+            for block in iter(lambda: file.read(_BLOCK_SIZE), b''):
+                stream.write(block)
+
+    def evict(self):
+        """Remove the least recently used entries until the rest fit in max_size."""
+        estimate = self._read_size()
+        if estimate is not None and estimate <= self.max_size:
+            return
+        entries = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(subdirectory.path):
+                try:
+                    status = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                entries.append((status.st_mtime_ns, status.st_size, entry.path))
+        excess = sum(size for _, size, _ in entries) - self.max_size
+        for _, size, path in sorted(entries):
+            if excess <= 0:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            excess -= size
+        self._write_size(excess + self.max_size)
@@ -0,0 +1,1886 @@
+"""
+Text transformation engine for the piglet console application.
+"""
+import bisect
+import codecs
+import collections
+import functools
+import itertools
+import mmap
+import os
+import re
+import time
+from array import array
+
+
+def get_barnyard_animals():
+    """
+    Return a list of common barnyard animals and their plural forms.
+    
+    Returns:
+        dict: Dictionary mapping singular forms to plural forms
+    """
+    animals = {
+        'pig': 'pigs',
+        'cow': 'cows',
+        'chicken': 'chickens',
+        'rooster': 'roosters',
+        'hen': 'hens',
+        'duck': 'ducks',
+        'goose': 'geese',
+        'sheep': 'sheep',
+        'lamb': 'lambs',
+        'goat': 'goats',
+        'horse': 'horses',
+        'donkey': 'donkeys',
+        'mule': 'mules',
+        'turkey': 'turkeys',
+        'rabbit': 'rabbits'
+    }
+    return animals
+
+
+# Articles and determiners that typically precede singular nouns
+SINGULAR_INDICATORS = frozenset([
+    'a', 'an', 'one', 'this', 'that', 'each', 'every', 'is', 'was',
+    'the', 'my', 'your', 'his', 'her', 'its', 'our', 'their', 'another'
+])
+
+# Words that typically precede plural nouns
+PLURAL_INDICATORS = frozenset([
+    'many', 'several', 'few', 'some', 'these', 'those', 'are', 'were',
+    'multiple', 'various', 'numerous', 'all', 'both', 'most', 'other',
+    'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten'
+])
+
+# Verb forms that typically follow plural nouns
+PLURAL_VERBS = frozenset(['are', 'were', 'seem', 'seemed', 'appear', 'appeared'])
+
+# Conjunctions that put "sheep" in a list of single animals
+SHEEP_CONJUNCTIONS = frozenset(['and', 'or', 'both'])
+
+# Number of words before a match that are taken into account
+WORDS_BEFORE = 6
+
+# Longer words cannot be any of the indicator words above
+_MAX_INDICATOR_LENGTH = max(
+    len(word) for word in SINGULAR_INDICATORS | PLURAL_INDICATORS | PLURAL_VERBS | SHEEP_CONJUNCTIONS
+)
+
+_TOKEN_PATTERN = re.compile(r'\S+')
+_TOKEN_START_PATTERN = re.compile(r'(?<!\S)\S')
+
+
+def _indicator_form(text, start, end):
+    """
+    Return the lowercase form of text[start:end] for comparison with the indicator words.
+
+    Args:
+        text (str): The text
+        start (int): The offset of the token
+        end (int): The offset just after the token
+
+    Returns:
+        str: The lowercase token, or an empty string if it is too long to be
+            an indicator word
+    """
+    return text[start:end].lower() if end - start <= _MAX_INDICATOR_LENGTH else ''
+
+
+class TokenIndex:
+    """
+    Offsets and lowercase forms of the whitespace-separated tokens of a text.
+
+    Tokens are indexed lazily from left to right, and long stretches of text
+    before a lookup are skipped, so looking up the words around a match takes
+    amortized constant time instead of splitting the whole text again.
+    """
+
+    # Unindexed text longer than this before a lookup is skipped
+    SKIP_DISTANCE = 256
+
+    def __init__(self, text):
+        """
+        Args:
+            text (str): The text to index
+        """
+        self.text = text
+        self._reset(0)
+
+    def _reset(self, position):
+        """Drop the index and restart it at the token starting at position."""
+        self._starts = array('q')
+        self._ends = array('q')
+        self._forms = []
+        self._first = position
+        self._indexed_to = position
+        self._cursor = 0
+
+    def _index_to(self, position):
+        """Index the tokens up to the first one that ends after position."""
+        text = self.text
+        while self._indexed_to <= position:
+            token = _TOKEN_PATTERN.search(text, self._indexed_to)
+            if token is None:
+                self._indexed_to = len(text) + 1
+                break
+            start, end = token.span()
+            self._starts.append(start)
+            self._ends.append(end)
+            self._forms.append(_indicator_form(text, start, end))
+            self._indexed_to = end
+
+    def _skip_to(self, position):
+        """Restart the index shortly before position if enough words fit in between."""
+        distance = 64
+        while distance < position - self._indexed_to:
+            restart = _TOKEN_START_PATTERN.search(self.text, position - distance, position)
+            if restart is not None:
+                window = _TOKEN_PATTERN.findall(self.text, restart.start(), position)
+                if len(window) > WORDS_BEFORE:
+                    self._reset(restart.start())
+                    return
+            distance *= 4
+
+    def _seek(self, position):
+        """
+        Return the index of the first token that ends after position.
+
+        Args:
+            position (int): An offset in the text
+
+        Returns:
+            int: The token index; equal to the number of indexed tokens if no
+                token ends after position
+        """
+        if position < self._first:
+            self._reset(0)
+        elif position - self._indexed_to > self.SKIP_DISTANCE:
+            self._skip_to(position)
+        self._index_to(position)
+
+        ends = self._ends
+        cursor = self._cursor
+        if cursor > 0 and ends[cursor - 1] > position:
+            cursor = bisect.bisect_right(ends, position)
+        while cursor < len(ends) and ends[cursor] <= position:
+            cursor += 1
+        self._cursor = cursor
+        return cursor
+
+    def _tokens_before(self, position, count):
+        """Return the range of indexes of the last count tokens of text[:position]."""
+        last = self._seek(position)
+        if last < len(self._starts) and self._starts[last] < position:
+            last += 1
+        if last < count and self._first > 0:
+            self._reset(0)
+            return self._tokens_before(position, count)
+        return max(last - count, 0), last
+
+    def words_before(self, position, count=WORDS_BEFORE):
+        """
+        Return the last tokens of text[:position], like text[:position].split()[-count:].
+
+        Args:
+            position (int): The end of the prefix
+            count (int): The maximum number of tokens
+
+        Returns:
+            list: The tokens in the form returned by _indicator_form()
+        """
+        first, last = self._tokens_before(position, count)
+        words = self._forms[first:last]
+        if words and self._ends[last - 1] > position:
+            words[-1] = _indicator_form(self.text, self._starts[last - 1], position)
+        return words
+
+    def word_after(self, position):
+        """
+        Return the first token of text[position:], like text[position:].split()[0].
+
+        Args:
+            position (int): The start of the suffix
+
+        Returns:
+            str: The token in the form returned by _indicator_form(), or None
+                if there is none
+        """
+        i = self._seek(position)
+        if i == len(self._starts):
+            return None
+        if self._starts[i] >= position:
+            return self._forms[i]
+        return _indicator_form(self.text, position, self._ends[i])
+
+    def stripped_end(self, position):
+        """
+        Return the length of text[:position].rstrip().
+
+        Args:
+            position (int): The end of the prefix
+
+        Returns:
+            int: The offset just after the last non-whitespace character
+        """
+        first, last = self._tokens_before(position, 1)
+        return min(self._ends[last - 1], position) if last > first else 0
+
+
+_SHEEP_AND_SHEEP_PATTERN = re.compile(r'[sS][hH][eE][eE][pP] [aA][nN][dD] [sS][hH][eE][eE][pP]')
+
+# The only character that str.lower() turns into two characters
+_DOTTED_CAPITAL_I = 'İ'
+
+
+class _SheepAndSheepRule:
+    """
+    Find the match that the "sheep and sheep" rule treats as singular.
+
+    The rule compares the offset of a match with
+    text.lower().find("sheep and sheep"). When the animals were replaced one
+    after another, both offsets were taken in the partially rewritten text,
+    so they moved with every replacement of an earlier animal, and lower()
+    lengthened each 'İ' before the phrase. This class tracks those shifts so
+    that a single pass makes the same decisions.
+    """
+
+    def __init__(self):
+        self.position = None
+        self._searched_to = 0
+        self._dotted_seen = 0
+        self._lengthened = 0
+        # The number of 'İ' in replaced words before the phrase, by rank,
+        # and the words that may turn out to be before or after it
+        self._dotted_counts = {}
+        self._dotted_pending = []
+        self._shifts = None
+
+    @property
+    def tracks_shifts(self):
+        """bool: Whether replacements after the phrase must be reported."""
+        return self._shifts is not None
+
+    def locate(self, text, start=0, stop=None, offset=0):
+        """
+        Search text[start:stop] for the first "sheep and sheep".
+
+        The phrase may extend past stop. Regions must be searched in order.
+
+        Args:
+            text (str): The text, or a buffer holding part of it
+            start (int): Where to start searching in text
+            stop (int): Where the phrase must start before; the end of text if omitted
+            offset (int): The offset of text within the whole text
+
+        Returns:
+            bool: True if the phrase has been found
+        """
+        if self.position is not None:
+            return True
+        stop = len(text) if stop is None else stop
+        start = max(start, self._searched_to - offset)
+        if start >= stop:
+            return False
+        phrase = _SHEEP_AND_SHEEP_PATTERN.search(text, start, stop + 14)
+        if phrase is None or phrase.start() >= stop:
+            self._dotted_seen += text.count(_DOTTED_CAPITAL_I, start, stop)
+            self._searched_to = offset + stop
+            self._count_pending(self._searched_to)
+            return False
+        self.position = offset + phrase.start()
+        self._lengthened = self._dotted_seen + text.count(_DOTTED_CAPITAL_I, start, phrase.start())
+        if self._lengthened:
+            self._shifts = {}
+        self._count_pending(self.position)
+        self._dotted_pending = []
+        return True
+
+    def _count_pending(self, before):
+        """Count the pending words with 'İ' that start before an offset."""
+        pending = []
+        for start, rank, count in self._dotted_pending:
+            if start < before:
+                self._dotted_counts[rank] = self._dotted_counts.get(rank, 0) + count
+            else:
+                pending.append((start, rank, count))
+        self._dotted_pending = pending
+
+    def note_dotted(self, start, rank, word):
+        """
+        Record a replaced word that contains 'İ'.
+
+        Args:
+            start (int): The offset of the word
+            rank (int): The position of its animal in the replacement order
+            word (str): The replaced word
+        """
+        count = word.count(_DOTTED_CAPITAL_I)
+        if not count:
+            return
+        # A phrase found later starts after everything searched so far
+        before = self._searched_to if self.position is None else self.position
+        if start < before:
+            self._dotted_counts[rank] = self._dotted_counts.get(rank, 0) + count
+        elif self.position is None:
+            self._dotted_pending.append((start, rank, count))
+
+    def note_shift(self, rank, shift):
+        """
+        Record the length change of a replacement after the phrase.
+
+        Args:
+            rank (int): The position of the animal in the replacement order
+            shift (int): Length of the replacement minus length of the word
+        """
+        self._shifts[rank] = self._shifts.get(rank, 0) + shift
+
+    def applies_to(self, start, rank):
+        """
+        Check whether the rule treats an ambiguous match as singular.
+
+        All replacements before the match must have been recorded.
+
+        Args:
+            start (int): The offset of the match
+            rank (int): The position of its animal in the replacement order
+
+        Returns:
+            bool: True if the match is at the legacy "sheep and sheep" offset
+        """
+        if self.position is None or start < self.position:
+            return False
+        lengthened = self._lengthened - sum(
+            count for word_rank, count in self._dotted_counts.items() if word_rank < rank
+        )
+        if not lengthened:
+            return start == self.position
+        shift = sum(value for shift_rank, value in self._shifts.items() if shift_rank < rank)
+        return start - self.position + shift == lengthened
+
+
+def is_plural_context(text, match, index=None, first_sheep_and_sheep=None):
+    """
+    Determine if a word is being used in a plural context based on surrounding words.
+    
+    Args:
+        text (str): The full text being processed
+        match: The regex match object for the word
+        index (TokenIndex): The token index of text; built if omitted
+        first_sheep_and_sheep (bool): Whether the match is at the offset of the
+            first "sheep and sheep"; computed from text if omitted
+    
+    Returns:
+        bool: True if the word is being used in a plural context, False otherwise
+    """
+    if index is None:
+        index = TokenIndex(text)
+    if first_sheep_and_sheep is None:
+        first_sheep_and_sheep = match.start() == text.lower().find("sheep and sheep")
+    return _is_plural_at(index, match.start(), match.end(), match.group(0), first_sheep_and_sheep)[0]
+
+
+def _is_plural_at(index, start, end, matched, first_sheep_and_sheep):
+    """
+    Decide whether the word at text[start:end] is used in a plural context.
+
+    Also names the rule that made the decision, for statistics.
+
+    Args:
+        index (TokenIndex): The token index of the text
+        start (int): The offset of the word
+        end (int): The offset just after the word
+        matched (str): The word as it appears in the text
+        first_sheep_and_sheep (bool): Whether the word is at the offset of the
+            first "sheep and sheep"
+
+    Returns:
+        tuple: True if the word is being used in a plural context, False
+            otherwise, and the name of the deciding rule
+    """
+    text = index.text
+    word = matched.lower()
+    
+    # Special handling for capitalized versions in patterns like "sheep and Sheep"
+    if word == "sheep" and matched[0].isupper():
+        # Check if this is part of a pattern like "sheep and Sheep"
+        before_end = index.stripped_end(start)
+        if (text[max(before_end - 9, 0):before_end].lower() == "sheep and"
+                or text[max(before_end - 6, 0):before_end].lower() == "sheep,"):
+            # This is likely a capitalized version in a list, treat as singular
+            return False, 'capitalized-in-list'
+    
+    # Check for specific phrases that indicate singular context
+    if first_sheep_and_sheep:
+        return False, 'first-sheep-and-sheep'
+    
+    # Get a larger context before and after the match
+    before_text = index.words_before(start)
+    after_word = index.word_after(end)
+    
+    # Check for singular indicators before the word
+    for word_index, word_before in enumerate(before_text):
+        if word_before in SINGULAR_INDICATORS:
+            # If the singular indicator is immediately before the word or separated by adjectives
+            if word_index >= len(before_text) - 3:
+                return False, 'singular-indicator'
+    
+    # Check for plural indicators before the word
+    for word_before in before_text:
+        if word_before in PLURAL_INDICATORS:
+            return True, 'plural-indicator'
+    
+    # Check if the word is followed by a plural verb form
+    if after_word in PLURAL_VERBS:
+        return True, 'plural-verb'
+
+    # Special handling for "sheep" which is often misidentified
+    if word == 'sheep':
+        # Check if it's part of a phrase like "sheep and Sheep" which indicates singular usage
+        if before_text and before_text[-1] in SHEEP_CONJUNCTIONS:
+            return False, 'sheep-conjunction'
+        if after_word in SHEEP_CONJUNCTIONS:
+            return False, 'sheep-conjunction'
+        # Default to singular for sheep unless clear plural indicators are present
+        return False, 'default'
+
+    # Default to singular if no plural context is detected
+    return False, 'default'
+
+
+def _build_word_trie_pattern(words):
+    """
+    Build a regular expression source that matches any of the given words.
+
+    The words are factored into a prefix trie so that the regex engine never
+    has to retry a shared prefix once per word.
+
+    Args:
+        words (iterable): The lowercase words to match
+
+    Returns:
+        str: The regular expression source (without word boundaries)
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def to_regex(node):
+        is_word_end = '' in node
+        branches = [re.escape(char) + to_regex(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        source = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + source + ')?' if is_word_end else source
+
+    return to_regex(trie)
+
+
+# Non-ASCII characters that re.IGNORECASE treats as equal to an ASCII letter.
+_IGNORECASE_FOLDS = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
+_IGNORECASE_FOLDS_PATTERN = re.compile('[\u0130\u0131\u017f\u212a]')
+
+
+def _animal_key(word):
+    """
+    Normalize a matched animal word to the lowercase form used as lookup key.
+
+    Args:
+        word (str): The word as it appears in the text
+
+    Returns:
+        str: The lowercase ASCII spelling of the word
+    """
+    if not word.isascii():
+        word = word.translate(_IGNORECASE_FOLDS)
+    return word.lower()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_animal_matcher():
+    """
+    Compile the single matcher for every singular and plural animal name.
+
+    The matcher is built once per process and shared by all calls.
+
+    Returns:
+        tuple: The compiled pattern and a dictionary mapping each lowercase
+            form to the position of its animal in get_barnyard_animals() and
+            to True (plural), False (singular) or None (ambiguous)
+    """
+    forms = {}
+    for rank, (singular, plural) in enumerate(get_barnyard_animals().items()):
+        forms[plural] = (rank, True)
+        forms[singular] = (rank, None if singular == plural else False)
+
+    first_letters = ''.join(sorted({form[0] for form in forms}))
+    pattern = re.compile(
+        r'(?=[' + first_letters + r'])\b' + _build_word_trie_pattern(forms) + r'\b',
+        re.IGNORECASE
+    )
+    return pattern, forms
+
+
+def match_case(word, replacement):
+    """
+    Apply the capitalization pattern of a word to its replacement.
+
+    Args:
+        word (str): The original word
+        replacement (str): The lowercase replacement
+
+    Returns:
+        str: The replacement in upper case, capitalized or lower case
+    """
+    if word.isupper():
+        return replacement.upper()
+    elif word[0].isupper():
+        return replacement.capitalize()
+    else:
+        return replacement
+
+
+class Stats:
+    """
+    Timings and counters collected while texts are processed.
+
+    Pass an instance as the stats argument of the replace functions to have
+    it filled in. One instance can collect any number of calls.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.animals = {}
+        self.rules = collections.Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def timer(self, phase):
+        """
+        Return a context manager that adds the time spent in it to a phase.
+
+        Args:
+            phase (str): The name of the phase, such as 'read' or 'write'
+
+        Returns:
+            The context manager
+        """
+        return _PhaseTimer(self, phase)
+
+    def add_time(self, phase, seconds):
+        """Add time spent in a phase."""
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def count_match(self, animal, is_plural):
+        """Count a replaced animal, by its singular form."""
+        counts = self.animals.setdefault(animal, [0, 0])
+        counts[bool(is_plural)] += 1
+
+    def count_rule(self, rule):
+        """Count a decision of the plural context rules, by the deciding rule."""
+        self.rules[rule] += 1
+
+    def merge(self, other):
+        """Add the timings and counters of another Stats."""
+        for phase, seconds in other.timings.items():
+            self.add_time(phase, seconds)
+        for animal, (singular, plural) in other.animals.items():
+            counts = self.animals.setdefault(animal, [0, 0])
+            counts[0] += singular
+            counts[1] += plural
+        self.rules.update(other.rules)
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+
+    def as_dict(self):
+        """
+        Return the statistics as plain data, ready for JSON.
+
+        Returns:
+            dict: The timings in seconds, the byte counts, the singular and
+                plural counts of each animal, and the decisions of each rule
+        """
+        return {
+            'timings': dict(self.timings),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'animals': {animal: {'singular': singular, 'plural': plural}
+                        for animal, (singular, plural) in self.animals.items()},
+            'context_decisions': sum(self.rules.values()),
+            'rules': dict(self.rules),
+        }
+
+    def format(self):
+        """
+        Return the statistics as a human-readable report.
+
+        Returns:
+            str: The report, one item per line
+        """
+        lines = [f"{phase}: {seconds:.3f} s" for phase, seconds in self.timings.items()]
+        lines.append(f"bytes in: {self.bytes_in}, bytes out: {self.bytes_out}")
+        for animal, (singular, plural) in self.animals.items():
+            lines.append(f"{animal}: {singular} singular, {plural} plural")
+        lines.append(f"decided by context: {sum(self.rules.values())}")
+        for rule, count in self.rules.most_common():
+            lines.append(f"  {rule}: {count}")
+        return '\n'.join(lines)
+
+
+class _PhaseTimer:
+    """Context manager that adds the time spent in it to a phase of a Stats."""
+
+    def __init__(self, stats, phase):
+        self._stats = stats
+        self._phase = phase
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stats.add_time(self._phase, time.perf_counter() - self._start)
+        return False
+
+
+class _Rewriter:
+    """
+    Replace the animals in consecutive regions of a text.
+
+    Keeps the state that carries over from one region to the next, so that a
+    text rewritten region by region gives the same result as in one go.
+    """
+
+    def __init__(self, stats=None):
+        self._pattern, self._forms = _get_animal_matcher()
+        self._rule = _SheepAndSheepRule()
+        self._stats = stats
+        # The names are only needed to count the matches
+        self._names = list(get_barnyard_animals()) if stats is not None else None
+
+    def replacements(self, text, start=0, stop=None, offset=0, whole_text=False):
+        """
+        Find the animals in text[start:stop] and decide their replacements.
+
+        Regions must be passed in order and must start and end next to
+        whitespace. The rest of text is context for ambiguous words: it must
+        hold at least WORDS_BEFORE words before start, and the first complete
+        word and 14 more characters after stop, unless the text ends there.
+
+        Args:
+            text (str): The text, or a buffer holding part of it
+            start (int): The start of the region in text
+            stop (int): The end of the region in text; the end of text if omitted
+            offset (int): The offset of text within the whole text
+            whole_text (bool): Whether text is the whole text
+
+        Yields:
+            tuple: The match object and its replacement
+        """
+        stop = len(text) if stop is None else stop
+        pattern = self._pattern
+        forms = self._forms
+        rule = self._rule
+        stats = self._stats
+        index = None
+        if not whole_text:
+            rule.locate(text, start, stop, offset)
+
+        for match in pattern.finditer(text, start, stop):
+            word = match.group(0)
+            position = offset + match.start()
+            rank, is_plural = forms[_animal_key(word)]
+            # Words with the same singular and plural form depend on their context
+            if is_plural is None:
+                if rule.position is None and whole_text and rule.locate(text) and rule.tracks_shifts:
+                    # Catch up with the replacements between the phrase and this match
+                    for earlier in pattern.finditer(text, rule.position, match.start()):
+                        earlier_rank, earlier_plural = forms[_animal_key(earlier.group(0))]
+                        rule.note_shift(earlier_rank, len('piglets' if earlier_plural else 'piglet') - len(earlier.group(0)))
+                if index is None:
+                    index = TokenIndex(text)
+                is_plural, deciding_rule = _is_plural_at(index, match.start(), match.end(), word,
+                                                         rule.applies_to(position, rank))
+                if stats is not None:
+                    stats.count_rule(deciding_rule)
+            if stats is not None:
+                stats.count_match(self._names[rank], is_plural)
+            replacement = match_case(word, 'piglets' if is_plural else 'piglet')
+            if not word.isascii():
+                rule.note_dotted(position, rank, word)
+            if rule.tracks_shifts and rule.position <= position:
+                rule.note_shift(rank, len(replacement) - len(word))
+            yield match, replacement
+
+    def rewrite(self, text, start=0, stop=None, offset=0, whole_text=False):
+        """
+        Return text[start:stop] with the animals replaced.
+
+        Takes the same arguments as replacements().
+
+        Returns:
+            str: The rewritten region
+        """
+        stop = len(text) if stop is None else stop
+        pieces = []
+        position = start
+        for match, replacement in self.replacements(text, start, stop, offset, whole_text):
+            pieces.append(text[position:match.start()])
+            pieces.append(replacement)
+            position = match.end()
+        pieces.append(text[position:stop])
+        return ''.join(pieces)
+
+
+def replace_animals_with_piglet(text, lexicon=None, stats=None):
+    """
+    Replace all occurrences of barnyard animals with 'piglet' or 'piglets',
+    preserving the original capitalization.
+
+    All singular and plural forms are found in a single left-to-right pass.
+    
+    Args:
+        text (str): The input text to process
+        lexicon (Lexicon): The animals to replace instead of the barnyard animals
+        stats (Stats): Collects the matches and the rules that decided them
+    
+    Returns:
+        str: The processed text with animal names replaced
+    """
+    if lexicon is not None:
+        return lexicon.rewrite(text, stats)
+    return _Rewriter(stats).rewrite(text, whole_text=True)
+
+
+_WORD_PATTERN = re.compile(r'\w+')
+_SEPARATOR_PATTERN = re.compile(r'\W+')
+_NAME_TOKEN_PATTERN = re.compile(r'\w+|\W+')
+
+# Texts at least this long are searched for the words of the lexicon they
+# contain before they are scanned
+_LEXICON_PREFILTER_SIZE = 64 * 1024
+
+
+def _fold_case(text):
+    """
+    Fold the case of a text the way re.IGNORECASE compares characters.
+
+    The result has the same length as the text, so offsets carry over.
+
+    Args:
+        text (str): The text to fold
+
+    Returns:
+        str: The text in lower case, with the characters that re.IGNORECASE
+            treats as ASCII letters replaced by those letters
+    """
+    if not text.isascii() and _IGNORECASE_FOLDS_PATTERN.search(text):
+        text = text.translate(_IGNORECASE_FOLDS)
+    return text.lower()
+
+
+class Lexicon:
+    """
+    A vocabulary of animal names, matched with a trie of words.
+
+    Names are split into words and the separators between them. The text is
+    scanned one word at a time and each word is looked up in the trie, so the
+    cost of a scan depends on the length of the text and not on the number of
+    names. Matches follow the word boundary and case rules of the barnyard
+    matcher; where names overlap, the longest one starting at a word wins.
+    """
+
+    def __init__(self, animals):
+        """
+        Build the trie for a vocabulary.
+
+        Args:
+            animals (dict): Dictionary mapping singular forms to plural forms
+
+        Raises:
+            ValueError: If a name does not start and end with a word character
+        """
+        self.animals = dict(animals)
+        self._trie = {}
+        for singular, plural in self.animals.items():
+            self._add(plural, singular, True)
+            self._add(singular, singular, None if _fold_case(singular) == _fold_case(plural) else False)
+
+    def _add(self, name, singular, is_plural):
+        """Add one form of a name to the trie."""
+        tokens = _NAME_TOKEN_PATTERN.findall(_fold_case(name))
+        if not tokens or not _WORD_PATTERN.fullmatch(tokens[0]) or not _WORD_PATTERN.fullmatch(tokens[-1]):
+            raise ValueError(f"Animal names must start and end with a letter or digit: {name!r}")
+        # Each node maps (separator, word) to the next node, and '' to the
+        # singular form and the number of the name that ends there
+        node = self._trie.setdefault(tokens[0], {})
+        for separator, word in zip(tokens[1::2], tokens[2::2]):
+            node = node.setdefault((separator, word), {})
+        node[''] = (singular, is_plural)
+
+    def _first_words(self, folded):
+        """
+        Find the words of a folded text that may start an animal name.
+
+        A long text is first split into its distinct words, and only those
+        that start a name in the trie go into the pattern that finds them.
+        The pattern depends on the words of the text, not on the size of the
+        lexicon, and lets the regex engine skip the other words.
+
+        Args:
+            folded (str): The text, folded with _fold_case()
+
+        Returns:
+            iterator: The match objects of the words, in order
+        """
+        if len(folded) < _LEXICON_PREFILTER_SIZE:
+            return _WORD_PATTERN.finditer(folded)
+        present = set()
+        start = 0
+        while start < len(folded):
+            # Cut the text into blocks at whitespace to bound the memory used
+            found = _WHITESPACE_PATTERN.search(folded, start + _LEXICON_PREFILTER_SIZE)
+            stop = found.start() if found else len(folded)
+            for token in set(folded[start:stop].split()):
+                present.update(_WORD_PATTERN.findall(token))
+            start = stop
+        present.intersection_update(self._trie)
+        if not present:
+            return iter(())
+        first_letters = ''.join(sorted({re.escape(word[0]) for word in present}))
+        pattern = re.compile(r'(?=[' + first_letters + r'])(?<!\w)' + _build_word_trie_pattern(present) + r'(?!\w)')
+        return pattern.finditer(folded)
+
+    def replacements(self, text, stats=None, begin=0, stop=None, phrase=None):
+        """
+        Find the animals in a text and decide their replacements.
+
+        The search can be limited to a region of the text that starts and
+        ends next to whitespace; the rest of the text is still the context
+        of the names in the region.
+
+        Args:
+            text (str): The text to search
+            stats (Stats): Collects the matches and the rules that decided them
+            begin (int): The start of the region
+            stop (int): The end of the region; the end of text if omitted
+            phrase (int): The offset of the first "sheep and sheep" in text
+                (-1 if there is none), or None to search for it when it is needed
+
+        Yields:
+            tuple: The start and end of each animal name and its replacement
+        """
+        stop = len(text) if stop is None else stop
+        # Offsets in the folded region are relative to begin
+        folded = _fold_case(text[begin:stop] if begin or stop < len(text) else text)
+        trie = self._trie
+        index = None
+        position = 0
+        for match in self._first_words(folded):
+            node = trie.get(match.group())
+            if node is None or match.start() < position:
+                continue
+            if node.__class__ is int:
+                # The node of a compiled matcher, decoded when first needed
+                node = self._decode_node(match.group(), node)
+            start = match.start()
+            end, name = (match.end(), node['']) if '' in node else (None, None)
+            # Follow the longest name that continues with the next words
+            scanned = match.end()
+            while len(node) > ('' in node):
+                separator = _SEPARATOR_PATTERN.match(folded, scanned)
+                word = separator and _WORD_PATTERN.match(folded, separator.end())
+                node = word and node.get((separator.group(), word.group()))
+                if not node:
+                    break
+                scanned = word.end()
+                if '' in node:
+                    end, name = scanned, node['']
+            if end is None:
+                continue
+
+            singular, is_plural = name
+            position = end
+            start += begin
+            end += begin
+            matched = text[start:end]
+            # Names with the same singular and plural form depend on their context
+            if is_plural is None:
+                if index is None:
+                    index = TokenIndex(text)
+                if phrase is None:
+                    found = _SHEEP_AND_SHEEP_PATTERN.search(text)
+                    phrase = found.start() if found else -1
+                is_plural, deciding_rule = _is_plural_at(index, start, end, matched, start == phrase)
+                if stats is not None:
+                    stats.count_rule(deciding_rule)
+            if stats is not None:
+                stats.count_match(singular, is_plural)
+            yield start, end, match_case(matched, 'piglets' if is_plural else 'piglet')
+
+    def rewrite(self, text, stats=None, begin=0, stop=None, phrase=None):
+        """
+        Return the text, or a region of it, with the animals of the lexicon replaced.
+
+        Takes the same arguments as replacements().
+
+        Returns:
+            str: The processed text or region with animal names replaced
+        """
+        stop = len(text) if stop is None else stop
+        pieces = []
+        position = begin
+        for start, end, replacement in self.replacements(text, stats, begin, stop, phrase):
+            pieces.append(text[position:start])
+            pieces.append(replacement)
+            position = end
+        pieces.append(text[position:stop])
+        return ''.join(pieces)
+
+
+def _read_text_lexicon(file):
+    """
+    Read a lexicon with one animal per line: the singular, a tab and the plural.
+
+    Empty lines and lines starting with '#' are skipped. A missing plural is
+    the singular with an 's' added.
+    """
+    animals = {}
+    for line in file:
+        singular, _, plural = line.strip().partition('\t')
+        if singular and not singular.startswith('#'):
+            animals[singular.strip()] = plural.strip() or singular.strip() + 's'
+    return animals
+
+
+def _read_csv_lexicon(file):
+    """Read a lexicon with one animal per row: the singular and the plural."""
+    import csv
+    animals = {}
+    for row in csv.reader(file):
+        if row and row[0].strip():
+            plural = row[1].strip() if len(row) > 1 else ''
+            animals[row[0].strip()] = plural or row[0].strip() + 's'
+    return animals
+
+
+def _read_json_lexicon(file):
+    """Read a lexicon stored as a JSON object mapping singular to plural forms."""
+    import json
+    animals = json.load(file)
+    if not isinstance(animals, dict):
+        raise ValueError("A JSON lexicon must be an object mapping singular to plural forms")
+    return animals
+
+
+# Functions that read the animals of a lexicon file, by file extension. Each
+# takes the open text file and returns a dictionary like get_barnyard_animals().
+LEXICON_READERS = {
+    '.txt': _read_text_lexicon,
+    '.tsv': _read_text_lexicon,
+    '.csv': _read_csv_lexicon,
+    '.json': _read_json_lexicon,
+}
+
+
+def load_lexicon(path):
+    """
+    Load a lexicon of animal names from a file.
+
+    The format is chosen by the extension of the file from LEXICON_READERS,
+    or the file is a matcher compiled by piglet_matcher.compile_matcher().
+
+    Args:
+        path (str): The lexicon file
+
+    Returns:
+        Lexicon: The lexicon, ready to match, or None for a matcher compiled
+            from the barnyard animals
+
+    Raises:
+        ValueError: If the format is not supported, a name is not valid, or
+            a compiled matcher is stale
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.pigm':
+        # Imported here, as it imports this module
+        import piglet_matcher
+        return piglet_matcher.load_matcher(path)
+    if extension not in LEXICON_READERS:
+        raise ValueError(f"Unsupported lexicon format: {path}")
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        return Lexicon(LEXICON_READERS[extension](file))
+
+
+# Number of characters read at a time in streaming mode
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Characters of lookahead the "sheep and sheep" search needs after a region
+_PHRASE_LOOKAHEAD = len("sheep and sheep") - 1
+
+_WHITESPACE_PATTERN = re.compile(r'\s')
+
+
+def _safe_cut(buffer, start):
+    """
+    Find where the text seen so far can be rewritten up to.
+
+    The cut is a whitespace character that is followed by a complete word and
+    enough characters for all lookahead, so the rest of the text cannot change
+    how anything before the cut is rewritten.
+
+    Args:
+        buffer (str): The buffered text
+        start (int): Where the unwritten part of the buffer starts
+
+    Returns:
+        int: The offset of the cut, or None if there is no cut after start
+    """
+    window = 256
+    while True:
+        window_start = max(start, len(buffer) - window)
+        tokens = [token.span() for token in _TOKEN_PATTERN.finditer(buffer, window_start)]
+        # The last word may continue in the next chunk
+        if tokens and tokens[-1][1] == len(buffer):
+            tokens.pop()
+        for i in range(len(tokens) - 1, 0, -1):
+            cut = tokens[i - 1][1]
+            if cut > start and len(buffer) - cut > _PHRASE_LOOKAHEAD:
+                return cut
+        if window_start == start:
+            return None
+        window *= 4
+
+
+def _context_start(buffer, cut):
+    """
+    Find how much of the buffer before a cut must be kept as context.
+
+    Args:
+        buffer (str): The buffered text
+        cut (int): The offset of the cut
+
+    Returns:
+        int: The start of the WORDS_BEFORE-th word before the cut, or 0
+    """
+    window = 64
+    while True:
+        window_start = max(0, cut - window)
+        starts = [token.start() for token in _TOKEN_PATTERN.finditer(buffer, window_start, cut)]
+        # The first word in the window may have started before it
+        if len(starts) > WORDS_BEFORE or window_start == 0:
+            return starts[-WORDS_BEFORE] if len(starts) >= WORDS_BEFORE else 0
+        window *= 4
+
+
+def replace_animals_with_piglet_stream(chunks, stats=None):
+    """
+    Replace the barnyard animals in a text that arrives in chunks.
+
+    Output is produced as soon as enough of the text has been seen, and only
+    the words that the plural context of later words depends on are kept, so
+    memory use does not grow with the length of the text. The concatenated
+    output is the same as replace_animals_with_piglet() of the whole text.
+
+    Args:
+        chunks (iterable): The consecutive pieces of the text
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Yields:
+        str: The consecutive pieces of the processed text
+    """
+    stream = _StreamRewriter(stats)
+    for chunk in chunks:
+        processed_chunk = stream.feed(chunk)
+        if processed_chunk is not None:
+            yield processed_chunk
+    yield stream.close()
+
+
+class _StreamRewriter:
+    """
+    Replace the animals in a text that is pushed in chunks.
+
+    The push counterpart of replace_animals_with_piglet_stream(), for callers
+    that receive the chunks from somewhere else, such as an event loop.
+    """
+
+    def __init__(self, stats=None):
+        self._rewriter = _Rewriter(stats)
+        self._buffer = ''
+        self._start = 0
+        self._offset = 0
+        self._pending = []
+
+    def feed(self, chunk):
+        """
+        Add the next chunk of the text.
+
+        Args:
+            chunk (str): The next piece of the text
+
+        Returns:
+            str: The next piece of the processed text, or None if the text
+                cannot be rewritten any further yet
+        """
+        if not _WHITESPACE_PATTERN.search(chunk):
+            # Nothing can be cut inside a single word
+            self._pending.append(chunk)
+            return None
+        buffer = ''.join([self._buffer] + self._pending + [chunk])
+        self._pending = []
+        cut = _safe_cut(buffer, self._start)
+        if cut is None:
+            self._buffer = buffer
+            return None
+        processed_chunk = self._rewriter.rewrite(buffer, self._start, cut, self._offset)
+        keep = _context_start(buffer, cut)
+        self._buffer = buffer[keep:]
+        self._offset += keep
+        self._start = cut - keep
+        return processed_chunk
+
+    @property
+    def buffered(self):
+        """int: The number of characters held back until more text arrives."""
+        return len(self._buffer) + sum(len(chunk) for chunk in self._pending)
+
+    def close(self):
+        """
+        Finish the text.
+
+        Returns:
+            str: The rest of the processed text
+        """
+        buffer = ''.join([self._buffer] + self._pending)
+        self._buffer = ''
+        self._pending = []
+        return self._rewriter.rewrite(buffer, self._start, len(buffer), self._offset)
+
+
+def read_chunks(file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read a file in chunks.
+
+    Args:
+        file: The open file
+        chunk_size (int): The number of characters per chunk
+
+    Yields:
+        str: The consecutive chunks of the file
+    """
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+# UTF-8 encodings of the characters that re.IGNORECASE matches to ASCII letters
+# ('İ', 'ı', 'ſ' and the Kelvin sign); 'İ' is also lengthened by str.lower().
+# Bytes containing any of them are decoded and processed as text.
+_CASE_FOLDING_BYTES_PATTERN = re.compile(rb'\xc4[\xb0\xb1]|\xc5\xbf|\xe2\x84\xaa')
+
+_BYTES_SHEEP_AND_SHEEP_PATTERN = re.compile(_SHEEP_AND_SHEEP_PATTERN.pattern.encode('ascii'))
+
+_TOKEN_END_PATTERN = re.compile(r'\S(?=\s)')
+
+
+@functools.lru_cache(maxsize=None)
+def _get_bytes_animal_matcher():
+    """
+    Compile the animal matcher for UTF-8 encoded bytes.
+
+    The pattern only checks ASCII neighbours for the word boundaries; a match
+    next to a non-ASCII character must be checked with _is_word_char_at().
+
+    Returns:
+        tuple: The compiled pattern and a dictionary mapping each lowercase
+            form, as bytes, to the same values as _get_animal_matcher()
+    """
+    _, forms = _get_animal_matcher()
+    first_letters = ''.join(sorted({form[0] for form in forms}))
+    source = (r'(?<![0-9A-Za-z_])(?=[' + first_letters + r'])'
+              + _build_word_trie_pattern(forms) + r'(?![0-9A-Za-z_])')
+    pattern = re.compile(source.encode('ascii'), re.IGNORECASE)
+    return pattern, {form.encode('ascii'): value for form, value in forms.items()}
+
+
+def _char_start(data, position):
+    """Move position back to the first byte of the UTF-8 character it is in."""
+    while position > 0 and 0x80 <= data[position] < 0xC0:
+        position -= 1
+    return position
+
+
+def _is_word_char_at(data, position):
+    """
+    Check whether the UTF-8 character that starts at position is a word character.
+
+    Args:
+        data: The UTF-8 encoded bytes
+        position (int): The offset of the first byte of the character
+
+    Returns:
+        bool: True if the regex word boundary treats the character as part of a word
+    """
+    char = data[position:position + 4].decode('utf-8', 'surrogateescape')[:1]
+    return char.isalnum() or char == '_'
+
+
+def _is_plural_in_bytes(data, start, end, first_sheep_and_sheep):
+    """
+    Decide whether the word at data[start:end] is used in a plural context.
+
+    Only a few words around the match are decoded.
+
+    Args:
+        data: The UTF-8 encoded bytes
+        start (int): The offset of the word
+        end (int): The offset just after the word
+        first_sheep_and_sheep (bool): Whether the word is at the offset of the
+            first "sheep and sheep"
+
+    Returns:
+        tuple: True if the word is being used in a plural context, False
+            otherwise, and the name of the deciding rule
+    """
+    reach = 64
+    while True:
+        window_start = _char_start(data, max(start - reach, 0))
+        window_end = len(data) if end + reach >= len(data) else _char_start(data, end + reach)
+        before = data[window_start:start].decode('utf-8', 'surrogateescape')
+        after = data[end:window_end].decode('utf-8', 'surrogateescape')
+        # The first word in the window may be cut, and so may the last one
+        if ((window_start == 0 or len(before.split()) > WORDS_BEFORE)
+                and (window_end == len(data) or _TOKEN_END_PATTERN.search(after))):
+            break
+        reach *= 4
+    word = data[start:end].decode('ascii')
+    index = TokenIndex(before + word + after)
+    return _is_plural_at(index, len(before), len(before) + len(word), word, first_sheep_and_sheep)
+
+
+def iter_replace_animals_in_bytes(data, stats=None):
+    """
+    Replace the barnyard animals in UTF-8 encoded bytes.
+
+    The bytes are matched directly, without decoding them; only the words
+    around an ambiguous animal are decoded. The text between the animals is
+    passed through as slices of data, and bytes that are not valid UTF-8 are
+    left as they are. The joined pieces are the same as encoding the result
+    of replace_animals_with_piglet() for the decoded text.
+
+    Args:
+        data: The bytes, or any object that supports slicing and the buffer
+            protocol, such as an mmap
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Yields:
+        bytes: The consecutive pieces of the processed bytes
+    """
+    if _CASE_FOLDING_BYTES_PATTERN.search(data):
+        decoded = codecs.decode(data, 'utf-8', 'surrogateescape')
+        yield replace_animals_with_piglet(decoded, stats=stats).encode('utf-8', 'surrogateescape')
+        return
+    yield from _iter_replace_bytes_range(data, 0, len(data), stats=stats)
+
+
+def _iter_bytes_range_replacements(data, begin, stop, phrase=None, stats=None):
+    """
+    Find the barnyard animals in a range of UTF-8 encoded bytes and decide their replacements.
+
+    The range must not cut a word: data[begin - 1] and data[stop - 1] must be
+    whitespace unless they are the ends of data. The bytes outside the range
+    are still used as the context of the words near its ends. The bytes must
+    not contain any of _CASE_FOLDING_BYTES_PATTERN.
+
+    Args:
+        data: The UTF-8 encoded bytes
+        begin (int): The offset of the range
+        stop (int): The offset just after the range
+        phrase (int): The offset of the first "sheep and sheep" in data (-1 if
+            there is none), or None to search for it when it is needed
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Yields:
+        tuple: The start and end offsets of each animal, its replacement as
+            bytes, and whether it was taken as plural
+    """
+    pattern, forms = _get_bytes_animal_matcher()
+    names = list(get_barnyard_animals()) if stats is not None else None
+    size = len(data)
+    for match in pattern.finditer(data, begin, stop):
+        start, end = match.span()
+        # Non-ASCII letters and digits are word characters as well
+        if ((start > 0 and data[start - 1] >= 0x80 and _is_word_char_at(data, _char_start(data, start - 1)))
+                or (end < size and data[end] >= 0x80 and _is_word_char_at(data, end))):
+            continue
+        word = match.group(0)
+        rank, is_plural = forms[word.lower()]
+        # Words with the same singular and plural form depend on their context
+        if is_plural is None:
+            if phrase is None:
+                found = _BYTES_SHEEP_AND_SHEEP_PATTERN.search(data)
+                phrase = found.start() if found else -1
+            is_plural, deciding_rule = _is_plural_in_bytes(data, start, end, start == phrase)
+            if stats is not None:
+                stats.count_rule(deciding_rule)
+        if stats is not None:
+            stats.count_match(names[rank], is_plural)
+        replacement = b'piglets' if is_plural else b'piglet'
+        if word.isupper():
+            replacement = replacement.upper()
+        elif word[:1].isupper():
+            replacement = replacement.capitalize()
+        yield start, end, replacement, is_plural
+
+
+def _iter_replace_bytes_range(data, begin, stop, phrase=None, stats=None):
+    """
+    Replace the barnyard animals in a range of UTF-8 encoded bytes.
+
+    Takes the same arguments as _iter_bytes_range_replacements().
+
+    Yields:
+        bytes: The consecutive pieces of the processed range
+    """
+    position = begin
+    for start, end, replacement, _ in _iter_bytes_range_replacements(data, begin, stop, phrase, stats):
+        yield data[position:start]
+        yield replacement
+        position = end
+    yield data[position:stop]
+
+
+def replace_animals_with_piglet_bytes(data, stats=None):
+    """
+    Replace the barnyard animals in UTF-8 encoded bytes.
+
+    Args:
+        data (bytes): The UTF-8 encoded text
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Returns:
+        bytes: The processed text, UTF-8 encoded
+    """
+    return b''.join(iter_replace_animals_in_bytes(data, stats))
+
+
+def iter_animal_spans(data, lexicon=None, stats=None):
+    """
+    Find the animals in UTF-8 encoded bytes and what each would be replaced with.
+
+    The decisions are the ones replace_animals_with_piglet() makes, but no
+    output is built: only the matches are reported, with their byte offsets
+    in data. The barnyard animals are matched in the bytes directly, unless
+    they contain characters that re.IGNORECASE folds to ASCII letters; text
+    with those, and lexicons, are decoded and matched as text.
+
+    Args:
+        data: The bytes, or any object that supports slicing and the buffer
+            protocol, such as an mmap
+        lexicon (Lexicon): The animals to find instead of the barnyard animals
+        stats (Stats): Collects the matches and the rules that decided them
+
+    Yields:
+        tuple: The byte offset and byte length of each animal, the animal and
+            its replacement as str, and whether it was taken as plural
+    """
+    if lexicon is None and not _CASE_FOLDING_BYTES_PATTERN.search(data):
+        for start, end, replacement, is_plural in _iter_bytes_range_replacements(data, 0, len(data), stats=stats):
+            yield start, end - start, data[start:end].decode('ascii'), replacement.decode('ascii'), is_plural
+        return
+
+    text = codecs.decode(data, 'utf-8', 'surrogateescape')
+    if lexicon is not None:
+        replacements = lexicon.replacements(text, stats)
+    else:
+        replacements = ((match.start(), match.end(), replacement)
+                        for match, replacement in _Rewriter(stats).replacements(text, whole_text=True))
+    # Character offsets are turned into byte offsets as the matches go by
+    position = offset = 0
+    for start, end, replacement in replacements:
+        offset += len(text[position:start].encode('utf-8', 'surrogateescape'))
+        word = text[start:end]
+        length = len(word.encode('utf-8', 'surrogateescape'))
+        yield offset, length, word, replacement, replacement.lower() == 'piglets'
+        position = end
+        offset += length
+
+
+def write_mapped_file(path, output, stats=None):
+    """
+    Process a file through a memory map and write the result.
+
+    The file is never read into memory as a whole: the matcher runs over the
+    mapped bytes and the text between the animals is copied as slices. Bytes
+    are written as they are, without newline translation.
+
+    Args:
+        path (str): The file to process
+        output: The binary stream to write to
+        stats (Stats): Collects the matches and the rules that decided them
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if _CASE_FOLDING_BYTES_PATTERN.search(mapped):
+                # Process as text, a chunk at a time
+                decoder = codecs.getincrementaldecoder('utf-8')('surrogateescape')
+                chunks = (decoder.decode(mapped[i:i + DEFAULT_CHUNK_SIZE], i + DEFAULT_CHUNK_SIZE >= len(mapped))
+                          for i in range(0, len(mapped), DEFAULT_CHUNK_SIZE))
+                for processed_chunk in replace_animals_with_piglet_stream(chunks, stats):
+                    output.write(processed_chunk.encode('utf-8', 'surrogateescape'))
+                return
+            for piece in iter_replace_animals_in_bytes(mapped, stats):
+                output.write(piece)
+
+
+class Transformer:
+    """
+    Replace animals with piglets in texts, strings, bytes or chunks.
+
+    The matchers are compiled when the transformer is created, so every call
+    only does the work that depends on its text. One transformer can be
+    shared by any number of calls and threads.
+    """
+
+    def __init__(self, lexicon=None):
+        """
+        Compile the matchers.
+
+        Args:
+            lexicon (Lexicon): The animals to replace instead of the barnyard animals
+        """
+        self.lexicon = lexicon
+        if lexicon is None:
+            _get_animal_matcher()
+            _get_bytes_animal_matcher()
+
+    def transform(self, text, stats=None):
+        """
+        Replace the animals in a text.
+
+        Args:
+            text (str): The input text to process
+            stats (Stats): Collects the matches and the rules that decided them
+
+        Returns:
+            str: The processed text
+        """
+        if self.lexicon is not None:
+            return self.lexicon.rewrite(text, stats)
+        return _Rewriter(stats).rewrite(text, whole_text=True)
+
+    def transform_bytes(self, data, stats=None):
+        """
+        Replace the animals in UTF-8 encoded bytes.
+
+        Bytes that are not valid UTF-8 are left as they are.
+
+        Args:
+            data (bytes): The UTF-8 encoded text
+            stats (Stats): Collects the matches and the rules that decided them
+
+        Returns:
+            bytes: The processed text, UTF-8 encoded
+        """
+        if self.lexicon is not None:
+            text = codecs.decode(data, 'utf-8', 'surrogateescape')
+            return self.lexicon.rewrite(text, stats).encode('utf-8', 'surrogateescape')
+        return b''.join(iter_replace_animals_in_bytes(data, stats))
+
+    def transform_iter(self, chunks, stats=None):
+        """
+        Replace the animals in a text that arrives in chunks.
+
+        Output is yielded as soon as enough of the text has been seen; see
+        replace_animals_with_piglet_stream(). A lexicon needs the whole text,
+        so with one the output is yielded once the last chunk has arrived.
+
+        Args:
+            chunks (iterable): The consecutive pieces of the text, as str
+            stats (Stats): Collects the matches and the rules that decided them
+
+        Yields:
+            str: The consecutive pieces of the processed text
+        """
+        if self.lexicon is not None:
+            yield self.lexicon.rewrite(''.join(chunks), stats)
+            return
+        yield from replace_animals_with_piglet_stream(chunks, stats)
+
+
+# Raised whenever a change of the rules changes the output for some text, so
+# that results stored by an older version are not reused
+ENGINE_VERSION = 1
+
+
+def matcher_fingerprint(lexicon=None):
+    """
+    Return a digest of everything the output of the matcher depends on.
+
+    Args:
+        lexicon (Lexicon): The lexicon in use, or None for the barnyard animals
+
+    Returns:
+        str: The engine version, the animals in their replacement order and
+            the indicator words, hashed
+    """
+    if getattr(lexicon, 'fingerprint', None):
+        # A compiled matcher is checked against its source when it is loaded
+        return lexicon.fingerprint
+    import hashlib
+    animals = get_barnyard_animals() if lexicon is None else lexicon.animals
+    parts = [
+        str(ENGINE_VERSION),
+        'barnyard' if lexicon is None else 'lexicon',
+        repr(list(animals.items())),
+        repr([sorted(words) for words in [SINGULAR_INDICATORS, PLURAL_INDICATORS, PLURAL_VERBS, SHEEP_CONJUNCTIONS]]),
+        str(WORDS_BEFORE),
+    ]
+    return hashlib.blake2b('\0'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+# A blank line, with the whitespace around it
+_PARAGRAPH_BREAK_PATTERN = re.compile(r'\n[^\S\n]*\n\s*')
+
+
+def _paragraph_spans(text):
+    """
+    Split a text into paragraphs.
+
+    Each paragraph includes the blank lines after it, so the spans cover the
+    whole text and every span but the last ends with whitespace.
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        list: (start, stop) tuples of the paragraphs, in order
+    """
+    spans = []
+    start = 0
+    for separator in _PARAGRAPH_BREAK_PATTERN.finditer(text):
+        spans.append((start, separator.end()))
+        start = separator.end()
+    if start < len(text) or not spans:
+        spans.append((start, len(text)))
+    return spans
+
+
+def replace_animals_with_piglet_cached(text, cache, lexicon=None, stats=None):
+    """
+    Replace the animals in a text, reusing the results for unchanged paragraphs.
+
+    Each paragraph is looked up by a hash of its text, the words around it
+    that the plural context of its animals can depend on, the position of
+    the first "sheep and sheep" if it lies in the paragraph, and the
+    fingerprint of the matcher. Only paragraphs that are not found are
+    rewritten, and their results are stored. The result is the same as
+    replace_animals_with_piglet().
+
+    Texts with characters that re.IGNORECASE folds to ASCII letters, whose
+    rewriting depends on the whole text before them, are not cached.
+
+    Args:
+        text (str): The input text to process
+        cache: The store of results, with get_many(keys) returning a
+            dictionary of the keys found and put_many(items) storing a
+            dictionary; see piglet_cache.ParagraphCache
+        lexicon (Lexicon): The animals to replace instead of the barnyard animals
+        stats (Stats): Collects the matches and the rules of the rewritten paragraphs
+
+    Returns:
+        str: The processed text with animal names replaced
+    """
+    if lexicon is None and _IGNORECASE_FOLDS_PATTERN.search(text):
+        return replace_animals_with_piglet(text, stats=stats)
+    import hashlib
+    fingerprint = matcher_fingerprint(lexicon).encode('ascii')
+    found = _SHEEP_AND_SHEEP_PATTERN.search(text)
+    phrase = found.start() if found else -1
+
+    spans = _paragraph_spans(text)
+    keys = []
+    for start, stop in spans:
+        context_start = _context_start(text, start)
+        token = _TOKEN_PATTERN.search(text, stop)
+        context_stop = token.end() if token else len(text)
+        local_phrase = phrase - context_start if start <= phrase < stop else -1
+        digest = hashlib.blake2b(fingerprint, digest_size=20)
+        digest.update(f"\0{start - context_start}\0{stop - context_start}\0{local_phrase}\0".encode('ascii'))
+        digest.update(text[context_start:context_stop].encode('utf-8', 'surrogatepass'))
+        keys.append(digest.digest())
+
+    stored = cache.get_many(keys)
+    rewriter = None
+    pieces = []
+    missing = {}
+    for (start, stop), key in zip(spans, keys):
+        processed = stored.get(key) or missing.get(key)
+        if processed is None:
+            if lexicon is not None:
+                processed = lexicon.rewrite(text, stats, start, stop, phrase)
+            else:
+                if rewriter is None:
+                    # The phrase is searched in the whole text, not paragraph by paragraph
+                    rewriter = _Rewriter(stats)
+                    rewriter._rule.locate(text)
+                processed = rewriter.rewrite(text, start, stop)
+            missing[key] = processed
+        pieces.append(processed)
+    if missing:
+        cache.put_many(missing)
+    return ''.join(pieces)
+
+
+DEFAULT_SHARD_SIZE = 16 * 1024 * 1024
+
+_ASCII_WHITESPACE_BYTES_PATTERN = re.compile(rb'[ \t\n\r\f\v]+')
+
+
+def _plan_shards(data, shard_size):
+    """
+    Split bytes into ranges of about shard_size bytes that do not cut a word.
+
+    Every range but the last ends just after a run of ASCII whitespace, which
+    is never part of a word or of a multi-byte UTF-8 character.
+
+    Args:
+        data: The UTF-8 encoded bytes
+        shard_size (int): The approximate size of a range
+
+    Returns:
+        list: The (start, stop) offsets of the consecutive ranges
+    """
+    bounds = [0]
+    while len(data) - bounds[-1] > shard_size:
+        found = _ASCII_WHITESPACE_BYTES_PATTERN.search(data, bounds[-1] + shard_size)
+        if found is None:
+            break
+        bounds.append(found.end())
+    if bounds[-1] != len(data):
+        bounds.append(len(data))
+    return list(zip(bounds, bounds[1:]))
+
+
+def _process_shard(path, start, stop, phrase, collect_stats=False):
+    """
+    Process one shard of a file in a worker process.
+
+    The worker maps the whole file, so the words on either side of the shard
+    are at hand to decide the number of an ambiguous word near its ends.
+
+    Args:
+        path (str): The file to process
+        start (int): The offset of the shard
+        stop (int): The offset just after the shard
+        phrase (int): The offset of the first "sheep and sheep" in the file, or -1
+        collect_stats (bool): Whether to collect the statistics of the shard
+
+    Returns:
+        tuple: The processed shard and its Stats, or None
+    """
+    stats = Stats() if collect_stats else None
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return b''.join(_iter_replace_bytes_range(mapped, start, stop, phrase, stats)), stats
+
+
+def write_sharded_file(path, output, jobs=None, shard_size=DEFAULT_SHARD_SIZE, stats=None):
+    """
+    Process a file in shards on several worker processes and write the result.
+
+    The shards are cut at whitespace and written in order as they complete,
+    with only a few of them in flight at a time. The result is the same as
+    write_mapped_file(), which is used instead when the file is too small to
+    split or has to be processed as text.
+
+    Args:
+        path (str): The file to process
+        output: The binary stream to write to
+        jobs (int): The number of worker processes (default: number of CPUs)
+        shard_size (int): The approximate number of bytes per shard
+        stats (Stats): Collects the matches and the rules that decided them
+    """
+    jobs = jobs or os.cpu_count() or 1
+    shards = []
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size > shard_size and jobs > 1:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if not _CASE_FOLDING_BYTES_PATTERN.search(mapped):
+                    # Every shard needs the same anchor for the "sheep and sheep" rule
+                    found = _BYTES_SHEEP_AND_SHEEP_PATTERN.search(mapped)
+                    phrase = found.start() if found else -1
+                    shards = _plan_shards(mapped, shard_size)
+    if len(shards) < 2:
+        write_mapped_file(path, output, stats)
+        return
+
+    # Imported here, as it is slow to import and most runs do not need it
+    import concurrent.futures
+    def write_next():
+        processed_shard, shard_stats = pending.popleft().result()
+        output.write(processed_shard)
+        if stats is not None:
+            stats.merge(shard_stats)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(shards))) as executor:
+        pending = collections.deque()
+        for start, stop in shards:
+            if len(pending) >= 2 * jobs:
+                write_next()
+            pending.append(executor.submit(_process_shard, path, start, stop, phrase, stats is not None))
+        while pending:
+            write_next()
+
+
+def _cached_lexicon(path):
+    """Load a lexicon file once per process, and again whenever it changes."""
+    status = os.stat(path)
+    return _load_lexicon_version(os.path.abspath(path), status.st_mtime_ns, status.st_size)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_lexicon_version(path, mtime_ns, size):
+    """Load a lexicon file, cached by its name, modification time and size."""
+    return load_lexicon(path)
+
+
+def _process_batch_file(path, output_path=None, lexicon_path=None, cache=None):
+    """
+    Process one file of a batch in a worker process.
+
+    Errors are returned instead of raised, so that a failing file does not
+    stop the rest of the batch.
+
+    Args:
+        path (str): The file to process
+        output_path (str): The file to write the result to, or None to return it
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+        cache (piglet_cache.ResultCache): Where outputs of whole files are kept, or None
+
+    Returns:
+        tuple: The processed text (None if written or failed) and the error message (None on success)
+    """
+    try:
+        lexicon = _cached_lexicon(lexicon_path) if lexicon_path else None
+        if cache is not None:
+            key = cache.key(path, matcher_fingerprint(lexicon))
+            entry = cache.lookup(key)
+            if entry is not None:
+                if output_path is None:
+                    with open(entry, 'r', encoding='utf-8') as file:
+                        return file.read()[:-1], None
+                cache.copy_to(entry, output_path)
+                return None, None
+        with open(path, 'r', encoding='utf-8') as file:
+            processed_content = replace_animals_with_piglet(file.read(), lexicon)
+        if cache is not None:
+            entry_file = cache.create()
+            try:
+                entry_file.write((processed_content + '\n').encode('utf-8'))
+            except BaseException:
+                cache.discard(entry_file)
+                raise
+            cache.store(key, entry_file)
+        if output_path is None:
+            return processed_content, None
+        # The output is replaced, never written through, as it may be a
+        # read-only hard link to a cache entry
+        directory, name = os.path.split(os.path.abspath(output_path))
+        temporary = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        try:
+            with open(temporary, 'w', encoding='utf-8') as file:
+                file.write(processed_content + '\n')
+            os.replace(temporary, output_path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except FileNotFoundError:
+                pass
+            raise
+        return None, None
+    except (OSError, UnicodeDecodeError) as e:
+        return None, str(e)
+
+
+def process_batch(paths, output_dir=None, jobs=None, logger=None, lexicon_path=None, cache=None, stdout=None):
+    """
+    Process many files, spreading them over a pool of worker processes.
+
+    Results are written in the order of the input files, whatever order the
+    workers finish in. Without an output directory each result is written to
+    stdout followed by a newline, exactly as for a single file; with one,
+    each file is written to a file of the same name in that directory.
+
+    Args:
+        paths (list): The files to process
+        output_dir (str): The directory to write the results to, or None for stdout
+        jobs (int): The number of worker processes (default: number of CPUs)
+        logger: The logger to report failed files to
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+        cache (piglet_cache.ResultCache): Where outputs of whole files are looked up
+            and stored, or None
+        stdout: Where the results are written without an output directory,
+            with a write(str) method (default: sys.stdout)
+
+    Returns:
+        int: The number of files that could not be processed
+    """
+    if logger is None:
+        # Imported here, as it is slow to import and the engine does not log otherwise
+        import logging
+        logger = logging.getLogger(__name__)
+    jobs = min(jobs or os.cpu_count() or 1, max(len(paths), 1))
+    output_paths = [None] * len(paths)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        output_paths = [os.path.join(output_dir, os.path.basename(path)) for path in paths]
+        names = [os.path.normcase(output_path) for output_path in output_paths]
+        if len(set(names)) != len(names):
+            raise ValueError("Files in a batch written to an output directory must have different names")
+
+    if lexicon_path:
+        # Fail early on a broken lexicon; forked workers inherit the loaded one
+        _cached_lexicon(lexicon_path)
+
+    if jobs == 1:
+        results = map(_process_batch_file, paths, output_paths, itertools.repeat(lexicon_path),
+                      itertools.repeat(cache))
+    else:
+        # Imported here, as it is slow to import and most runs do not need it
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        # Hand out files in small groups to keep the workers busy with little overhead
+        chunksize = max(1, min(64, len(paths) // (jobs * 8)))
+        results = executor.map(_process_batch_file, paths, output_paths, itertools.repeat(lexicon_path),
+                               itertools.repeat(cache), chunksize=chunksize)
+
+    failures = 0
+    try:
+        for path, (processed_content, error) in zip(paths, results):
+            if error is not None:
+                logger.error(f"Failed to process {path}: {error}")
+                failures += 1
+            elif processed_content is not None:
+                if stdout is None:
+                    # Imported here, as only batches written to stdout need it
+                    import sys
+                    stdout = sys.stdout
+                stdout.write(processed_content + '\n')
+    finally:
+        if jobs > 1:
+            executor.shutdown(cancel_futures=True)
+        if cache is not None:
+            cache.evict()
+    logger.info(f"Processed {len(paths) - failures} of {len(paths)} files")
+    return failures
+
@@ -0,0 +1,226 @@
+"""
+Compiled matchers for the piglet console application.
+
+Building the trie of a large lexicon costs more than transforming a short
+text. compile_matcher() does it once and stores the result in a file that
+load_matcher() maps into memory: only the first word of every name is read
+when the file is loaded, and the rest of the trie below a word is decoded
+the first time a text contains that word.
+
+The file starts with a header naming the format, the engine and the Python
+version that wrote it and holding a checksum of the rest of the file,
+followed by the fingerprint of the matcher and the source lexicon it was
+compiled from. A file written by another version, compiled from a lexicon
+that has changed since, or damaged, is rejected.
+
+Layout, after the header and the section sizes:
+    the first words of the names, in UTF-8 separated by newlines;
+    the offset of the trie node of each word, and the end, as 64-bit integers;
+    the trie nodes, each serialized with marshal;
+    the animals, serialized with marshal.
+"""
+import functools
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from piglet_engine import (
+    ENGINE_VERSION,
+    Lexicon,
+    load_lexicon,
+    matcher_fingerprint,
+)
+
+MATCHER_EXTENSION = '.pigm'
+MATCHER_FORMAT_VERSION = 2
+
+_MAGIC = b'PIGLETM\0'
+# Magic and format version, which every version of the format starts with
+_PREFIX = struct.Struct('<8sI')
+# The prefix, the engine, marshal and Python versions, the byte order, the
+# size of the metadata that follows, and the checksum of the rest of the file
+_HEADER = struct.Struct('<8sIIIIII16s')
+# Sizes of the first words, the offsets, the nodes and the animals
+_SECTIONS = struct.Struct('<QQQQ')
+
+
+class StaleMatcherError(ValueError):
+    """Raised when a compiled matcher does not match this version or its source any more."""
+
+
+def _python_version():
+    """Return the Python major and minor version as one number, as marshal changes with them."""
+    return sys.version_info[0] << 8 | sys.version_info[1]
+
+
+def _rules_fingerprint():
+    """Return the fingerprint of the rules alone, which lexicons are matched with."""
+    return matcher_fingerprint(Lexicon({}))
+
+
+def _checksum(body):
+    """Return the checksum of everything after the header."""
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+def _source_status(path):
+    """Return the size and modification time of a lexicon file."""
+    status = os.stat(path)
+    return status.st_size, status.st_mtime_ns
+
+
+def compile_matcher(path, lexicon_path=None):
+    """
+    Compile the barnyard animals or a lexicon into a matcher file.
+
+    The barnyard animals are matched by the built-in matcher, which is
+    compiled in well under a millisecond; their file only records the
+    fingerprint of the animals and rules, so that it is rejected once they
+    change. The file is written under a temporary name and renamed into place.
+
+    Args:
+        path (str): The file to write
+        lexicon_path (str): The lexicon file to compile instead of the barnyard animals
+
+    Returns:
+        str: The fingerprint of the compiled matcher
+    """
+    metadata = {'fingerprint': matcher_fingerprint(), 'source': None}
+    words = []
+    nodes = []
+    animals = {}
+    if lexicon_path:
+        lexicon = load_lexicon(lexicon_path)
+        size, mtime_ns = _source_status(lexicon_path)
+        metadata = {'fingerprint': matcher_fingerprint(lexicon), 'rules': _rules_fingerprint(),
+                    'source': os.path.abspath(lexicon_path), 'size': size, 'mtime_ns': mtime_ns}
+        words = list(lexicon._trie)
+        nodes = [marshal.dumps(lexicon._trie[word]) for word in words]
+        animals = lexicon.animals
+
+    encoded_words = '\n'.join(words).encode('utf-8')
+    offsets = array('Q', [0])
+    for node in nodes:
+        offsets.append(offsets[-1] + len(node))
+    encoded_metadata = marshal.dumps(metadata)
+    encoded_animals = marshal.dumps(list(animals.items()))
+    # The offsets are read in place, so they start at a multiple of 8
+    padding = -(_HEADER.size + len(encoded_metadata) + _SECTIONS.size + len(encoded_words)) % 8
+
+    body = [encoded_metadata,
+            _SECTIONS.pack(len(encoded_words) + padding, len(offsets) * offsets.itemsize,
+                           offsets[-1], len(encoded_animals)),
+            encoded_words + b'\n' * padding,
+            offsets.tobytes(),
+            *nodes,
+            encoded_animals]
+    checksum = hashlib.blake2b(digest_size=16)
+    for piece in body:
+        checksum.update(piece)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, MATCHER_FORMAT_VERSION, ENGINE_VERSION, marshal.version, _python_version(),
+                                sys.byteorder == 'little', len(encoded_metadata), checksum.digest()))
+        file.writelines(body)
+    os.replace(temporary, path)
+    return metadata['fingerprint']
+
+
+class _MappedLexicon(Lexicon):
+    """
+    A lexicon read from a compiled matcher file.
+
+    The trie maps each first word to the number of its node until a text
+    contains the word; the node is then decoded from the file and replaces
+    the number.
+    """
+
+    def __init__(self, data, words, offsets, nodes_start, animals_range, fingerprint):
+        self._data = data
+        self._offsets = offsets
+        self._nodes_start = nodes_start
+        self._animals_range = animals_range
+        self.fingerprint = fingerprint
+        self._trie = dict(zip(words, range(len(words))))
+
+    def _decode_node(self, word, number):
+        """Decode the trie node of a first word and keep it in the trie."""
+        start = self._nodes_start + self._offsets[number]
+        node = self._trie[word] = marshal.loads(self._data[start:self._nodes_start + self._offsets[number + 1]])
+        return node
+
+    @functools.cached_property
+    def animals(self):
+        """dict: The animals, decoded from the file when first needed."""
+        start, stop = self._animals_range
+        return dict(marshal.loads(self._data[start:stop]))
+
+
+def load_matcher(path):
+    """
+    Load a compiled matcher file.
+
+    Args:
+        path (str): The file written by compile_matcher()
+
+    Returns:
+        Lexicon: The compiled lexicon, or None if the file was compiled from
+            the barnyard animals
+
+    Raises:
+        ValueError: If the file is not a compiled matcher, or is damaged or truncated
+        StaleMatcherError: If it was written by another version, or its
+            source lexicon or the barnyard animals have changed since
+    """
+    with open(path, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            data = b''
+    if len(data) < _PREFIX.size or data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError(f"Not a compiled matcher: {path}")
+    if _PREFIX.unpack_from(data)[1] != MATCHER_FORMAT_VERSION:
+        raise StaleMatcherError(f"{path} was compiled by another version of piglet; compile it again")
+    if len(data) < _HEADER.size:
+        raise ValueError(f"{path} is truncated; compile it again")
+    _, _, engine_version, marshal_version, python_version, little_endian, metadata_size, checksum = \
+        _HEADER.unpack_from(data)
+    if (engine_version, marshal_version, python_version, bool(little_endian)) != \
+            (ENGINE_VERSION, marshal.version, _python_version(), sys.byteorder == 'little'):
+        raise StaleMatcherError(f"{path} was compiled by another version of piglet or Python; compile it again")
+    # The sizes of the sections are only trusted once the whole file is known to be intact
+    if _checksum(memoryview(data)[_HEADER.size:]) != checksum:
+        raise ValueError(f"{path} is damaged or truncated; compile it again")
+    position = _HEADER.size + metadata_size
+    metadata = marshal.loads(data[_HEADER.size:position])
+
+    source = metadata['source']
+    if source is None:
+        if metadata['fingerprint'] != matcher_fingerprint():
+            raise StaleMatcherError(f"The barnyard animals have changed since {path} was compiled; compile it again")
+        return None
+    if metadata['rules'] != _rules_fingerprint():
+        raise StaleMatcherError(f"The rules have changed since {path} was compiled; compile it again")
+    try:
+        changed = _source_status(source) != (metadata['size'], metadata['mtime_ns'])
+    except FileNotFoundError:
+        # A compiled matcher can be used without the lexicon it came from
+        changed = False
+    if changed:
+        raise StaleMatcherError(f"{source} has changed since {path} was compiled; compile it again")
+
+    words_size, offsets_size, nodes_size, animals_size = _SECTIONS.unpack_from(data, position)
+    position += _SECTIONS.size
+    words = data[position:position + words_size].rstrip(b'\n').decode('utf-8').split('\n')
+    position += words_size
+    offsets = memoryview(data)[position:position + offsets_size].cast('Q')
+    position += offsets_size
+    animals_range = (position + nodes_size, position + nodes_size + animals_size)
+    return _MappedLexicon(data, words if words != [''] else [], offsets, position, animals_range,
+                          metadata['fingerprint'])
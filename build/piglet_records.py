@@ -0,0 +1,200 @@
+"""
+Transformation of one field in every record of a JSON Lines or CSV file.
+
+Records are handed out in batches, so that many short texts share one
+compiled matcher and, with several jobs, one round trip to a worker process.
+The output has the records in their input order.
+"""
+import collections
+import csv
+import functools
+import io
+import json
+import os
+
+from piglet_engine import _cached_lexicon, replace_animals_with_piglet
+
+FORMATS = ('jsonl', 'csv')
+DEFAULT_RECORD_BATCH_SIZE = 10000
+
+_EXTENSIONS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl', '.csv': 'csv'}
+
+
+def guess_format(path):
+    """
+    Find the record format of a file from its extension.
+
+    Args:
+        path (str): The file name
+
+    Returns:
+        str: 'jsonl' or 'csv', or None if the extension is not known
+    """
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def _memoized_transform(lexicon_path):
+    """
+    Create a function that replaces the animals in a text, once per distinct text.
+
+    Record fields often repeat, such as titles or labels, and a batch then
+    transforms each value only once.
+
+    Args:
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+
+    Returns:
+        callable: The function, taking and returning a str
+    """
+    lexicon = _cached_lexicon(lexicon_path) if lexicon_path else None
+    processed = {}
+
+    def transform(text):
+        result = processed.get(text)
+        if result is None:
+            result = processed[text] = replace_animals_with_piglet(text, lexicon)
+        return result
+    return transform
+
+
+def _transform_lines(first_line, field, lexicon_path, lines):
+    """
+    Transform a field in a batch of JSON Lines records.
+
+    Lines whose field does not change are kept exactly as they were; the
+    others are serialized again.
+
+    Args:
+        first_line (int): The line number of the first line, for error messages
+        field (str): The name of the field
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+        lines (list): The lines, with their line endings
+
+    Returns:
+        str: The transformed lines
+    """
+    transform = _memoized_transform(lexicon_path)
+    processed_lines = []
+    for number, line in enumerate(lines, first_line):
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {number} is not valid JSON: {e}")
+            if not isinstance(record, dict):
+                raise ValueError(f"Line {number} is not a JSON object")
+            value = record.get(field)
+            if isinstance(value, str):
+                processed_value = transform(value)
+                if processed_value != value:
+                    record[field] = processed_value
+                    ending = line[len(line.rstrip('\r\n')):]
+                    line = json.dumps(record, ensure_ascii=False) + ending
+        processed_lines.append(line)
+    return ''.join(processed_lines)
+
+
+def _transform_rows(column, lexicon_path, rows):
+    """
+    Transform a column in a batch of CSV rows.
+
+    Args:
+        column (int): The index of the column
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+        rows (list): The rows, as lists of values
+
+    Returns:
+        str: The transformed rows in CSV format
+    """
+    transform = _memoized_transform(lexicon_path)
+    for row in rows:
+        if column < len(row):
+            row[column] = transform(row[column])
+    text = io.StringIO()
+    csv.writer(text, lineterminator='\n').writerows(rows)
+    return text.getvalue()
+
+
+def _batches(items, batch_size):
+    """
+    Group items into lists.
+
+    Args:
+        items: An iterable of items
+        batch_size (int): The number of items per list
+
+    Yields:
+        list: The consecutive groups, the last one possibly shorter
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def transform_records(source, output, field, record_format='jsonl', jobs=1,
+                      batch_size=DEFAULT_RECORD_BATCH_SIZE, lexicon_path=None):
+    """
+    Replace the animals in one field of every record of a file.
+
+    In JSON Lines, every non-blank line must be a JSON object; a field that
+    is missing or is not a string is left alone. In CSV, the first row names
+    the columns and is written unchanged.
+
+    Args:
+        source: The text file to read, opened with newline=''
+        output: Where to write the transformed records, with a write(str) method
+        field (str): The name of the field or column to transform
+        record_format (str): 'jsonl' or 'csv'
+        jobs (int): The number of worker processes; with 1 the records are
+            transformed in this process
+        batch_size (int): The number of records handed out at a time
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+
+    Returns:
+        int: The number of records processed
+    """
+    if record_format == 'csv':
+        rows = csv.reader(source)
+        header = next(rows, None)
+        if header is None:
+            return 0
+        if field not in header:
+            raise ValueError(f"There is no column named {field}")
+        csv.writer(output, lineterminator='\n').writerow(header)
+        batches = _batches(rows, batch_size)
+        transform = functools.partial(_transform_rows, header.index(field), lexicon_path)
+        tasks = ((transform, batch) for batch in batches)
+    elif record_format == 'jsonl':
+        def line_tasks():
+            first_line = 1
+            for batch in _batches(source, batch_size):
+                yield functools.partial(_transform_lines, first_line, field, lexicon_path), batch
+                first_line += len(batch)
+        tasks = line_tasks()
+    else:
+        raise ValueError(f"Unknown record format: {record_format}")
+
+    count = 0
+    if jobs <= 1:
+        for transform, batch in tasks:
+            output.write(transform(batch))
+            count += len(batch)
+        return count
+
+    # Imported here, as it is slow to import and most runs do not need it
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for transform, batch in tasks:
+            if len(pending) >= 2 * jobs:
+                output.write(pending.popleft().result())
+            pending.append(executor.submit(transform, batch))
+            count += len(batch)
+        while pending:
+            output.write(pending.popleft().result())
+    return count
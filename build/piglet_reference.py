@@ -0,0 +1,176 @@
+"""
+Reference implementation of the text transformation.
+
+This is the transformation as the application first shipped it, kept
+unchanged so that faster engines can be checked against it: every engine
+must give exactly its output, quirks included. The animals are replaced one
+after another in the order of get_barnyard_animals(), each with a pass over
+the text, and is_plural_context() sees the text as rewritten by the passes
+before it. Do not optimize or fix this module; change the engines instead.
+"""
+import re
+
+
+def get_barnyard_animals():
+    """
+    Return a list of common barnyard animals and their plural forms.
+    
+    Returns:
+        dict: Dictionary mapping singular forms to plural forms
+    """
+    animals = {
+        'pig': 'pigs',
+        'cow': 'cows',
+        'chicken': 'chickens',
+        'rooster': 'roosters',
+        'hen': 'hens',
+        'duck': 'ducks',
+        'goose': 'geese',
+        'sheep': 'sheep',
+        'lamb': 'lambs',
+        'goat': 'goats',
+        'horse': 'horses',
+        'donkey': 'donkeys',
+        'mule': 'mules',
+        'turkey': 'turkeys',
+        'rabbit': 'rabbits'
+    }
+    return animals
+
+
+def is_plural_context(text, match):
+    """
+    Determine if a word is being used in a plural context based on surrounding words.
+    
+    Args:
+        text (str): The full text being processed
+        match: The regex match object for the word
+    
+    Returns:
+        bool: True if the word is being used in a plural context, False otherwise
+    """
+    # Get the position of the match
+    start = match.start()
+    end = match.end()
+    
+    # Get the word itself
+    word = match.group(0).lower()
+    
+    # Special handling for capitalized versions in patterns like "sheep and Sheep"
+    if word == "sheep" and match.group(0)[0].isupper():
+        # Check if this is part of a pattern like "sheep and Sheep"
+        before_context = text[:start].lower().strip()
+        if before_context.endswith("sheep and") or before_context.endswith("sheep,"):
+            # This is likely a capitalized version in a list, treat as singular
+            return False
+    
+    # Check for specific phrases that indicate singular context
+    full_text = text.lower()
+    match_pos = match.start()
+    if "sheep and sheep" in full_text and match_pos == full_text.find("sheep and sheep"):
+        return False
+    
+    # Get a larger context before and after the match
+    before_text = text[:start].strip().split()[-6:] if start > 0 else []
+    after_text = text[end:].strip().split()[:5] if end < len(text) else []
+    
+    # Articles and determiners that typically precede singular nouns
+    singular_indicators = [
+        'a', 'an', 'one', 'this', 'that', 'each', 'every', 'is', 'was', 
+        'the', 'my', 'your', 'his', 'her', 'its', 'our', 'their', 'another'
+    ]
+    
+    # Check for singular indicators before the word
+    for word_index, word_before in enumerate(before_text):
+        if word_before.lower() in singular_indicators:
+            # If the singular indicator is immediately before the word or separated by adjectives
+            if word_index >= len(before_text) - 3:
+                return False
+    
+    # Words that typically precede plural nouns
+    plural_indicators = [
+        'many', 'several', 'few', 'some', 'these', 'those', 'are', 'were',
+        'multiple', 'various', 'numerous', 'all', 'both', 'many', 'most', 'other',
+        'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten'
+    ]
+    
+    # Check for plural indicators before the word
+    for word_before in before_text:
+        if word_before.lower() in plural_indicators:
+            return True
+    
+    # Check if the word is followed by a plural verb form or other plural indicators
+    if len(after_text) > 0:
+        # Check for plural verb forms
+        if after_text[0].lower() in ['are', 'were', 'seem', 'seemed', 'appear', 'appeared']:
+            return True
+
+    # Special handling for "sheep" which is often misidentified
+    if word.lower() == 'sheep':
+        # Look for specific context clues for plural sheep
+        # Check if it's part of a phrase like "sheep and Sheep" which indicates singular usage
+        if len(before_text) > 0 and before_text[-1].lower() in ['and', 'or', 'both']:
+            return False
+        if len(after_text) > 0 and after_text[0].lower() in ['and', 'or', 'both']:
+            # Special case for "other sheep" which should be treated as plural
+            if len(before_text) > 0 and before_text[-1].lower() == 'other':
+                return True
+            
+            return False
+        for word_before in before_text:
+            if word_before.lower() in ['many', 'several', 'these', 'those', 'are', 'were', 'some']:
+                return True
+        # Default to singular for sheep unless clear plural indicators are present
+        return False
+
+    # Default to singular if no plural context is detected
+    return False
+
+
+def replace_animals_with_piglet(text):
+    """
+    Replace all occurrences of barnyard animals with 'piglet' or 'piglets',
+    preserving the original capitalization.
+    
+    Args:
+        text (str): The input text to process
+    
+    Returns:
+        str: The processed text with animal names replaced
+    """
+    animals = get_barnyard_animals()
+    
+    # Process the text
+    for singular, plural in animals.items():
+        # Create patterns that match the word boundaries and preserve capitalization
+        singular_pattern = re.compile(r'\b' + singular + r'\b', re.IGNORECASE)
+        plural_pattern = re.compile(r'\b' + plural + r'\b', re.IGNORECASE)
+        
+        # Replace with appropriate case-matched version
+        def match_case(match, replacement, is_plural=False):
+            word = match.group(0)
+            if is_plural:
+                replacement = 'piglets'
+            
+            if word.isupper():
+                return replacement.upper()
+            elif word[0].isupper():
+                return replacement.capitalize()
+            else:
+                return replacement
+        
+        # Special handling for words with same singular and plural form
+        if singular == plural:
+            def replace_with_context(match):
+                is_plural = is_plural_context(text, match)
+                return match_case(match, 'piglet', is_plural)
+            
+            text = singular_pattern.sub(replace_with_context, text)
+            # Skip the regular processing for this animal since we've handled it
+            continue
+        
+        # Regular processing for animals with different singular and plural forms
+        text = singular_pattern.sub(lambda m: match_case(m, 'piglet'), text)
+        text = plural_pattern.sub(lambda m: match_case(m, 'piglet', True), text)
+    
+    return text
@@ -0,0 +1,125 @@
+"""
+Server mode for the piglet console application.
+
+A long-running server keeps the animal matcher compiled and processes the
+requests of many short-lived clients.
+"""
+import logging
+import os
+import socket
+import socketserver
+
+from piglet_engine import _get_animal_matcher, replace_animals_with_piglet
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handle one request sent to the server.
+
+    A request is a header line, either "FILE <path>" or "TEXT <length>"
+    followed by that many bytes of UTF-8 text. The reply is "OK <length>"
+    followed by the processed text, or "ERROR <message>".
+    """
+
+    def handle(self):
+        header = self.rfile.readline().decode('utf-8', 'replace').rstrip('\r\n')
+        if not header:
+            return
+        command, _, argument = header.partition(' ')
+        try:
+            if command == 'FILE':
+                with open(argument, 'r', encoding='utf-8') as file:
+                    content = file.read()
+            elif command == 'TEXT':
+                content = self.rfile.read(int(argument)).decode('utf-8')
+            else:
+                raise ValueError(f"Unknown request: {header}")
+            processed_content = replace_animals_with_piglet(content).encode('utf-8')
+        except (OSError, ValueError) as e:
+            message = ' '.join(str(e).split())
+            self.wfile.write(f"ERROR {message}\n".encode('utf-8'))
+            return
+        self.wfile.write(b'OK %d\n' % len(processed_content))
+        self.wfile.write(processed_content)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A Unix socket server that handles each client in its own thread."""
+
+    daemon_threads = True
+
+
+def create_server(socket_path):
+    """
+    Create a server that processes requests sent to a Unix socket.
+
+    The animal matcher is compiled before the server is returned, so that
+    requests never pay for it. A socket file left behind by a server that
+    is no longer running is replaced.
+
+    Args:
+        socket_path (str): The path of the Unix socket
+
+    Returns:
+        socketserver.BaseServer: The server, ready for serve_forever()
+    """
+    _get_animal_matcher()
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+        else:
+            raise OSError(f"A server is already listening on {socket_path}")
+    return _Server(socket_path, _RequestHandler)
+
+
+def serve(socket_path, logger=None):
+    """
+    Process requests sent to a Unix socket until interrupted.
+
+    Args:
+        socket_path (str): The path of the Unix socket
+        logger: The logger to report to
+    """
+    logger = logger or logging.getLogger(__name__)
+    with create_server(socket_path) as server:
+        logger.info(f"Listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+    logger.info("Server stopped")
+
+
+def request_server(socket_path, path=None, text=None):
+    """
+    Have the server at a Unix socket process a file or a text.
+
+    Args:
+        socket_path (str): The path of the server's Unix socket
+        path (str): The file to process, as seen by the server
+        text (str): The text to process, if no file is given
+
+    Returns:
+        str: The processed text
+
+    Raises:
+        OSError: If the server cannot be reached
+        RuntimeError: If the server could not process the request
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        if path is not None:
+            client.sendall(f"FILE {path}\n".encode('utf-8'))
+        else:
+            data = text.encode('utf-8')
+            client.sendall(b'TEXT %d\n' % len(data) + data)
+        with client.makefile('rb') as reply:
+            status, _, argument = reply.readline().decode('utf-8').rstrip('\n').partition(' ')
+            if status != 'OK':
+                raise RuntimeError(argument or "The server closed the connection")
+            return reply.read(int(argument)).decode('utf-8')
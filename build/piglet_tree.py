@@ -0,0 +1,209 @@
+"""
+Incremental transformation of a directory tree into a mirror tree.
+
+A manifest in the output directory records the size, modification time and
+content hash of every input file, and the version of the engine and animals
+that transformed them. A later run only reads the files whose size or
+modification time changed, only rewrites those whose content changed, and
+removes the outputs of files that are gone.
+"""
+import hashlib
+import itertools
+import json
+import os
+
+from piglet_engine import ENGINE_VERSION, _cached_lexicon, matcher_fingerprint, replace_animals_with_piglet
+
+MANIFEST_NAME = ".piglet-manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _walk(directory, skip):
+    """
+    List the regular files below a directory, without following links to directories.
+
+    Args:
+        directory (str): The directory to list
+        skip (str): A real path whose subtree is left out, such as the output directory
+
+    Yields:
+        tuple: The path of each file relative to directory, with '/' as
+            separator, and its os.stat_result
+    """
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(directory, relative)) as entries:
+            for entry in entries:
+                name = f"{relative}/{entry.name}" if relative else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.realpath(entry.path) != skip:
+                        pending.append(name)
+                elif entry.is_file():
+                    yield name, entry.stat()
+
+
+def _load_manifest(path, engine):
+    """
+    Read the manifest of an output directory.
+
+    Args:
+        path (str): The manifest file
+        engine (str): The fingerprint of the engine and animals of this run
+
+    Returns:
+        dict: The records of the files, by relative path; empty if there is
+            no manifest or it was written by another engine or with other animals
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        # A damaged manifest only costs a full run
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('engine') != engine:
+        return {}
+    return manifest.get('files', {})
+
+
+def _save_manifest(path, engine, files):
+    """
+    Write a manifest, replacing the old one at once.
+
+    Args:
+        path (str): The manifest file
+        engine (str): The fingerprint of the engine and animals of this run
+        files (dict): The records of the files, by relative path
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump({'version': MANIFEST_VERSION, 'engine_version': ENGINE_VERSION, 'engine': engine,
+                   'files': files}, file, separators=(',', ':'))
+    os.replace(temporary, path)
+
+
+def _process_tree_file(path, output_path, lexicon_path=None, known_digest=None, as_single_file=False):
+    """
+    Transform one file of a tree in a worker process, unless its content is unchanged.
+
+    The output is written under a temporary name and renamed into place.
+    Errors are returned instead of raised, so that a failing file does not
+    stop the rest of the tree.
+
+    Args:
+        path (str): The file to process
+        output_path (str): The file to write
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+        known_digest (str): The content hash in the manifest, or None
+        as_single_file (bool): Translate line endings and end the output with
+            a newline, as piglet FILE --output does
+
+    Returns:
+        tuple: The content hash (None on failure), whether the output was
+            written, and the error message (None on success)
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        if digest == known_digest and os.path.exists(output_path):
+            return digest, False, None
+        lexicon = _cached_lexicon(lexicon_path) if lexicon_path else None
+        text = data.decode('utf-8')
+        if as_single_file:
+            # Universal newlines, as a file opened in text mode is read
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        processed_content = replace_animals_with_piglet(text, lexicon)
+        if as_single_file:
+            processed_content += '\n'
+        directory, name = os.path.split(os.path.abspath(output_path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        with open(temporary, 'wb') as file:
+            file.write(processed_content.encode('utf-8'))
+        os.replace(temporary, output_path)
+        return digest, True, None
+    except (OSError, UnicodeDecodeError) as e:
+        return None, False, str(e)
+
+
+def process_tree(input_dir, output_dir, jobs=None, logger=None, lexicon_path=None):
+    """
+    Transform every file below a directory into the same place below another one.
+
+    Each output has the processed text of its input, without a newline
+    added. Files whose size and modification time match the manifest are
+    skipped without being read.
+
+    Args:
+        input_dir (str): The directory to process
+        output_dir (str): The directory to mirror it into
+        jobs (int): The number of worker processes (default: number of CPUs)
+        logger: The logger to report progress and failed files to
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+
+    Returns:
+        int: The number of files that could not be processed
+    """
+    if logger is None:
+        # Imported here, as it is slow to import and callers usually pass a logger
+        import logging
+        logger = logging.getLogger(__name__)
+    os.makedirs(output_dir, exist_ok=True)
+    engine = matcher_fingerprint(_cached_lexicon(lexicon_path) if lexicon_path else None)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    recorded = _load_manifest(manifest_path, engine)
+
+    files = {}
+    pending = []
+    for name, status in _walk(input_dir, os.path.realpath(output_dir)):
+        if name == MANIFEST_NAME:
+            continue
+        record = recorded.get(name)
+        output_path = os.path.join(output_dir, *name.split('/'))
+        if (record is not None and record[0] == status.st_size and record[1] == status.st_mtime_ns
+                and os.path.exists(output_path)):
+            files[name] = record
+        else:
+            pending.append((name, status, output_path, record[2] if record else None))
+
+    failures = written = 0
+    jobs = min(jobs or os.cpu_count() or 1, max(len(pending), 1))
+    paths = [os.path.join(input_dir, *name.split('/')) for name, _, _, _ in pending]
+    output_paths = [output_path for _, _, output_path, _ in pending]
+    digests = [digest for _, _, _, digest in pending]
+    if jobs == 1:
+        results = map(_process_tree_file, paths, output_paths, itertools.repeat(lexicon_path), digests)
+    else:
+        # Imported here, as it is slow to import and most runs do not need it
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        chunksize = max(1, min(64, len(paths) // (jobs * 8)))
+        results = executor.map(_process_tree_file, paths, output_paths, itertools.repeat(lexicon_path), digests,
+                               chunksize=chunksize)
+    try:
+        for (name, status, _, _), (digest, changed, error) in zip(pending, results):
+            if error is not None:
+                logger.error(f"Failed to process {name}: {error}")
+                failures += 1
+                continue
+            files[name] = [status.st_size, status.st_mtime_ns, digest]
+            written += changed
+    finally:
+        if jobs > 1:
+            executor.shutdown(cancel_futures=True)
+        # Outputs of the files that are gone go as well
+        removed = 0
+        for name in recorded.keys() - files.keys() - {name for name, _, _, _ in pending}:
+            try:
+                os.unlink(os.path.join(output_dir, *name.split('/')))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        _save_manifest(manifest_path, engine, files)
+
+    logger.info(f"Processed {len(files) + failures} files: {written} written, "
+                f"{len(files) - written} unchanged, {removed} removed, {failures} failed")
+    return failures
@@ -0,0 +1,116 @@
+"""
+Watch mode for the piglet console application.
+
+A resident process keeps the animal matcher compiled, polls a file or a
+directory tree for changes, and transforms again only what changed. Saves
+that follow each other quickly, as editors often write a file in several
+steps, are handled once they have settled.
+"""
+import logging
+import os
+import threading
+
+from piglet_engine import _cached_lexicon, _get_animal_matcher
+from piglet_tree import _process_tree_file, _walk, process_tree
+
+# Seconds between two looks at the watched path
+DEFAULT_INTERVAL = 0.5
+
+# Seconds the watched path must stay unchanged before it is transformed
+DEFAULT_DEBOUNCE = 0.2
+
+
+def _snapshot(path, skip=None):
+    """
+    Describe the state of a file or of the files below a directory.
+
+    Args:
+        path (str): The watched file or directory
+        skip (str): A real path whose subtree is left out, such as the output directory
+
+    Returns:
+        The size and modification time of the file, or a dict of them by
+        relative path for a directory; None if the path does not exist
+    """
+    try:
+        if os.path.isdir(path):
+            return {name: (status.st_size, status.st_mtime_ns) for name, status in _walk(path, skip)}
+        status = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return status.st_size, status.st_mtime_ns
+
+
+def watch(path, output, logger=None, lexicon_path=None, jobs=None, interval=DEFAULT_INTERVAL,
+          debounce=DEFAULT_DEBOUNCE, stop=None):
+    """
+    Transform a file or a directory tree, then again whenever it changes, until stopped.
+
+    A directory is mirrored into the output directory as process_tree()
+    does, so only the files that changed are read and rewritten, and its
+    outputs get no newline added. A file is written to the output path like
+    piglet FILE --output writes it, unless its content is the same as the
+    last time.
+
+    Args:
+        path (str): The file or directory to watch
+        output (str): The output file, or the output directory for a directory
+        logger: The logger to report updates and failures to
+        lexicon_path (str): The lexicon file to use instead of the barnyard animals
+        jobs (int): The number of worker processes for the first pass over a
+            directory (default: number of CPUs); later passes only see a few
+            files and run in this process, where the matcher is compiled already
+        interval (float): Seconds between two looks at the path
+        debounce (float): Seconds the path must stay unchanged before it is transformed
+        stop (threading.Event): Ends watching when set (default: run until interrupted)
+
+    Returns:
+        int: The number of files that could not be processed in the last pass
+    """
+    logger = logger or logging.getLogger(__name__)
+    stop = stop or threading.Event()
+    is_directory = os.path.isdir(path)
+    skip = os.path.realpath(output) if is_directory else None
+    if lexicon_path:
+        _cached_lexicon(lexicon_path)
+    else:
+        _get_animal_matcher()
+    digest = None
+
+    def update(jobs=1):
+        nonlocal digest
+        if is_directory:
+            return process_tree(path, output, jobs, logger, lexicon_path)
+        new_digest, written, error = _process_tree_file(path, output, lexicon_path, digest, as_single_file=True)
+        if error is not None:
+            logger.error(f"Failed to process {path}: {error}")
+            return 1
+        digest = new_digest
+        if written:
+            logger.info(f"Updated {output}")
+        return 0
+
+    snapshot = _snapshot(path, skip)
+    failures = update(jobs) if snapshot is not None else 0
+    logger.info(f"Watching {path}")
+    try:
+        while not stop.wait(interval):
+            current = _snapshot(path, skip)
+            if current == snapshot:
+                continue
+            # Wait for the saves to settle before reading the files
+            settled = False
+            while not settled and not stop.wait(debounce):
+                latest = _snapshot(path, skip)
+                settled = latest == current
+                current = latest
+            if not settled:
+                break
+            snapshot = current
+            if snapshot is not None:
+                # A file that is gone for a moment is being replaced
+                failures = update()
+    except KeyboardInterrupt:
+        pass
+    logger.info("Stopped watching")
+    return failures
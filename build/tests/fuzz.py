@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Differential fuzzing of the engines against the reference implementation.
+
+Random texts, both adversarial token soups and realistic prose, are given
+to every engine and mode, and each output is compared with the output of
+piglet_reference.replace_animals_with_piglet(). A text that makes an engine
+differ is shrunk to a minimal one that still does, and reported.
+
+Run from the build directory:
+
+    python tests/fuzz.py --cases 5000 --seed 1
+    python tests/fuzz.py --engines stream,sharded --kinds adversarial
+"""
+import sys
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+from unittest.mock import patch
+
+BUILD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BUILD_DIR)
+import piglet  # noqa: E402
+import piglet_async  # noqa: E402
+import piglet_engine  # noqa: E402
+import piglet_records  # noqa: E402
+import piglet_reference  # noqa: E402
+
+# Words and pieces that exercise the plural rules, the "sheep and sheep"
+# rule, case folding ('İ', 'ı', 'ſ', the Kelvin sign) and word boundaries
+_ADVERSARIAL_TOKENS = [
+    'sheep', 'Sheep', 'SHEEP', 'ſheep', 'sheep and sheep', 'SHEEP AND Sheep', 'sheep,', 'sheep and',
+    'pig', 'pİg', 'PIGS', 'cow', 'Cows', 'chİcken', 'chicken', 'rooster', 'hen', 'hens', 'ducK', 'duck',
+    'goose', 'Goose', 'geese', 'lamb', 'goat', 'horse', 'donkey', 'mule', 'turkeys', 'rabbit', 'rabbİt',
+    'pigsheep', 'cow_', '1cow', 'écow', 'cowé', 'Kid', 'İ', 'ı',
+    'a', 'an', 'the', 'this', 'is', 'one', 'many', 'few', 'are', 'were', 'seem', 'other', 'both', 'and', 'or',
+    ',', '.', '—', '-', "'s", '_', 'x' * 30, '\n', '\r\n', '\t', '  ',
+]
+_SEPARATORS = [' ', ' ', ' ', '', '\n', ', ', ' and ', '  ', '\n\n', ' \n \n']
+
+_FILLER_WORDS = ("the farmer walked across field near barn with old gate while rain fell on green hills and "
+                 "children played by river under tall trees").split()
+_ANIMAL_WORDS = [form for pair in piglet_reference.get_barnyard_animals().items() for form in pair]
+_DETERMINERS = ['a', 'the', 'many', 'two', 'some', 'this', 'these', 'one', 'other', 'several', 'my']
+
+KINDS = ('adversarial', 'realistic')
+
+
+def adversarial_text(generator):
+    """
+    Generate a soup of the tokens that stress the rules.
+
+    Args:
+        generator (random.Random): The random generator
+
+    Returns:
+        str: The text
+    """
+    count = generator.randint(0, generator.choice([20, 60, 300]))
+    return ''.join(generator.choice(_ADVERSARIAL_TOKENS) + generator.choice(_SEPARATORS) for _ in range(count))
+
+
+def realistic_text(generator):
+    """
+    Generate paragraphs of sentences that mention animals now and then.
+
+    Args:
+        generator (random.Random): The random generator
+
+    Returns:
+        str: The text
+    """
+    paragraphs = []
+    for _ in range(generator.randint(1, 8)):
+        sentences = []
+        for _ in range(generator.randint(1, 6)):
+            words = []
+            for _ in range(generator.randint(3, 18)):
+                roll = generator.random()
+                if roll < 0.1:
+                    words.extend([generator.choice(_DETERMINERS), generator.choice(_ANIMAL_WORDS)])
+                elif roll < 0.15:
+                    words.append(generator.choice(['sheep', 'sheep and sheep', 'sheep are', 'sheep is']))
+                else:
+                    words.append(generator.choice(_FILLER_WORDS))
+            sentence = ' '.join(words)
+            if generator.random() < 0.1:
+                sentence = sentence.upper()
+            sentences.append(sentence[:1].upper() + sentence[1:] + generator.choice(['.', '!', '?', ';']))
+        paragraphs.append(' '.join(sentences))
+    return generator.choice(['\n\n', '\n', '\r\n\r\n']).join(paragraphs)
+
+
+_GENERATORS = {'adversarial': adversarial_text, 'realistic': realistic_text}
+
+
+def _chunks(text, generator):
+    """Cut a text into chunks of random sizes."""
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = generator.choice([1, 2, 3, 7, 16, 64, 1000])
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+class _MemoryCache(dict):
+    """A paragraph cache kept in a dictionary."""
+
+    def get_many(self, keys):
+        return {key: self[key] for key in keys if key in self}
+
+    def put_many(self, items):
+        self.update(items)
+
+
+class Engines:
+    """
+    The engines and modes under test, each as a function of a text.
+
+    The functions take the text and a random generator, which picks chunk
+    and shard sizes and modes, and return the output as a string. The
+    engines that read a file in text mode, like the command does by default,
+    have the line endings of their input translated.
+
+    A lexicon decides the "sheep and sheep" rule at the offset of the phrase
+    in the text it is given. The reference finds that offset in the lowered,
+    partly rewritten text, where every 'İ' before it takes two characters,
+    so texts with 'İ' are not compared for the lexicon engine.
+
+    Args:
+        directory (str): A directory for the files the engines read
+    """
+
+    # Engines whose input goes through a file read in text mode
+    TRANSLATE_NEWLINES = {'batch', 'cli'}
+    # Engines and the texts they are not compared on
+    EXCLUDED = {'lexicon': lambda text: 'İ' in text}
+
+    def __init__(self, directory):
+        self._path = os.path.join(directory, "case.txt")
+        self._lexicon = piglet_engine.Lexicon(piglet_engine.get_barnyard_animals())
+        self._transformer = piglet_engine.Transformer()
+        self._logger = logging.Logger("fuzz", logging.CRITICAL)
+        self.functions = {
+            'text': self.text,
+            'lexicon': self.lexicon,
+            'stream': self.stream,
+            'transformer': self.transformer,
+            'async': self.async_stream,
+            'bytes': self.bytes,
+            'mmap': self.mmap,
+            'spans': self.spans,
+            'sharded': self.sharded,
+            'paragraph-cache': self.paragraph_cache,
+            'batch': self.batch,
+            'records': self.records,
+            'cli': self.cli,
+            'cli-bytes': self.cli_bytes,
+        }
+
+    def _write(self, text):
+        """Write a text to the case file as UTF-8 and return its name."""
+        with open(self._path, 'wb') as file:
+            file.write(text.encode('utf-8'))
+        return self._path
+
+    def text(self, text, generator):
+        return piglet_engine.replace_animals_with_piglet(text)
+
+    def lexicon(self, text, generator):
+        return piglet_engine.replace_animals_with_piglet(text, self._lexicon)
+
+    def stream(self, text, generator):
+        return ''.join(piglet_engine.replace_animals_with_piglet_stream(_chunks(text, generator)))
+
+    def transformer(self, text, generator):
+        return ''.join(self._transformer.transform_iter(_chunks(text, generator)))
+
+    def async_stream(self, text, generator):
+        async def chunks():
+            for chunk in _chunks(text.encode('utf-8'), generator):
+                yield chunk
+
+        async def collect():
+            return b''.join([piece async for piece in piglet_async.transform_stream(chunks())])
+        return asyncio.run(collect()).decode('utf-8')
+
+    def bytes(self, text, generator):
+        return piglet_engine.replace_animals_with_piglet_bytes(text.encode('utf-8')).decode('utf-8')
+
+    def mmap(self, text, generator):
+        output = io.BytesIO()
+        piglet_engine.write_mapped_file(self._write(text), output)
+        return output.getvalue().decode('utf-8')
+
+    def spans(self, text, generator):
+        data = text.encode('utf-8')
+        pieces = []
+        position = 0
+        for offset, length, _, replacement, _ in piglet_engine.iter_animal_spans(data):
+            pieces += [data[position:offset], replacement.encode('utf-8')]
+            position = offset + length
+        pieces.append(data[position:])
+        return b''.join(pieces).decode('utf-8')
+
+    def sharded(self, text, generator):
+        output = io.BytesIO()
+        # Threads instead of processes, so that tiny shards stay cheap
+        with patch.object(concurrent.futures, 'ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor):
+            piglet_engine.write_sharded_file(self._write(text), output, jobs=2, shard_size=generator.randint(1, 64))
+        return output.getvalue().decode('utf-8')
+
+    def paragraph_cache(self, text, generator):
+        cache = _MemoryCache()
+        # Warm the cache with the paragraphs of another text, then reuse them
+        piglet_engine.replace_animals_with_piglet_cached('\n\n'.join(generator.sample(
+            text.split('\n\n'), generator.randint(0, text.count('\n\n') + 1))), cache)
+        return piglet_engine.replace_animals_with_piglet_cached(text, cache)
+
+    def batch(self, text, generator):
+        output = io.StringIO()
+        piglet_engine.process_batch([self._write(text)], jobs=1, logger=self._logger, stdout=output)
+        return output.getvalue()[:-1]
+
+    def records(self, text, generator):
+        output = io.StringIO()
+        source = io.StringIO(json.dumps({'text': text}) + '\n', newline='')
+        piglet_records.transform_records(source, output, 'text', batch_size=generator.randint(1, 4))
+        return json.loads(output.getvalue())['text']
+
+    def cli(self, text, generator):
+        return self._main([self._write(text)] + generator.choice([[], ['--stream']]))
+
+    def cli_bytes(self, text, generator):
+        return self._main([self._write(text)] + generator.choice([['--mmap'], ['--bytes']]))
+
+    def _main(self, arguments):
+        """Run piglet.main() and return its output without the final newline."""
+        output = io.BytesIO()
+        if piglet.main(arguments, stdout=output, stderr=io.StringIO()) != 0:
+            raise RuntimeError("piglet.main() failed")
+        return output.getvalue().decode('utf-8')[:-1]
+
+
+def expected_output(text, engine):
+    """
+    Compute what an engine must return for a text.
+
+    Args:
+        text (str): The text
+        engine (str): The name of the engine
+
+    Returns:
+        str: The output of the reference implementation, or None if the
+            engine is not compared on this text
+    """
+    excluded = Engines.EXCLUDED.get(engine)
+    if excluded is not None and excluded(text):
+        return None
+    if engine in Engines.TRANSLATE_NEWLINES:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return piglet_reference.replace_animals_with_piglet(text)
+
+
+def minimize(text, fails):
+    """
+    Shrink a text as long as it keeps failing.
+
+    Ever smaller slices are removed, from half the text down to single
+    characters, until no slice can be removed without the failure going.
+
+    Args:
+        text (str): A failing text
+        fails (callable): Tells whether a text still fails
+
+    Returns:
+        str: The smallest failing text found
+    """
+    size = max(len(text) // 2, 1)
+    while True:
+        removed = False
+        position = 0
+        while position < len(text):
+            candidate = text[:position] + text[position + size:]
+            if fails(candidate):
+                text = candidate
+                removed = True
+            else:
+                position += size
+        if size == 1 and not removed:
+            return text
+        if not removed:
+            size = max(size // 2, 1)
+
+
+def run(cases, seed=0, engines=None, kinds=KINDS, limit=5, report=print):
+    """
+    Compare the engines with the reference on random texts.
+
+    Args:
+        cases (int): The number of texts to generate
+        seed (int): The seed of the random generator
+        engines (list): The names of the engines to check (default: all)
+        kinds (list): The kinds of texts to generate
+        limit (int): The number of mismatches of an engine to minimize and report
+        report (callable): Receives every message
+
+    Returns:
+        dict: The number of mismatches of each engine
+    """
+    generator = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        functions = Engines(directory).functions
+        names = list(functions) if engines is None else list(engines)
+        mismatches = dict.fromkeys(names, 0)
+        for case in range(cases):
+            text = _GENERATORS[generator.choice(kinds)](generator)
+            case_seed = generator.getrandbits(32)
+            for name in names:
+                def fails(candidate):
+                    expected = expected_output(candidate, name)
+                    if expected is None:
+                        return False
+                    try:
+                        return functions[name](candidate, random.Random(case_seed)) != expected
+                    except Exception:
+                        return True
+
+                if not fails(text):
+                    continue
+                mismatches[name] += 1
+                if mismatches[name] > limit:
+                    continue
+                smallest = minimize(text, fails)
+                try:
+                    got = functions[name](smallest, random.Random(case_seed))
+                except Exception as e:
+                    got = f"{type(e).__name__}: {e}"
+                report(f"MISMATCH {name} (seed {seed}, case {case}): {smallest!r}\n"
+                       f"  expected {expected_output(smallest, name)!r}\n"
+                       f"  got      {got!r}")
+    return mismatches
+
+
+def main():
+    """
+    Run the fuzzer.
+
+    Returns:
+        int: Exit code (0 if every engine matched the reference, 1 otherwise)
+    """
+    parser = argparse.ArgumentParser(description="Compare the piglet engines with the reference implementation.")
+    parser.add_argument("--cases", type=int, default=1000, help="Number of random texts (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--engines", help="Comma-separated engines to check (default: all)")
+    parser.add_argument("--kinds", default=','.join(KINDS),
+                        help="Comma-separated kinds of texts: adversarial, realistic (default: both)")
+    parser.add_argument("--limit", type=int, default=5, help="Mismatches reported per engine (default: 5)")
+    args = parser.parse_args()
+
+    engines = args.engines.split(',') if args.engines else None
+    mismatches = run(args.cases, args.seed, engines, args.kinds.split(','), args.limit)
+    for name, count in mismatches.items():
+        print(f"{name:16} {count} mismatches")
+    return 1 if any(mismatches.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
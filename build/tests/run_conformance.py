@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Run the conformance tests with piglet.py executed in this process.
+
+The conformance tests start `python piglet.py ...` for every case, through
+subprocess.run() or subprocess.Popen(). With --in-process, those calls are
+answered by piglet.main() with captured streams instead, which saves an
+interpreter start per case; any other command still runs as a subprocess.
+Without it, the tests run unchanged.
+
+Run from the build directory, where the conformance tests expect piglet.py:
+
+    python tests/run_conformance.py --in-process ../conformance_tests/*/tests
+"""
+import sys
+import argparse
+import io
+import os
+import subprocess
+import time
+import unittest
+from unittest.mock import patch
+
+BUILD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BUILD_DIR)
+import piglet  # noqa: E402
+
+
+def _piglet_arguments(command):
+    """
+    Find the arguments of a command that runs piglet.py.
+
+    Args:
+        command: The command given to subprocess
+
+    Returns:
+        list: The arguments after piglet.py, or None for any other command
+    """
+    if (isinstance(command, (list, tuple)) and len(command) >= 2 and command[0] == sys.executable
+            and os.path.basename(str(command[1])) == "piglet.py"):
+        return [str(argument) for argument in command[2:]]
+    return None
+
+
+def run_piglet(arguments, input=None, text=False):
+    """
+    Run piglet.main() as if the command had been started with these arguments.
+
+    Args:
+        arguments (list): The command-line arguments
+        input (str or bytes): What the command reads on standard input
+        text (bool): Whether the output is returned as str instead of bytes
+
+    Returns:
+        tuple: The exit code, the standard output and the standard error
+    """
+    if isinstance(input, bytes):
+        input = input.decode('utf-8', 'surrogateescape')
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', errors='surrogateescape', write_through=True)
+    stderr = io.StringIO()
+    returncode = piglet.main(arguments, io.StringIO(input or ''), stdout, stderr)
+    stdout.flush()
+    output = stdout.buffer.getvalue()
+    if text:
+        return returncode, output.decode('utf-8', 'surrogateescape'), stderr.getvalue()
+    return returncode, output, stderr.getvalue().encode('utf-8', 'surrogateescape')
+
+
+def _is_text(kwargs):
+    """Tell whether subprocess arguments ask for text instead of bytes."""
+    return bool(kwargs.get('text') or kwargs.get('universal_newlines') or kwargs.get('encoding'))
+
+
+def _captured(returned, target, capture_output):
+    """Keep an output of a command if it is captured, or write it where it was sent, as subprocess does."""
+    if capture_output or target == subprocess.PIPE:
+        return returned
+    sink = sys.stdout if target is None else target
+    if isinstance(returned, bytes) and isinstance(sink, io.TextIOBase):
+        sink = sink.buffer
+    sink.write(returned)
+    return None
+
+
+def _outputs(stdout, stderr, kwargs, capture_output=False):
+    """
+    Arrange the outputs of a command the way its subprocess arguments ask for.
+
+    Args:
+        stdout: The standard output of the command
+        stderr: The standard error of the command
+        kwargs (dict): The keyword arguments given to subprocess
+        capture_output (bool): Whether both outputs are captured
+
+    Returns:
+        tuple: The captured standard output and standard error, or None for each one not captured
+    """
+    if kwargs.get('stderr') == subprocess.STDOUT:
+        return _captured(stdout + stderr, kwargs.get('stdout'), capture_output), None
+    return (_captured(stdout, kwargs.get('stdout'), capture_output),
+            _captured(stderr, kwargs.get('stderr'), capture_output))
+
+
+class _InProcessPopen:
+    """A stand-in for subprocess.Popen that runs piglet.main() when the output is collected."""
+
+    def __init__(self, arguments, command, kwargs):
+        self.args = command
+        self.returncode = None
+        self._arguments = arguments
+        self._kwargs = kwargs
+
+    def communicate(self, input=None, timeout=None):
+        """Run the command and return its captured standard output and standard error."""
+        if self.returncode is not None:
+            return None, None
+        self.returncode, stdout, stderr = run_piglet(self._arguments, input, _is_text(self._kwargs))
+        return _outputs(stdout, stderr, self._kwargs)
+
+    def wait(self, timeout=None):
+        """Run the command if it has not run yet and return its exit code."""
+        self.communicate()
+        return self.returncode
+
+    def poll(self):
+        """Return the exit code, running the command if it has not run yet."""
+        return self.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wait()
+        return False
+
+
+def install():
+    """
+    Replace subprocess.run() and subprocess.Popen() by in-process calls for piglet.py.
+
+    Returns:
+        list: The patches, which are started and can be stopped with stop()
+    """
+    real_run = subprocess.run
+    real_popen = subprocess.Popen
+
+    def run(command, *args, **kwargs):
+        arguments = _piglet_arguments(command)
+        if arguments is None or args:
+            return real_run(command, *args, **kwargs)
+        returncode, stdout, stderr = run_piglet(arguments, kwargs.get('input'), _is_text(kwargs))
+        result = subprocess.CompletedProcess(command, returncode,
+                                             *_outputs(stdout, stderr, kwargs, kwargs.get('capture_output', False)))
+        if kwargs.get('check'):
+            result.check_returncode()
+        return result
+
+    def popen(command, *args, **kwargs):
+        arguments = _piglet_arguments(command)
+        if arguments is None or args:
+            return real_popen(command, *args, **kwargs)
+        return _InProcessPopen(arguments, command, kwargs)
+
+    patches = [patch.object(subprocess, 'run', run), patch.object(subprocess, 'Popen', popen)]
+    for started in patches:
+        started.start()
+    return patches
+
+
+def load_tests_from(paths):
+    """
+    Collect the tests of several directories.
+
+    Each directory is loaded as its own top level, and the modules it loads
+    are forgotten before the next one, as the directories reuse module names.
+
+    Args:
+        paths (list): The test directories
+
+    Returns:
+        unittest.TestSuite: All their tests
+    """
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for path in paths:
+        path = os.path.abspath(path)
+        loaded = set(sys.modules)
+        suite.addTests(loader.discover(path, top_level_dir=path))
+        for name in set(sys.modules) - loaded:
+            module_file = getattr(sys.modules[name], '__file__', None) or ''
+            if os.path.abspath(module_file).startswith(path + os.sep):
+                del sys.modules[name]
+    return suite
+
+
+def main():
+    """
+    Run the conformance tests.
+
+    Returns:
+        int: Exit code (0 if all tests passed, 1 otherwise)
+    """
+    parser = argparse.ArgumentParser(description="Run the piglet conformance tests.")
+    parser.add_argument("paths", nargs="+", metavar="DIR", help="The directories of the conformance tests")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Run piglet.py commands by calling piglet.main() instead of starting a process")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Report every test")
+    args = parser.parse_args()
+
+    patches = install() if args.in_process else []
+    try:
+        start = time.perf_counter()
+        result = unittest.TextTestRunner(verbosity=2 if args.verbose else 1).run(load_tests_from(args.paths))
+        print(f"Ran in {time.perf_counter() - start:.3f}s{' in process' if args.in_process else ''}")
+    finally:
+        for started in patches:
+            started.stop()
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,12 +3,27 @@
 """
 Unit tests for the console application.
 """
+import argparse
+import asyncio
+import io
+import json
 import unittest
 import os
+import stat
+import subprocess
 import sys
 import tempfile
+import threading
 from unittest.mock import patch
 import piglet
+import piglet_async
+import piglet_cache
+import piglet_engine
+import piglet_matcher
+import piglet_records
+import piglet_server
+import piglet_tree
+import piglet_watch
 
 
 
@@ -67,6 +82,601 @@ class TestMainModule(unittest.TestCase):
         result = piglet.replace_animals_with_piglet(text)
         self.assertEqual(result, "The cowboy rode his piglet to the showpig competition.")
 
+    def test_replace_animals_with_piglet_irregular_plural(self):
+        """Test that irregular plurals and all-caps words are replaced in one pass."""
+        text = "GEESE chased a goose past the Sheep."
+        result = piglet.replace_animals_with_piglet(text)
+        self.assertEqual(result, "PIGLETS chased a piglet past the Piglet.")
+
+    def test_animal_matcher_compiled_once(self):
+        """Test that the animal matcher is shared between calls."""
+        piglet.replace_animals_with_piglet("cow")
+        self.assertIs(piglet_engine._get_animal_matcher(), piglet_engine._get_animal_matcher())
+
+    def test_token_index_matches_split(self):
+        """Test that the token index returns the same words as splitting the text."""
+        text = "  Many  (woolly)\tsheep were, and\n" + "x " * 300 + "other SHEEP are "
+        index = piglet.TokenIndex(text)
+        for position in [0, 3, 17, 22, 28, 40, len(text) - 10, len(text) - 4, len(text)]:
+            expected_before = [word.lower() for word in text[:position].split()[-6:]]
+            self.assertEqual(index.words_before(position), expected_before)
+            expected_after = text[position:].split()[:1]
+            self.assertEqual(index.word_after(position), expected_after[0].lower() if expected_after else None)
+            self.assertEqual(index.stripped_end(position), len(text[:position].rstrip()))
+
+    def test_replace_animals_with_piglet_sheep_context(self):
+        """Test that the context of 'sheep' decides between singular and plural."""
+        text = "Many sheep graze. The sheep and Sheep slept. Other sheep are awake."
+        result = piglet.replace_animals_with_piglet(text)
+        self.assertEqual(result, "Many piglets graze. The piglet and Piglet slept. Other piglets are awake.")
+
+    def test_lexicon(self):
+        """Test that a lexicon matches multi-word names and irregular plurals with the usual rules."""
+        lexicon = piglet.Lexicon({'guinea pig': 'guinea pigs', 'ox': 'oxen', 'moose': 'moose', 'pig': 'pigs'})
+        text = "A Guinea Pig, two GUINEA PIGS and a guinea  pig. Oxen and an ox. Then many moose, a pig-pen, not foxes."
+        self.assertEqual(piglet.replace_animals_with_piglet(text, lexicon),
+                         "A Piglet, two PIGLETS and a guinea  piglet. Piglets and an piglet. Then many piglets, "
+                         "a piglet-pen, not foxes.")
+        barnyard = piglet.Lexicon(piglet.get_barnyard_animals())
+        text = "Many sheep and the cow. " * 3000 + "A sheep and Sheep, the Geese."
+        self.assertEqual(barnyard.rewrite(text), piglet.replace_animals_with_piglet(text))
+
+    def test_load_lexicon(self):
+        """Test that lexicons are read from text, CSV and JSON files."""
+        with tempfile.TemporaryDirectory() as directory:
+            contents = {"animals.txt": "# Breeds\nalpaca\talpacas\nox\toxen\nyak\n",
+                        "animals.csv": "alpaca,alpacas\nox,oxen\nyak\n",
+                        "animals.json": '{"alpaca": "alpacas", "ox": "oxen", "yak": "yaks"}'}
+            for name, content in contents.items():
+                path = os.path.join(directory, name)
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(content)
+                lexicon = piglet.load_lexicon(path)
+                self.assertEqual(lexicon.animals, {'alpaca': 'alpacas', 'ox': 'oxen', 'yak': 'yaks'})
+            with self.assertRaises(ValueError):
+                piglet.load_lexicon(os.path.join(directory, "animals.xml"))
+
+    def test_compiled_matcher(self):
+        """Test that a compiled lexicon matches like the lexicon, and that a stale one is rejected."""
+        with tempfile.TemporaryDirectory() as directory:
+            lexicon_path = os.path.join(directory, "animals.json")
+            with open(lexicon_path, 'w', encoding='utf-8') as file:
+                json.dump({'guinea pig': 'guinea pigs', 'ox': 'oxen', 'moose': 'moose'}, file)
+            matcher_path = os.path.join(directory, "animals.pigm")
+            self.assertEqual(piglet.main(["--compile-matcher", matcher_path, "--lexicon", lexicon_path],
+                                         stderr=io.StringIO()), 0)
+            compiled = piglet.load_lexicon(matcher_path)
+            lexicon = piglet.load_lexicon(lexicon_path)
+            text = "A Guinea Pig, two GUINEA PIGS and a guinea  pig. Oxen and an ox. Then many moose."
+            self.assertEqual(piglet.replace_animals_with_piglet(text, compiled),
+                             piglet.replace_animals_with_piglet(text, lexicon))
+            self.assertEqual(compiled.animals, lexicon.animals)
+            self.assertEqual(piglet.matcher_fingerprint(compiled), piglet.matcher_fingerprint(lexicon))
+
+            barnyard_path = os.path.join(directory, "barnyard.pigm")
+            piglet_matcher.compile_matcher(barnyard_path)
+            self.assertIsNone(piglet.load_lexicon(barnyard_path))
+            with patch('piglet_matcher.matcher_fingerprint', return_value="other"):
+                with self.assertRaises(piglet_matcher.StaleMatcherError):
+                    piglet_matcher.load_matcher(barnyard_path)
+
+            status = os.stat(lexicon_path)
+            os.utime(lexicon_path, ns=(status.st_atime_ns, status.st_mtime_ns + 1))
+            with self.assertRaises(piglet_matcher.StaleMatcherError):
+                piglet_matcher.load_matcher(matcher_path)
+            stderr = io.StringIO()
+            self.assertEqual(piglet.main(["--lexicon", matcher_path, self.temp_file.name], stderr=stderr), 1)
+            self.assertIn("compile it again", stderr.getvalue())
+
+            piglet_matcher.compile_matcher(matcher_path, lexicon_path)
+            with open(matcher_path, 'rb') as file:
+                data = file.read()
+            damaged = bytearray(data)
+            damaged[-1] ^= 1
+            for content in [data[:20], data[:len(data) // 2], data[:-1], bytes(damaged)]:
+                with open(matcher_path, 'wb') as file:
+                    file.write(content)
+                with self.assertRaises(ValueError):
+                    piglet_matcher.load_matcher(matcher_path)
+                stdout, stderr = io.StringIO(), io.StringIO()
+                self.assertEqual(piglet.main(["--lexicon", matcher_path, self.temp_file.name],
+                                             stdout=stdout, stderr=stderr), 1)
+                self.assertEqual(stdout.getvalue(), "")
+                self.assertIn("compile it again", stderr.getvalue())
+
+    def test_transformer(self):
+        """Test that a transformer gives the same results for strings, bytes and chunks."""
+        text = "Many sheep and a sheep and Sheep. The pİg, the COWS and a Goose."
+        lexicon = piglet.Lexicon({'guinea pig': 'guinea pigs'})
+        cases = [(piglet.Transformer(), text, piglet.replace_animals_with_piglet(text)),
+                 (piglet.Transformer(lexicon), "A Guinea Pig and guinea pigs.", "A Piglet and piglets.")]
+        for transformer, source, result in cases:
+            self.assertEqual(transformer.transform(source), result)
+            self.assertEqual(transformer.transform_bytes(source.encode('utf-8')), result.encode('utf-8'))
+            chunks = iter([source[i:i + 5] for i in range(0, len(source), 5)])
+            self.assertEqual(''.join(transformer.transform_iter(chunks)), result)
+
+    def test_paragraph_cache(self):
+        """Test that cached paragraphs give the same result and that the cache stays bounded."""
+        paragraphs = ["Many sheep and the cow.", "A sheep and Sheep, the Geese.", "The sheep\nare here.", "Two pigs."]
+        with tempfile.TemporaryDirectory() as directory:
+            with piglet_cache.ParagraphCache(os.path.join(directory, "cache.db")) as cache:
+                for text in ["\n\n".join(paragraphs), "\n\n".join(paragraphs[::-1]), "\n\n".join(paragraphs[1:])]:
+                    self.assertEqual(piglet.replace_animals_with_piglet_cached(text, cache),
+                                     piglet.replace_animals_with_piglet(text))
+                with patch('piglet_engine._Rewriter') as mock_rewriter:
+                    piglet.replace_animals_with_piglet_cached("\n\n".join(paragraphs[1:]), cache)
+                mock_rewriter.assert_not_called()
+            with piglet_cache.ParagraphCache(os.path.join(directory, "small.db"), max_size=100) as cache:
+                piglet.replace_animals_with_piglet_cached("\n\n".join(paragraphs * 10), cache)
+                self.assertLessEqual(cache._db.execute("SELECT SUM(size) FROM paragraphs").fetchone()[0], 100)
+
+    def test_async_transform_stream(self):
+        """Test that the async API gives the same output from a stream reader and from chunks."""
+        text = "Many sheep and a sheep and Sheep. The pİg, the COWS and a Goose. \udcff " * 50
+        data = text.encode('utf-8', 'surrogateescape')
+
+        async def chunks():
+            for i in range(0, len(text), 7):
+                yield text[i:i + 7]
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            # A threshold of 0 moves all the work to the executor
+            from_reader = [piece async for piece in piglet_async.transform_stream(reader, threshold=0, chunk_size=100)]
+            from_chunks = [piece async for piece in piglet_async.transform_stream(chunks())]
+            return b''.join(from_reader), ''.join(from_chunks), await piglet_async.transform(text)
+
+        from_reader, from_chunks, whole = asyncio.run(run())
+        expected = piglet.replace_animals_with_piglet(text)
+        self.assertEqual(from_reader, expected.encode('utf-8', 'surrogateescape'))
+        self.assertEqual(from_chunks, expected)
+        self.assertEqual(whole, expected)
+
+    def test_stats(self):
+        """Test that the stats hook counts the animals and the deciding rules."""
+        text = "Many sheep and a sheep and Sheep. The cow and two cows."
+        for replace in [piglet.replace_animals_with_piglet,
+                        lambda text, stats: piglet.replace_animals_with_piglet_bytes(text.encode('utf-8'), stats)]:
+            stats = piglet.Stats()
+            replace(text, stats=stats)
+            self.assertEqual(stats.animals, {'cow': [1, 1], 'sheep': [2, 1]})
+            self.assertEqual(dict(stats.rules), {'plural-indicator': 1, 'first-sheep-and-sheep': 1,
+                                                 'capitalized-in-list': 1})
+
+    @patch('piglet.parse_arguments')
+    def test_main_stats_json(self, mock_parse_args):
+        """Test that --stats-json reports the run as JSON on stderr."""
+        mock_parse_args.return_value = argparse.Namespace(file=self.temp_file.name, stats='json')
+        with patch('sys.stdout', new_callable=io.StringIO), patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            result = piglet.main()
+        self.assertEqual(result, 0)
+        report = json.loads(stderr.getvalue().splitlines()[-1])
+        self.assertEqual(report['animals'], {'cow': {'singular': 1, 'plural': 1}})
+        self.assertEqual(report['bytes_out'], len("The piglet jumped over the moon. Piglets are animals.\n"))
+        self.assertEqual(set(report['timings']), {'read', 'transform', 'write'})
+
+    def test_main_stats_stdin(self):
+        """Test that the statistics of standard input are collected in every mode."""
+        for arguments in [[], ["--bytes"], ["--line-buffered"], ["--stream"]]:
+            stderr = io.StringIO()
+            self.assertEqual(piglet.main(["--stats-json"] + arguments + ["-"], io.StringIO("many sheep and the cow"),
+                                         io.BytesIO(), stderr), 0)
+            report = json.loads(stderr.getvalue().splitlines()[-1])
+            self.assertEqual(report['animals'], {'sheep': {'singular': 0, 'plural': 1},
+                                                 'cow': {'singular': 1, 'plural': 0}}, arguments)
+            self.assertEqual(report['bytes_in'], len("many sheep and the cow"))
+
+    def test_replace_animals_with_piglet_stream(self):
+        """Test that streaming gives the same result as processing the whole text."""
+        text = ("Many sheep and other SHEEP were near the cow. " * 20
+                + "A sheep and Sheep, the geese and a Goose.\nThe sheep is here.")
+        expected = piglet.replace_animals_with_piglet(text)
+        for size in [1, 7, 50, len(text)]:
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            result = ''.join(piglet.replace_animals_with_piglet_stream(chunks))
+            self.assertEqual(result, expected, f"Mismatch with chunks of {size} characters")
+
+        # Replaced words with 'İ' shift the phrase, before and after it is found
+        import piglet_reference
+        text = "The pİg, İPig and COWS. " * 3 + "Blacksheep and sheep pİg sheep the cow. " * 40
+        expected = piglet_reference.replace_animals_with_piglet(text)
+        self.assertEqual(piglet.replace_animals_with_piglet(text), expected)
+        for size in [3, 64]:
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual(''.join(piglet.replace_animals_with_piglet_stream(chunks)), expected)
+
+    @patch('piglet.parse_arguments')
+    def test_main_stream(self, mock_parse_args):
+        """Test that streaming mode writes the same output as whole-file mode."""
+        mock_parse_args.return_value = argparse.Namespace(file=self.temp_file.name, stream=True, chunk_size=4)
+        with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            result = piglet.main()
+        self.assertEqual(result, 0)
+        self.assertEqual(mock_stdout.getvalue(), "The piglet jumped over the moon. Piglets are animals.\n")
+
+    @patch('piglet.parse_arguments')
+    def test_main_stdin(self, mock_parse_args):
+        """Test that - reads standard input, in bulk or a line at a time."""
+        text = "The cow jumped.\nMany sheep are here.\nA goose"
+        for line_buffered, expected in [(False, "The piglet jumped.\nMany piglets are here.\nA piglet\n"),
+                                        (True, "The piglet jumped.\nMany piglets are here.\nA piglet")]:
+            mock_parse_args.return_value = argparse.Namespace(file='-', line_buffered=line_buffered, chunk_size=8)
+            with patch('sys.stdin', io.StringIO(text)), \
+                    patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+                result = piglet.main()
+            self.assertEqual(result, 0)
+            self.assertEqual(mock_stdout.getvalue(), expected)
+
+    def test_main_output_file(self):
+        """Test that --output and --in-place replace the file only when the output is complete."""
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "out.txt")
+            with open(output_path, 'w', encoding='utf-8') as file:
+                file.write("old")
+            args = argparse.Namespace(file=self.temp_file.name, output=output_path, buffer_size=8)
+            with patch('piglet.replace_animals_with_piglet', side_effect=RuntimeError("failed")):
+                self.assertEqual(piglet.main(args), 1)
+            self.assertEqual(os.listdir(directory), ["out.txt"])
+            with open(output_path, encoding='utf-8') as file:
+                self.assertEqual(file.read(), "old")
+
+            self.assertEqual(piglet.main(args), 0)
+            with open(output_path, encoding='utf-8') as file:
+                self.assertEqual(file.read(), "The piglet jumped over the moon. Piglets are animals.\n")
+            with open(output_path, 'w', encoding='utf-8') as file:
+                file.write("Two cows.\n")
+            self.assertEqual(piglet.main(argparse.Namespace(file=output_path, in_place=True)), 0)
+            with open(output_path, encoding='utf-8') as file:
+                self.assertEqual(file.read(), "Two piglets.\n")
+            self.assertEqual(os.listdir(directory), ["out.txt"])
+
+    def test_main_result_cache(self):
+        """Test that a cached output is reused for the same bytes and bypassed with --no-cache."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = os.path.join(directory, "cache")
+            output_path = os.path.join(directory, "out.txt")
+            args = argparse.Namespace(file=self.temp_file.name, output=output_path, cache_dir=cache_dir)
+            self.assertEqual(piglet.main(args), 0)
+            with patch('piglet.replace_animals_with_piglet') as mock_replace:
+                self.assertEqual(piglet.main(args), 0)
+                args.cache_hardlink = True
+                self.assertEqual(piglet.main(args), 0)
+                mock_replace.assert_not_called()
+                self.assertEqual(os.stat(output_path).st_nlink, 2)
+                args.no_cache = True
+                mock_replace.return_value = "bypassed"
+                self.assertEqual(piglet.main(args), 0)
+            with open(output_path, encoding='utf-8') as file:
+                self.assertEqual(file.read(), "bypassed\n")
+            self.assertTrue(os.stat(output_path).st_mode & stat.S_IWUSR)
+
+            # The byte modes keep line endings that the text modes translate
+            crlf_path = os.path.join(directory, "crlf.txt")
+            with open(crlf_path, 'wb') as file:
+                file.write(b"a cow\r\ntwo cows\r\n")
+            for arguments, expected in [(["--bytes"], b"a piglet\r\ntwo piglets\r\n\n"),
+                                        ([], b"a piglet\ntwo piglets\n\n")]:
+                stdout = io.BytesIO()
+                self.assertEqual(piglet.main(["--cache-dir", cache_dir] + arguments + [crlf_path], stdout=stdout,
+                                             stderr=io.StringIO()), 0)
+                self.assertEqual(stdout.getvalue(), expected)
+
+            # A batch output linked to an entry is replaced by a writable file
+            output_dir = os.path.join(directory, "batch")
+            os.makedirs(output_dir)
+            batch_output = os.path.join(output_dir, os.path.basename(self.temp_file.name))
+            linking_cache = piglet_cache.ResultCache(cache_dir, hardlink=True)
+            self.assertEqual(piglet.process_batch([self.temp_file.name], output_dir, jobs=1, cache=linking_cache), 0)
+            self.assertEqual(os.stat(batch_output).st_nlink, 2)
+
+            # A cache below its size is not looked through, and a full one drops the least recently used outputs
+            with patch('piglet_cache.os.scandir') as mock_scandir:
+                piglet_cache.ResultCache(cache_dir).evict()
+                mock_scandir.assert_not_called()
+            cache = piglet_cache.ResultCache(cache_dir, max_size=1)
+            cache.evict()
+            self.assertIsNone(cache.lookup(cache.key(self.temp_file.name, piglet.matcher_fingerprint())))
+            self.assertEqual(piglet.process_batch([self.temp_file.name], output_dir, jobs=1), 0)
+            status = os.stat(batch_output)
+            self.assertEqual(status.st_nlink, 1)
+            self.assertTrue(status.st_mode & stat.S_IWUSR)
+
+    def test_transform_records(self):
+        """Test that one field of JSON Lines and CSV records is transformed, in order and across batches."""
+        lines = ['{"id": 1, "text": "Many sheep", "note": "cow"}\n', '\n', '{"id": 2,  "text": "a pig"}\r\n',
+                 '{"id": 3, "text": 7}\n', '{"id": 4, "text": "Many sheep"}']
+        output = io.StringIO()
+        self.assertEqual(piglet_records.transform_records(io.StringIO(''.join(lines)), output, "text", batch_size=2), 5)
+        self.assertEqual(output.getvalue(), '{"id": 1, "text": "Many piglets", "note": "cow"}\n\n'
+                                            '{"id": 2, "text": "a piglet"}\r\n{"id": 3, "text": 7}\n'
+                                            '{"id": 4, "text": "Many piglets"}')
+
+        output = io.StringIO()
+        rows = 'id,text\n1,"The cow,\nthe geese"\n2,sheep\n'
+        self.assertEqual(piglet_records.transform_records(io.StringIO(rows, newline=''), output, "text", 'csv'), 2)
+        self.assertEqual(output.getvalue(), 'id,text\n1,"The piglet,\nthe piglets"\n2,piglet\n')
+        with self.assertRaises(ValueError):
+            piglet_records.transform_records(io.StringIO('{"id": 1}\n[1]\n'), io.StringIO(), "text")
+
+        stdout, stderr = io.BytesIO(), io.StringIO()
+        args = ["--field", "text", "--batch", self.temp_file.name]
+        self.assertEqual(piglet.main(args, stdout=stdout, stderr=stderr), 1)
+        self.assertEqual(stdout.getvalue(), b"")
+        self.assertIn("--field cannot be combined", stderr.getvalue())
+
+    def test_main_reentrant(self):
+        """Test that main() can run many times in one process on the streams it is given."""
+        import logging
+        handlers = list(logging.getLogger().handlers)
+        for _ in range(3):
+            stdout, stderr = io.BytesIO(), io.StringIO()
+            self.assertEqual(piglet.main(["-"], io.StringIO("Two cows."), stdout, stderr), 0)
+            self.assertEqual(stdout.getvalue(), b"Two piglets.\n")
+            self.assertIn("Processing file: -", stderr.getvalue())
+        self.assertEqual(logging.getLogger().handlers, handlers)
+        self.assertEqual(logging.getLogger('piglet').handlers, [])
+
+        # Batch results go to binary and text streams alike
+        for stdout in [io.BytesIO(), io.StringIO()]:
+            self.assertEqual(piglet.main(["--batch", self.temp_file.name, self.temp_file.name, "--jobs", "1"],
+                                         stdout=stdout, stderr=io.StringIO()), 0)
+            output = stdout.getvalue()
+            self.assertEqual(output if isinstance(output, str) else output.decode('utf-8'),
+                             "The piglet jumped over the moon. Piglets are animals.\n" * 2)
+
+        stderr = io.StringIO()
+        self.assertEqual(piglet.main(["--jobs", "0", "x.txt"], stderr=stderr), 2)
+        self.assertIn("is not a positive number", stderr.getvalue())
+
+    def test_main_bytes(self):
+        """Test that --bytes processes files and standard input without decoding them."""
+        with open(self.temp_file.name, 'ab') as file:
+            file.write(b" Two cows\xff.")
+        stdout = io.BytesIO()
+        args = argparse.Namespace(file=self.temp_file.name, bytes=True)
+        self.assertEqual(piglet.main(args, stdout=stdout, stderr=io.StringIO()), 0)
+        self.assertEqual(stdout.getvalue(), b"The piglet jumped over the moon. Piglets are animals. Two piglets\xff.\n")
+
+        stdin = io.TextIOWrapper(io.BytesIO(b"A cow\xfe and many sheep."), encoding='utf-8')
+        stdout = io.BytesIO()
+        self.assertEqual(piglet.main(["--bytes", "-"], stdin, stdout, io.StringIO()), 0)
+        self.assertEqual(stdout.getvalue(), b"A piglet\xfe and many piglets.\n")
+
+    def test_animal_spans(self):
+        """Test that the spans of the animals and their replacements rebuild the processed text."""
+        lexicon = piglet.Lexicon({'guinea pig': 'guinea pigs', 'ox': 'oxen'})
+        for text, spans_lexicon in [("Pigé and «Pig», many sheep and the Cows.", None),
+                                    ("The pİg and ſheep, then many sheep and sheep.", None),
+                                    ("Two Guinea Pigs, é an ox.", lexicon)]:
+            data = text.encode('utf-8')
+            pieces = []
+            position = 0
+            for offset, length, word, replacement, is_plural in piglet.iter_animal_spans(data, spans_lexicon):
+                self.assertEqual(data[offset:offset + length].decode('utf-8'), word)
+                self.assertEqual(is_plural, replacement.lower() == 'piglets')
+                pieces += [data[position:offset], replacement.encode('utf-8')]
+                position = offset + length
+            pieces.append(data[position:])
+            self.assertEqual(b''.join(pieces).decode('utf-8'), piglet.replace_animals_with_piglet(text, spans_lexicon))
+
+        stdin = io.TextIOWrapper(io.BytesIO("é Two COWS.".encode('utf-8')), encoding='utf-8')
+        stdout = io.BytesIO()
+        self.assertEqual(piglet.main(["--spans", "-"], stdin, stdout, io.StringIO()), 0)
+        self.assertEqual([json.loads(line) for line in stdout.getvalue().splitlines()],
+                         [{"offset": 7, "length": 4, "original": "COWS", "replacement": "PIGLETS", "plural": True}])
+
+        stdout, stderr = io.BytesIO(), io.StringIO()
+        self.assertEqual(piglet.main(["--spans", "--batch", self.temp_file.name], stdout=stdout, stderr=stderr), 1)
+        self.assertEqual(stdout.getvalue(), b"")
+        self.assertIn("--spans cannot be combined", stderr.getvalue())
+
+    def test_main_directory(self):
+        """Test that a directory is mirrored, and that a second run only redoes what changed."""
+        with tempfile.TemporaryDirectory() as directory:
+            input_dir = os.path.join(directory, "in")
+            output_dir = os.path.join(directory, "out")
+            os.makedirs(os.path.join(input_dir, "a", "b"))
+            for name, text in [("one.txt", "A cow."), ("a/b/two.txt", "Many sheep\n"), ("a/gone.txt", "A pig")]:
+                with open(os.path.join(input_dir, *name.split('/')), 'w', encoding='utf-8') as file:
+                    file.write(text)
+            args = argparse.Namespace(file=input_dir, output_dir=output_dir)
+            self.assertEqual(piglet.main(args, stderr=io.StringIO()), 0)
+            with open(os.path.join(output_dir, "a", "b", "two.txt"), encoding='utf-8') as file:
+                self.assertEqual(file.read(), "Many piglets\n")
+
+            with patch('piglet_tree.replace_animals_with_piglet') as mock_replace:
+                self.assertEqual(piglet_tree.process_tree(input_dir, output_dir, jobs=1), 0)
+                mock_replace.assert_not_called()
+
+            with open(os.path.join(input_dir, "one.txt"), 'w', encoding='utf-8') as file:
+                file.write("Two cows.")
+            os.remove(os.path.join(input_dir, "a", "gone.txt"))
+            self.assertEqual(piglet_tree.process_tree(input_dir, output_dir, jobs=1), 0)
+            with open(os.path.join(output_dir, "one.txt"), encoding='utf-8') as file:
+                self.assertEqual(file.read(), "Two piglets.")
+            self.assertFalse(os.path.exists(os.path.join(output_dir, "a", "gone.txt")))
+            self.assertEqual(piglet.main(argparse.Namespace(file=input_dir), stderr=io.StringIO()), 1)
+
+    def test_watch(self):
+        """Test that watch mode transforms a file again once its saves settle, and stops when asked."""
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "out.txt")
+            stop = threading.Event()
+            thread = threading.Thread(target=piglet_watch.watch, args=(self.temp_file.name, output_path),
+                                      kwargs=dict(interval=0.01, debounce=0.05, stop=stop))
+            thread.start()
+            try:
+                for _ in range(500):
+                    if os.path.exists(output_path):
+                        break
+                    stop.wait(0.01)
+                with open(output_path, encoding='utf-8') as file:
+                    self.assertEqual(file.read(), "The piglet jumped over the moon. Piglets are animals.\n")
+                with patch('piglet_watch._process_tree_file', wraps=piglet_watch._process_tree_file) as mock_process:
+                    for text in ["A cow.", "Two cows.", "Many sheep."]:
+                        with open(self.temp_file.name, 'w', encoding='utf-8') as file:
+                            file.write(text)
+                    for _ in range(500):
+                        with open(output_path, encoding='utf-8') as file:
+                            if file.read() == "Many piglets.\n":
+                                break
+                        stop.wait(0.01)
+                    self.assertEqual(mock_process.call_count, 1)
+            finally:
+                stop.set()
+                thread.join()
+            with open(output_path, 'rb') as file:
+                self.assertEqual(file.read(), b"Many piglets.\n")
+
+            # A watched file is written like piglet FILE --output writes it
+            with open(self.temp_file.name, 'wb') as file:
+                file.write(b"Many sheep.\r\nA cow.\r\n")
+            direct_path = os.path.join(directory, "direct.txt")
+            self.assertEqual(piglet.main([self.temp_file.name, "--output", direct_path]), 0)
+            with open(direct_path, 'rb') as file:
+                direct = file.read()
+            stop = threading.Event()
+            stop.set()
+            piglet_watch.watch(self.temp_file.name, output_path, stop=stop)
+            with open(output_path, 'rb') as file:
+                self.assertEqual(file.read(), direct)
+
+            # An output in the working directory has no directory part
+            working_directory = os.getcwd()
+            os.chdir(directory)
+            try:
+                self.assertEqual(piglet_watch.watch(self.temp_file.name, "relative.txt", stop=stop), 0)
+            finally:
+                os.chdir(working_directory)
+            with open(os.path.join(directory, "relative.txt"), 'rb') as file:
+                self.assertEqual(file.read(), direct)
+
+    def test_engines_match_reference(self):
+        """Test that every engine and mode gives the output of the reference on random texts."""
+        from tests import fuzz
+        messages = []
+        mismatches = fuzz.run(30, seed=3, report=messages.append)
+        self.assertEqual(set(mismatches.values()), {0}, "\n".join(messages))
+        self.assertEqual(fuzz.minimize("many cows and a sheep", lambda text: "cow" in text), "cow")
+
+    def test_replace_animals_with_piglet_bytes(self):
+        """Test that processing UTF-8 bytes gives the same result as processing text."""
+        for text in ["Pigé and épig, but «Pig» and the Cows are here.",
+                     "Many sheep　are here; a sheep and Sheep.",
+                     "The pİg and ſheep, then many sheep and sheep."]:
+            expected = piglet.replace_animals_with_piglet(text).encode('utf-8')
+            self.assertEqual(piglet.replace_animals_with_piglet_bytes(text.encode('utf-8')), expected)
+
+    @patch('piglet.parse_arguments')
+    def test_main_mmap(self, mock_parse_args):
+        """Test that memory-mapped mode writes the processed bytes to stdout."""
+        mock_parse_args.return_value = argparse.Namespace(file=self.temp_file.name, mmap=True)
+        output = io.BytesIO()
+        stdout = io.TextIOWrapper(output, encoding='utf-8')
+        with patch('sys.stdout', new=stdout):
+            result = piglet.main()
+        self.assertEqual(result, 0)
+        self.assertEqual(output.getvalue(), b"The piglet jumped over the moon. Piglets are animals.\n")
+
+    def test_write_sharded_file(self):
+        """Test that processing a file in shards gives the same result as one pass."""
+        text = "Many sheep and sheep. " * 40 + "The sheep is near the cows. " * 40 + "A sheep and Sheep."
+        with open(self.temp_file.name, 'w', encoding='utf-8') as file:
+            file.write(text)
+        for shard_size in [5, 64, 300]:
+            output = io.BytesIO()
+            piglet.write_sharded_file(self.temp_file.name, output, jobs=2, shard_size=shard_size)
+            self.assertEqual(output.getvalue(), piglet.replace_animals_with_piglet(text).encode('utf-8'))
+
+    def test_process_batch(self):
+        """Test that a batch is written in input order and failed files are skipped."""
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for i, text in enumerate(["A pig.", "Two cows.", "The sheep and sheep."]):
+                paths.append(os.path.join(directory, f"input{i}.txt"))
+                with open(paths[-1], 'w', encoding='utf-8') as file:
+                    file.write(text)
+            paths.insert(1, os.path.join(directory, "missing.txt"))
+            with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+                failures = piglet.process_batch(paths, jobs=2)
+            self.assertEqual(failures, 1)
+            self.assertEqual(mock_stdout.getvalue(), "A piglet.\nTwo piglets.\nThe piglet and piglet.\n")
+
+            # Options for a single file are rejected in a batch rather than ignored
+            for option in [["--in-place"], ["--output", os.path.join(directory, "out.txt")],
+                           ["--paragraph-cache", os.path.join(directory, "cache")]]:
+                stdout, stderr = io.BytesIO(), io.StringIO()
+                self.assertEqual(piglet.main(["--batch", paths[0], *option], stdout=stdout, stderr=stderr), 1)
+                self.assertEqual(stdout.getvalue(), b"")
+                self.assertIn("cannot be combined", stderr.getvalue())
+            with open(paths[0], encoding='utf-8') as file:
+                self.assertEqual(file.read(), "A pig.")
+
+    @patch('piglet.parse_arguments')
+    def test_main_batch_output_dir(self, mock_parse_args):
+        """Test that batch mode writes each file to the output directory."""
+        with tempfile.TemporaryDirectory() as directory:
+            mock_parse_args.return_value = argparse.Namespace(
+                file=None, batch=[self.temp_file.name], output_dir=directory, jobs=1)
+            result = piglet.main()
+            self.assertEqual(result, 0)
+            output_path = os.path.join(directory, os.path.basename(self.temp_file.name))
+            with open(output_path, 'r', encoding='utf-8') as file:
+                self.assertEqual(file.read(), "The piglet jumped over the moon. Piglets are animals.\n")
+
+    def test_server(self):
+        """Test that the server processes texts and files sent by clients."""
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, "piglet.sock")
+            server = piglet_server.create_server(socket_path)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                self.assertEqual(piglet_server.request_server(socket_path, text="Two cows and a pig."),
+                                 "Two piglets and a piglet.")
+                self.assertEqual(piglet_server.request_server(socket_path, path=self.temp_file.name),
+                                 "The piglet jumped over the moon. Piglets are animals.")
+                with self.assertRaises(RuntimeError):
+                    piglet_server.request_server(socket_path, path=os.path.join(directory, "missing.txt"))
+                args = argparse.Namespace(file=self.temp_file.name, socket=socket_path)
+                with patch('piglet_server.request_server', wraps=piglet_server.request_server) as mock_request, \
+                        patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+                    self.assertEqual(piglet.main(args), 0)
+                mock_request.assert_called_once()
+                self.assertEqual(mock_stdout.getvalue(), "The piglet jumped over the moon. Piglets are animals.\n")
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+    @patch('piglet.parse_arguments')
+    def test_main_socket_fallback(self, mock_parse_args):
+        """Test that the file is processed locally when no server is running."""
+        mock_parse_args.return_value = argparse.Namespace(file=self.temp_file.name, socket="/nonexistent/piglet.sock")
+        with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            result = piglet.main()
+        self.assertEqual(result, 0)
+        self.assertEqual(mock_stdout.getvalue(), "The piglet jumped over the moon. Piglets are animals.\n")
+
+        # Statistics are collected locally, even with a server running
+        with patch('piglet_server.request_server') as mock_request:
+            stderr = io.StringIO()
+            self.assertEqual(piglet.main(argparse.Namespace(file=self.temp_file.name, socket="piglet.sock",
+                                                            stats='json'), stdout=io.BytesIO(), stderr=stderr), 0)
+            mock_request.assert_not_called()
+        self.assertEqual(json.loads(stderr.getvalue().splitlines()[-1])['animals'],
+                         {'cow': {'singular': 1, 'plural': 1}})
+
+        # A server that cannot process the file leaves it to this process
+        with patch('piglet_server.request_server', side_effect=RuntimeError("Permission denied")):
+            stdout = io.BytesIO()
+            self.assertEqual(piglet.main(argparse.Namespace(file=self.temp_file.name, socket="piglet.sock"),
+                                         stdout=stdout, stderr=io.StringIO()), 0)
+        self.assertEqual(stdout.getvalue(), b"The piglet jumped over the moon. Piglets are animals.\n")
+
     @patch('sys.stdout', new_callable=tempfile.TemporaryFile)
     @patch('piglet.parse_arguments')
     def test_main_output(self, mock_parse_args, mock_stdout):
@@ -102,6 +712,10 @@ class TestMainModule(unittest.TestCase):
         with patch('sys.argv', ['piglet.py', self.temp_file.name]):
             args = piglet.parse_arguments()
             self.assertEqual(args.file, self.temp_file.name)
+        for option in ["--chunk-size", "--shard-size", "--buffer-size"]:
+            stderr = io.StringIO()
+            self.assertEqual(piglet.main([option, "0", self.temp_file.name], stdout=io.StringIO(), stderr=stderr), 2)
+            self.assertIn("not a positive number", stderr.getvalue())
 
     @patch('argparse.ArgumentParser.parse_args')
     def test_parse_arguments_called(self, mock_parse_args):
@@ -128,6 +742,17 @@ class TestMainModule(unittest.TestCase):
 
         mock_setup_logging.assert_called_once()
 
+    def test_startup_imports(self):
+        """Test that a plain run does not import modules that only some modes need."""
+        code = ("import sys, piglet; sys.argv = ['piglet.py', 'file.txt']; piglet.parse_arguments(); "
+                "print(' '.join(sorted(sys.modules)))")
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(piglet.__file__)))
+        modules = result.stdout.split()
+        self.assertIn('piglet_engine', modules)
+        for module in ['concurrent.futures', 'shutil', 'socket', 'socketserver', 'piglet_server']:
+            self.assertNotIn(module, modules)
+
     @patch('piglet.main')
     def test_sys_exit_called_with_main_result(self, mock_main):
         """Test that sys.exit is called with the result of main()."""